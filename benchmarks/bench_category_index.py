@@ -0,0 +1,65 @@
+# encoding: utf-8
+
+"""Benchmark of category lookup and range parsing with 100k categories.
+
+Times building a category_index.CategoryIndex over 100k names, and
+substring, prefix and glob queries on it. tests/test_category_index.py
+checks their results against fnmatch. Then times Terminal.parse_uint_list on
+'1:50000' with unique=True. The terminal interface only runs under
+python 2, so that part is skipped under python 3.
+
+    python benchmarks/bench_category_index.py [number of categories]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from category_index import CategoryIndex
+
+WORDS = ['chemistry', 'physics', 'biology', 'history', 'algebra', 'geometry', 'music', 'art']
+QUERIES = ['chem', 'chemistry bio', 'chemistry biology 99', 'chem*', '*bio* 12?', 'c', '[ab]rt*']
+
+
+def make_names(n):
+    random.seed(1)
+    return ['{} {} {}'.format(random.choice(WORDS), random.choice(WORDS), i) for i in range(n)]
+
+def timed(f, *args):
+    t = time.time()
+    result = f(*args)
+    return result, time.time() - t
+
+
+def bench_index(n):
+    names = make_names(n)
+    index, t = timed(CategoryIndex, names)
+    print("CategoryIndex of {} names: built in {:.3f}s".format(n, t))
+    for query in QUERIES:
+        # Time each query on its own, not as a refinement of the one before
+        index.last_query = None
+        result, t = timed(index.search, query)
+        print("  {:<24} {:>6} matches {:>8.1f}ms".format(repr(query), len(result), 1000 * t))
+
+def bench_uint_list():
+    try:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'interfaces'))
+        from terminal import Terminal
+    except (ImportError, SyntaxError):
+        print("parse_uint_list: skipped, the terminal interface needs python 2")
+        return True
+    terminal = Terminal.__new__(Terminal)
+    result, t = timed(terminal.parse_uint_list, '1:50000', True)
+    print("parse_uint_list('1:50000', unique=True): {} values in {:.1f}ms".format(len(result), 1000 * t))
+    return result == list(range(1, 50001))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bench_index(n)
+    sys.exit(0 if bench_uint_list() else 1)
@@ -0,0 +1,130 @@
+# encoding: utf-8
+
+"""Benchmark of parsing compressed quiz files against plain ones,
+on a cold page cache.
+
+Makes .gz, .bz2 and .xz copies of a quiz file (a generated bank of
+20k questions if none is given), and parses each one with parser.parse
+in a fresh process, after evicting the file from the page cache. Prints
+the wall time of the parse, and the bytes it read from the disk, as
+counted in /proc/self/io.
+
+The cache is dropped system wide through /proc/sys/vm/drop_caches when
+running as root, and otherwise just for the file with posix_fadvise
+(python 3 only). Without either, the numbers are for a warm cache.
+Bytes read are only counted on Linux.
+
+    python benchmarks/bench_compressed.py [quiz file]
+"""
+
+from __future__ import print_function
+
+import bz2
+import gzip
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+WORDS = 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau'.split()
+
+
+def generate(path, n=20000):
+    random.seed(0)
+    with open(path, 'w') as f:
+        for c in range(n // 50):
+            f.write('Category {}\n'.format(c))
+            for i in range(50):
+                f.write('?Question {} {}\n'.format(c * 50 + i, ' '.join(random.choice(WORDS) for _ in range(8))))
+                f.write('Answer {}\n'.format(' '.join(random.choice(WORDS) for _ in range(10))))
+            f.write('\n')
+
+def compress(path, directory):
+    """Returns the path of path itself, and of its compressed copies in directory.
+    """
+    openers = [('.gz', gzip.open), ('.bz2', bz2.BZ2File)]
+    try:
+        import lzma
+        openers.append(('.xz', lzma.open))
+    except ImportError:
+        pass
+    paths = [path]
+    for extension, opener in openers:
+        target = os.path.join(directory, os.path.basename(path) + extension)
+        with open(path, 'rb') as f, opener(target, 'wb') as out:
+            shutil.copyfileobj(f, out)
+        paths.append(target)
+    return paths
+
+def drop_cache(path):
+    """Evicts path from the page cache. Returns how, or None if it could not.
+    """
+    try:
+        subprocess.call(['sync'])
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return 'drop_caches'
+    except (IOError, OSError):
+        pass
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return 'fadvise'
+    return None
+
+def read_bytes():
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines() if line)
+    except IOError:
+        return None
+    return int(counters['read_bytes'])
+
+def child(path):
+    """Parses path, and prints the wall time and the bytes read.
+    """
+    from parser import parse
+    # Imported now, so that reading the modules is not counted
+    import course
+    before = read_bytes()
+    t = time.time()
+    categories = parse(path)
+    t = time.time() - t
+    after = read_bytes()
+    n = sum(len(category) for category in categories)
+    print(n, t, -1 if before is None else after - before)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+        sys.exit(0)
+
+    directory = tempfile.mkdtemp()
+    try:
+        if len(sys.argv) > 1:
+            source = sys.argv[1]
+        else:
+            source = os.path.join(directory, 'bank.ep')
+            generate(source)
+        print("{:<20} {:>12} {:>10} {:>8} {:>14}  {}".format(
+              'file', 'size', 'questions', 'parse', 'read from disk', 'cache'))
+        for path in compress(source, directory):
+            how = drop_cache(path)
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', path])
+            n, t, n_bytes = out.split()
+            print("{:<20} {:>10.2f}MB {:>10} {:>7.2f}s {:>12.2f}MB  {}".format(
+                  os.path.basename(path), os.path.getsize(path) / 1e6, int(n), float(t),
+                  int(n_bytes) / 1e6 if int(n_bytes) >= 0 else float('nan'), how or 'warm'))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+"""Benchmark of importing a CSV file, in rows per second.
+
+Writes a CSV file of generated flashcards (100k rows if no number is
+given), some of whose fields need escaping or span several lines. Times
+turning it into a quiz file with importer.write_ep, and into categories
+with importer.load, and parsing the quiz file written with parser.parse.
+Prints the rows per second of each.
+
+    python benchmarks/bench_importer.py [number of rows]
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from importer import load, read_rows, write_ep
+from parser import parse
+
+WORDS = 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau'.split()
+# Starts of lines that the quiz file has to escape
+SYNTAX = [u'?', u'%', u'[', u'INCLUDE:', u'\\']
+
+
+def text(n):
+    return u' '.join(random.choice(WORDS) for _ in range(n))
+
+def field():
+    """Mostly plain text, sometimes with a line that needs escaping,
+    or paragraphs separated by a blank line.
+    """
+    r = random.random()
+    if r < 0.1:
+        return random.choice(SYNTAX) + text(6)
+    if r < 0.2:
+        return text(8) + u'\n\n' + text(8)
+    return text(random.randint(4, 16))
+
+def generate(path, n):
+    random.seed(0)
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(u'deck,front,back\r\n')
+        for i in range(n):
+            row = [u'Deck {}'.format(i // 100), field(), field()]
+            f.write(u','.join(u'"' + value.replace(u'"', u'""') + u'"' for value in row) + u'\r\n')
+
+def timed(name, n, run):
+    t = time.time()
+    run()
+    t = time.time() - t
+    print("{:<28} {:>7.2f}s {:>10.0f} rows/s".format(name, t, n / max(t, 1e-9)))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'deck.csv')
+        target = os.path.join(directory, 'deck.ep')
+        generate(source, n)
+        print("{} rows, {:.1f} MB of CSV".format(n, os.path.getsize(source) / 1e6))
+
+        def convert():
+            with io.open(target, 'w', encoding='utf-8') as out:
+                write_ep(read_rows(source), out)
+        timed('read_rows + write_ep', n, convert)
+        timed('importer.load', n, lambda: load(source))
+        timed('parser.parse of the quiz file', n, lambda: parse(target))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,97 @@
+# encoding: utf-8
+
+"""Fast lookup of categories by name, for picking a few out of
+thousands of categories.
+
+Substring queries search all lowercase names joined into one string,
+which str.find scans at C speed, and map hits back to names through
+their start offsets. Prefix queries use a sorted list of the names.
+Queries extending the previous query are filtered from the previous
+result, so typing a filter one character at a time stays cheap.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from fnmatch import translate
+
+RE_GLOB_SPECIAL = re.compile(r'[*?\[\]]')
+RE_GLOB_WILDCARD = re.compile(r'\*|\?|\[[^\]]*\]?')
+
+
+class CategoryIndex(object):
+    """Index over a list of category names.
+    All methods return ascending lists of indices into the list.
+    Matching ignores case.
+    """
+
+    def __init__(s, names):
+        s.names = [name.lower() for name in names]
+        s.sorted_names = sorted((name, i) for i, name in enumerate(s.names))
+        # Names are single lines, so a newline never occurs inside one
+        s.text = '\n'.join(s.names) + '\n'
+        s.starts = []
+        start = 0
+        for name in s.names:
+            s.starts.append(start)
+            start += len(name) + 1
+        s.starts.append(start)
+        s.last_query = None
+        s.last_result = None
+
+    def __len__(s):
+        return len(s.names)
+
+    def all(s):
+        return list(range(len(s.names)))
+
+    def prefix(s, text):
+        """Indices of names starting with text.
+        """
+        text = text.lower()
+        out = []
+        for name, i in s.sorted_names[bisect_left(s.sorted_names, (text, -1)):]:
+            if not name.startswith(text):
+                break
+            out.append(i)
+        return sorted(out)
+
+    def substring(s, text):
+        """Indices of names containing text.
+        """
+        text = text.lower()
+        if '\n' in text:
+            return []
+        if not text:
+            # Found everywhere, also past the last name
+            return s.all()
+        if s.last_query is not None and s.last_query in text:
+            result = [i for i in s.last_result if text in s.names[i]]
+        else:
+            result = []
+            pos = s.text.find(text)
+            while pos != -1:
+                i = bisect_right(s.starts, pos) - 1
+                result.append(i)
+                pos = s.text.find(text, s.starts[i+1])
+        s.last_query, s.last_result = text, result
+        return result
+
+    def glob(s, pattern):
+        """Indices of names matching the shell style pattern, e.g. 'chem*'.
+        The longest literal part of the pattern narrows down the candidates.
+        """
+        pattern = pattern.lower()
+        if pattern.endswith('*') and not RE_GLOB_SPECIAL.search(pattern[:-1]):
+            return s.prefix(pattern[:-1])
+        regex = re.compile(translate(pattern))
+        literal = max(RE_GLOB_WILDCARD.split(pattern), key=len)
+        candidates = s.substring(literal) if literal else s.all()
+        return [i for i in candidates if regex.match(s.names[i])]
+
+    def search(s, query):
+        """Glob match if query contains glob characters,
+        otherwise substring match.
+        """
+        if RE_GLOB_SPECIAL.search(query):
+            return s.glob(query)
+        return s.substring(query)
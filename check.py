@@ -0,0 +1,177 @@
+# encoding: utf-8
+
+"""Checks quiz files for mistakes that would otherwise only show up
+in the middle of a quiz:
+
+    errors:    questions without an answer, media names with an unmatched
+               bracket, missing media files, missing included files
+    warnings:  categories without any questions
+
+Every quiz file under a directory is checked, in parallel. Run
+    python check.py path/to/quizzes
+or
+    python examprepper.py --check path/to/quizzes
+It prints one line per problem, with file and line number, and exits
+with a non-zero status if there are errors, so it can gate commits.
+Media are looked for in ./media next to each quiz file, or in the folder
+given with -m, as when running a quiz.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os.path import dirname, isabs, isfile, join, normpath
+
+from parser import LineParser, open_quiz_file, unescape
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class Diagnostic(object):
+    def __init__(s, path, line_number, severity, message):
+        s.path = path
+        s.line_number = line_number
+        s.severity = severity
+        s.message = message
+
+    def __str__(s):
+        return '{}:{}: {}: {}'.format(s.path, s.line_number, s.severity, s.message)
+
+
+def unmatched_bracket(line):
+    """Whether the media names at the start of line lack a closing bracket.
+    """
+    while line.startswith('['):
+        n = line.find(']')
+        if n == -1:
+            return True
+        line = line[n+1:]
+    return False
+
+
+class CheckingLineParser(LineParser):
+    """A LineParser that records what it discards, and other
+    problems, as Diagnostics.
+    """
+
+    def __init__(s, path):
+        LineParser.__init__(s, collect_diagnostics=True)
+        s.path = path
+        s.diagnostics = []
+
+    def report(s, line_number, severity, message):
+        s.diagnostics.append(Diagnostic(s.path, line_number, severity, message))
+
+    def parse_line(s, line):
+        LineParser.parse_line(s, line)
+        if s.qa_buffer and s.qa_buffer[-1] is line:
+            text, escaped = unescape(line[1:] if s.building_question else line, s.escapes)
+            if not escaped and unmatched_bracket(text):
+                s.report(s.line_number, ERROR, "Media name without a closing bracket: {}".format(line.strip()))
+
+    def store_discarded_qa(s):
+        if len(s.qa_buffer) > 0:
+            s.report(s.qa_line_number, ERROR, "Question without an answer: {}".format(s.qa_buffer[0].strip()))
+        LineParser.store_discarded_qa(s)
+
+    def store_discarded_category(s, category):
+        # The implicit category before the first named one has no line number
+        if getattr(category, 'line_number', None) is not None:
+            s.report(category.line_number, WARNING, "Category without questions: {}".format(category.name))
+        LineParser.store_discarded_category(s, category)
+
+    def flush_qa(s):
+        try:
+            LineParser.flush_qa(s)
+        except AssertionError:
+            s.report(s.qa_line_number, ERROR, "Question without an answer: {}".format(s.qa_buffer[0].strip()))
+            s.clear()
+
+
+def check_file(path, media_path_rel='./media'):
+    """Returns a list of Diagnostics for the quiz file in path.
+    """
+    p = CheckingLineParser(path)
+    try:
+        with open_quiz_file(path) as f:
+            for line in f:
+                p.parse_line(line)
+            p.close()
+    except (IOError, EOFError, UnicodeDecodeError) as e:
+        return [Diagnostic(path, 0, ERROR, "Could not read the file: {}".format(e))]
+
+    media_folder = normpath(join(dirname(path), media_path_rel))
+    for category in p.categories:
+        for qa in category:
+            for media in (qa.question_media or []) + (qa.answer_media or []):
+                media_path = media if isabs(media) else join(media_folder, media)
+                if not isfile(media_path):
+                    p.report(qa.line_number, ERROR, "Missing media file: {}".format(media_path))
+    for position, include, line_number in p.includes:
+        include_path = normpath(join(dirname(path), include))
+        if not isfile(include_path):
+            p.report(line_number, ERROR, "Missing included file: {}".format(include_path))
+
+    return sorted(p.diagnostics, key=lambda d: d.line_number or 0)
+
+def find_quiz_files(directory):
+    """Returns the paths of all quiz files under directory, sorted.
+    """
+    from examprepper import is_ep_file
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        found.extend(join(root, f) for f in sorted(files) if is_ep_file(f))
+    return found
+
+def check_paths(paths, processes=None, media_path_rel='./media'):
+    """Checks the quiz files in paths, using a pool of processes
+    when there is more than one. Returns a list of Diagnostics.
+    """
+    if len(paths) <= 1:
+        results = [check_file(path, media_path_rel) for path in paths]
+    else:
+        processes = processes or cpu_count()
+        pool = Pool(processes)
+        try:
+            results = pool.map(partial(check_file, media_path_rel=media_path_rel), paths,
+                               chunksize=max(1, len(paths) // (4 * processes)))
+        finally:
+            pool.close()
+            pool.join()
+    return [d for diagnostics in results for d in diagnostics]
+
+def check(path, processes=None, out=None, media_path_rel='./media'):
+    """Checks the quiz file in path, or every quiz file under it if it is
+    a directory, and prints the problems found. Media are looked for in
+    media_path_rel, relative to each quiz file, as when running a quiz.
+    Returns the number of errors.
+    """
+    out = out or sys.stdout
+    paths = find_quiz_files(path) if os.path.isdir(path) else [path]
+    diagnostics = check_paths(paths, processes, media_path_rel)
+    for d in diagnostics:
+        print(d, file=out)
+    n_errors = sum(1 for d in diagnostics if d.severity == ERROR)
+    print("Checked {} quiz files: {} errors, {} warnings.".format(
+          len(paths), n_errors, len(diagnostics) - n_errors), file=out)
+    return n_errors
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="Check quiz files for mistakes")
+    argparser.add_argument("path", nargs='?', default='.',
+                           help="Quiz file, or directory to search for quiz files. Defaults to the current directory.")
+    argparser.add_argument("-j", "--jobs", dest="processes", type=int, default=None,
+                           help="Number of processes. Defaults to the number of CPUs.")
+    argparser.add_argument("-m", "--media", dest="media_path", default="./media",
+                           help="Media folder, relative to each quiz file, or absolute. Defaults to ./media.")
+    args = argparser.parse_args()
+
+    sys.exit(1 if check(args.path, args.processes, media_path_rel=args.media_path) else 0)
@@ -0,0 +1,347 @@
+# encoding: utf-8
+
+"""A columnar binary format for quiz banks (.epc).
+
+The .ep text format is meant for writing quizzes. The columnar format
+is meant for loading them quickly, and for analysing them with numpy.
+A file holds these sections, each one a flat little-endian array:
+
+    question_text, answer_text    utf-8 text of all questions/answers, back to back
+    question_offsets,             uint64, n+1 offsets into the text arenas;
+    answer_offsets                question i is question_text[offsets[i]:offsets[i+1]]
+    media_text, media_offsets     utf-8 media file names, back to back, and m+1 offsets
+    question_media_offsets,       uint64, n+1 offsets into the list of media names;
+    answer_media_offsets          question i has media answer_media_offsets[i]
+                                  up to question_media_offsets[i+1], and its
+                                  answer the media from there to answer_media_offsets[i+1]
+    line_numbers                  uint32, the line each question starts on (0 if unknown)
+    category_text,                utf-8 category names, and c+1 offsets
+    category_offsets
+    category_qa_offsets           uint64, c+1 offsets; category j holds the
+                                  question-answers category_qa_offsets[j:j+2]
+    category_line_numbers         uint32, the line each category is named on (0 if unknown)
+    include_text, include_offsets utf-8 paths of include directives that were not
+                                  followed, and i+1 offsets
+    include_positions             uint64, i offsets; include k goes before category
+                                  include_positions[k]
+    include_line_numbers          uint32, the line of each include directive
+    source_digest                 utf-8 sha1 of the quiz file the sections were
+                                  parsed from, if known
+
+Files converted with export() follow include directives, so they have none.
+Files written by course.CourseLoader as a cache of a parse have them.
+Files without the include and source sections, from before they were added,
+are read as having none.
+
+The sections are followed by a JSON table of their positions, the
+length of the table as uint64, and MAGIC.
+
+Writing streams every column to its own temporary file while the quiz is
+parsed, so quizzes larger than memory can be converted.
+"""
+
+import io
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+import numpy as np
+from os.path import abspath, dirname, isfile, join, normpath
+
+from parser import LineParser, IncludeError, open_quiz_file
+from quiz_handler import Category, QuestionAnswer
+
+MAGIC = b'EPCOL\x00v1'
+ALIGNMENT = 8
+
+COLUMN_DTYPES = {
+    'question_text': '<u1',
+    'answer_text': '<u1',
+    'media_text': '<u1',
+    'category_text': '<u1',
+    'question_offsets': '<u8',
+    'answer_offsets': '<u8',
+    'media_offsets': '<u8',
+    'question_media_offsets': '<u8',
+    'answer_media_offsets': '<u8',
+    'line_numbers': '<u4',
+    'category_offsets': '<u8',
+    'category_qa_offsets': '<u8',
+    'category_line_numbers': '<u4',
+    'include_text': '<u1',
+    'include_offsets': '<u8',
+    'include_positions': '<u8',
+    'include_line_numbers': '<u4',
+    'source_digest': '<u1',
+}
+FORMATS = {'<u8': '<Q', '<u4': '<I'}
+
+
+def to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+def to_text(data):
+    """Inverse of to_bytes. Under python 2, parser.parse returns byte strings,
+    so they are kept as such.
+    """
+    if str is bytes:
+        return data
+    return data.decode('utf-8')
+
+
+class ColumnWriter(object):
+    """Writes question-answers and categories column by column
+    into temporary files, and joins them into one file on close().
+    If in_memory is True, the columns are kept in memory instead, which
+    is quicker for quizzes that are in memory already.
+    """
+
+    def __init__(s, file_path, in_memory=False):
+        s.file_path = file_path
+        s.columns = dict((name, io.BytesIO() if in_memory else tempfile.TemporaryFile())
+                         for name in COLUMN_DTYPES)
+        s.sizes = dict((name, 0) for name in COLUMN_DTYPES)
+        s.n_qas = 0
+        s.n_media = 0
+        for name in ['question_offsets', 'answer_offsets', 'media_offsets',
+                     'question_media_offsets', 'answer_media_offsets',
+                     'category_offsets', 'category_qa_offsets', 'include_offsets']:
+            s.write_number(name, 0)
+
+    def write_number(s, name, value):
+        s.columns[name].write(struct.pack(FORMATS[COLUMN_DTYPES[name]], value))
+
+    def write_text(s, name, text):
+        """Appends text to a text column, and its end to the matching offsets.
+        """
+        data = to_bytes(text)
+        s.columns[name + '_text'].write(data)
+        s.sizes[name + '_text'] += len(data)
+        s.write_number(name + '_offsets', s.sizes[name + '_text'])
+
+    def add_qa(s, qa):
+        s.write_text('question', qa.question)
+        s.write_text('answer', qa.answer)
+        for kind in ['question', 'answer']:
+            for media in getattr(qa, kind + '_media') or []:
+                s.write_text('media', media)
+                s.n_media += 1
+            s.write_number(kind + '_media_offsets', s.n_media)
+        s.write_number('line_numbers', qa.line_number or 0)
+        s.n_qas += 1
+
+    def add_category(s, name, line_number=None):
+        """Closes a category holding every question-answer added
+        since the previous category.
+        """
+        s.write_text('category', name)
+        s.write_number('category_qa_offsets', s.n_qas)
+        s.write_number('category_line_numbers', line_number or 0)
+
+    def add_include(s, position, path, line_number):
+        """Records an include directive that goes before category number position.
+        """
+        s.write_text('include', path)
+        s.write_number('include_positions', position)
+        s.write_number('include_line_numbers', line_number)
+
+    def set_source_digest(s, digest):
+        s.columns['source_digest'].write(to_bytes(digest))
+
+    def close(s):
+        table = dict()
+        with open(s.file_path, 'wb') as out:
+            out.write(MAGIC)
+            for name in sorted(s.columns):
+                column = s.columns[name]
+                offset = out.tell()
+                column.seek(0)
+                shutil.copyfileobj(column, out)
+                length = out.tell() - offset
+                column.close()
+                out.write(b'\x00' * (-out.tell() % ALIGNMENT))
+                itemsize = np.dtype(COLUMN_DTYPES[name]).itemsize
+                table[name] = [offset, length // itemsize, COLUMN_DTYPES[name]]
+            data = to_bytes(json.dumps(table, sort_keys=True))
+            out.write(data)
+            out.write(struct.pack('<Q', len(data)))
+            out.write(MAGIC)
+
+
+class StreamingLineParser(LineParser):
+    """A LineParser that hands question-answers and categories to a
+    ColumnWriter as soon as they are parsed, instead of keeping them.
+    """
+
+    def __init__(s, writer, unique=False, file_path=None, media_path_rel='./media', stack=()):
+        """file_path is the file being parsed, which include directives
+        are relative to. stack holds the files including it; media paths
+        of included files are resolved relative to media_path_rel next to them.
+        """
+        LineParser.__init__(s, unique=unique)
+        s.writer = writer
+        s.current_count = 0
+        s.file_path = abspath(file_path) if file_path else None
+        s.media_path_rel = media_path_rel
+        s.stack = stack
+        s.media_folder = None
+        if stack:
+            s.media_folder = normpath(join(dirname(s.file_path), media_path_rel))
+
+    def add_qa(s, qa):
+        if s.media_folder is not None:
+            qa.question_media = [join(s.media_folder, m) for m in qa.question_media or []]
+            qa.answer_media = [join(s.media_folder, m) for m in qa.answer_media or []]
+        s.writer.add_qa(qa)
+        s.current_count += 1
+
+    def include(s, path):
+        """Streams the included file through a parser of its own.
+        """
+        s.flush_category()
+        path = normpath(join(dirname(s.file_path or abspath('.')), path))
+        stack = s.stack + (s.file_path,)
+        if path in stack:
+            raise IncludeError("Include cycle: {}".format(' -> '.join(stack[stack.index(path):] + (path,))))
+        if not isfile(path):
+            raise IncludeError("{}, line {}: included file {} does not exist.".format(
+                               s.file_path, s.line_number, path))
+        p = StreamingLineParser(s.writer, unique=s.unique, file_path=path,
+                                media_path_rel=s.media_path_rel, stack=stack)
+        p.seen_fingerprints = s.seen_fingerprints
+        with open_quiz_file(path) as f:
+            for line in f:
+                p.parse_line(line)
+            p.close()
+
+    def flush_category(s, new_category_name=None):
+        if s.current_count > 0:
+            s.writer.add_category(s.current_category.name,
+                                  getattr(s.current_category, 'line_number', None))
+        else:
+            s.store_discarded_category(s.current_category)
+        s.current_count = 0
+
+        if new_category_name:
+            s.current_category = Category(new_category_name)
+            s.current_category.line_number = s.line_number
+        else:
+            s.current_category = Category('Default')
+
+
+def export(lines, file_path, unique=False, source_path=None, media_path_rel='./media'):
+    """Parses the quiz text in lines (e.g. an open .ep file),
+    and writes it to file_path in the columnar format.
+    Only the columns being written are held in memory, one item at a time.
+    Include directives are followed relative to source_path, the path
+    of the quiz file, and media of included files are resolved relative
+    to media_path_rel next to them.
+    """
+    writer = ColumnWriter(file_path)
+    p = StreamingLineParser(writer, unique=unique, file_path=source_path,
+                            media_path_rel=media_path_rel)
+    for line in lines:
+        p.parse_line(line)
+    p.close()
+    writer.close()
+
+def export_categories(categories, file_path, includes=(), source_digest=None):
+    """Writes an already parsed list of categories to file_path.
+    includes is a list of (position in categories, path, line number)
+    of include directives that were not followed, as in LineParser.includes.
+    """
+    writer = ColumnWriter(file_path, in_memory=True)
+    for category in categories:
+        for qa in category:
+            writer.add_qa(qa)
+        writer.add_category(category.name, getattr(category, 'line_number', None))
+    for position, path, line_number in includes:
+        writer.add_include(position, path, line_number)
+    if source_digest is not None:
+        writer.set_source_digest(source_digest)
+    writer.close()
+
+
+def read_table(f):
+    f.seek(-16, 2)
+    length, magic = struct.unpack('<Q8s', f.read(16))
+    if magic != MAGIC:
+        raise ValueError("{} is not a columnar quiz file.".format(f.name))
+    f.seek(-16 - length, 2)
+    return json.loads(f.read(length).decode('utf-8'))
+
+def load_arrays(file_path):
+    """Returns a dict of numpy arrays, one per column, memory mapped
+    from file_path. Nothing is read before it is used.
+    """
+    with open(file_path, 'rb') as f:
+        table = read_table(f)
+    return dict((name, np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(count,)))
+                for name, (offset, count, dtype) in table.items())
+
+def read_source_digest(file_path):
+    """Returns the sha1 of the quiz file that file_path was parsed from,
+    or None if it is not known.
+    """
+    with open(file_path, 'rb') as f:
+        table = read_table(f)
+        if 'source_digest' not in table or table['source_digest'][1] == 0:
+            return None
+        offset, count, dtype = table['source_digest']
+        f.seek(offset)
+        return f.read(count).decode('ascii')
+
+def load(file_path, with_includes=False):
+    """Reads a columnar quiz file into a list of Category,
+    like the one parser.parse returns.
+    If with_includes is True, returns the categories and a list of
+    (position in categories, path, line number) of include directives.
+    """
+    with open(file_path, 'rb') as f:
+        table = read_table(f)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        def column(name):
+            if name not in table:
+                return []
+            offset, count, dtype = table[name]
+            return np.frombuffer(data, dtype=dtype, count=count, offset=offset).tolist()
+
+        def strings(name):
+            if name + '_text' not in table:
+                return []
+            start = table[name + '_text'][0]
+            offsets = column(name + '_offsets')
+            return [to_text(data[start+a:start+b]) for a, b in zip(offsets[:-1], offsets[1:])]
+
+        questions = strings('question')
+        answers = strings('answer')
+        media = strings('media')
+        question_media = column('question_media_offsets')
+        answer_media = column('answer_media_offsets')
+        line_numbers = column('line_numbers')
+        category_names = strings('category')
+        category_qas = column('category_qa_offsets')
+        category_line_numbers = column('category_line_numbers')
+        includes = list(zip(column('include_positions'), strings('include'),
+                            column('include_line_numbers')))
+    finally:
+        data.close()
+
+    categories = []
+    for j, name in enumerate(category_names):
+        category = Category(name)
+        category.line_number = category_line_numbers[j] or None
+        for i in range(category_qas[j], category_qas[j+1]):
+            qa = QuestionAnswer(questions[i], answers[i],
+                                media[answer_media[i]:question_media[i+1]],
+                                media[question_media[i+1]:answer_media[i+1]],
+                                line_numbers[i] or None)
+            category.append(qa)
+        categories.append(category)
+    if with_includes:
+        return categories, includes
+    return categories
@@ -0,0 +1,54 @@
+# encoding: utf-8
+
+"""Converts quiz files between the .ep text format and the
+columnar binary format (.epc) described in columnar.py.
+    python convert.py quiz.ep quiz.epc
+The conversion streams, so it works for quizzes larger than memory,
+and compressed quiz files (.ep.gz, .ep.bz2, .ep.xz) are read as they are.
+Use --info to print a summary of a .epc file.
+"""
+
+from __future__ import print_function
+
+
+def info(file_path):
+    """Prints the number of questions, categories and media of
+    a .epc file, using only its offset columns.
+    """
+    import numpy as np
+    from columnar import load_arrays
+    arrays = load_arrays(file_path)
+    n_qas = len(arrays['line_numbers'])
+    print("{} questions in {} categories, with {} media references.".format(
+          n_qas, len(arrays['category_line_numbers']), len(arrays['media_offsets']) - 1))
+    if n_qas > 0:
+        for name in ['question', 'answer']:
+            lengths = np.diff(arrays[name + '_offsets'])
+            print("{} length in bytes: mean {:.1f}, max {}.".format(
+                  name.capitalize(), lengths.mean(), lengths.max()))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a .ep quiz file to the columnar .epc format")
+    parser.add_argument("source", help="Path to the .ep quiz file, or to a .epc file with --info")
+    parser.add_argument("target", nargs='?', default=None,
+                        help="Path to the .epc file to write. Defaults to source with extension .epc")
+    parser.add_argument("-u", "--unique", dest="unique", action="store_true",
+                        help="Drop exact duplicate questions.")
+    parser.add_argument("--info", dest="info", action="store_true",
+                        help="Print a summary of a .epc file instead of converting.")
+    args = parser.parse_args()
+
+    if args.info:
+        info(args.source)
+    else:
+        from os.path import splitext
+        from columnar import export
+        from parser import compressed_extension, open_quiz_file
+        source = args.source
+        if compressed_extension(source):
+            source = source[:-len(compressed_extension(source))]
+        target = args.target or splitext(source)[0] + '.epc'
+        with open_quiz_file(args.source) as f:
+            export(f, target, unique=args.unique, source_path=args.source)
@@ -0,0 +1,274 @@
+# encoding: utf-8
+
+"""Loading of quizzes split over several files with include directives.
+
+A line
+    INCLUDE:relative/path/to/fragment.ep
+where a category name could be, puts the categories of that file there.
+Paths are relative to the including file, and media referenced in an
+included file are looked up relative to that file.
+
+Every file is parsed on its own, and cached by the hash of its contents.
+Which files include which is kept as a dependency graph, so when one
+fragment changes, only that fragment is parsed again, and only the files
+including it (directly or indirectly) are linked again.
+
+The parse of every file is also saved next to it, in <quiz file>.parsed,
+in the columnar format of columnar.py, along with the sha1 of the file.
+A later run reads it from there instead of parsing the file, as long as
+the file has the same sha1, so after editing one fragment of a course
+only that fragment is parsed, also in a new process.
+"""
+
+import os
+from hashlib import sha1
+from os.path import abspath, dirname, join, normpath
+
+from parser import parse_lines, IncludeError, open_quiz_file
+from quiz_handler import Category
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class FileEntry(object):
+    """The parsed contents of a single quiz file.
+    includes is a list of (position in categories, absolute path, line number).
+    """
+
+    def __init__(s, path, stat, digest, categories, includes, resolved_media):
+        s.path = path
+        s.stat = stat
+        s.digest = digest
+        s.categories = categories
+        s.includes = includes
+        s.resolved_media = resolved_media
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def file_digest(path):
+    """The sha1 of the file in path, as it is stored (so of the compressed
+    data, for compressed files), read a chunk at a time.
+    """
+    h = sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_path(path):
+    return path + '.parsed'
+
+def read_cache(path, digest):
+    """Returns the categories and includes of the quiz file in path from
+    its cache, as parse_lines would give them, or None if there is no
+    cache for the contents with this digest.
+    """
+    from columnar import load, read_source_digest
+    try:
+        if read_source_digest(cache_path(path)) != digest:
+            return None
+        return load(cache_path(path), with_includes=True)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def write_cache(path, digest, categories, includes):
+    """Saves the parse of the quiz file in path next to it.
+    Nothing happens if it cannot be written.
+    """
+    from columnar import export_categories
+    target = cache_path(path)
+    try:
+        export_categories(categories, target + '.tmp', includes, digest)
+        os.rename(target + '.tmp', target)
+    except (IOError, OSError):
+        pass
+
+def copy_categories(categories):
+    """New Category objects holding the same question-answers, so
+    that reinsertions during a quiz never change the cached ones.
+    """
+    copies = []
+    for category in categories:
+        copy = Category(category.name)
+        copy.line_number = getattr(category, 'line_number', None)
+        copy.extend(category)
+        copies.append(copy)
+    return copies
+
+
+class CourseLoader(object):
+    """Loads a quiz file and the files it includes, reusing the parse
+    of every file that did not change since the previous load.
+    """
+
+    def __init__(s, unique=False, media_path_rel='./media', cache=True):
+        """media_path_rel is where media of included files are looked for,
+        relative to each included file.
+        If cache is True, parses are saved next to the files, and reused
+        by later runs (see read_cache).
+        """
+        s.unique = unique
+        s.media_path_rel = media_path_rel
+        s.cache = cache
+        s.entries = dict()
+        s.linked = dict()
+        s.dependents = dict()
+        s.root = None
+
+    def load(s, file_path):
+        """Returns the list of categories of the quiz in file_path,
+        with included files spliced in.
+        """
+        root = abspath(file_path)
+        if root != s.root:
+            s.linked = dict()
+            s.root = root
+        s.refresh(root)
+        categories = copy_categories(s.link(root, ()))
+        if s.unique:
+            categories = s.remove_duplicates(categories)
+        return categories
+
+    def entry(s, path):
+        """Returns the FileEntry of path, parsing the file only
+        if its contents changed since it was last parsed,
+        in this process or, through its cache, in an earlier one.
+        """
+        try:
+            stat = file_stat(path)
+        except OSError:
+            raise IncludeError("Quiz file {} does not exist.".format(path))
+        resolve = path != s.root
+        old = s.entries.get(path)
+        if old is not None and old.stat == stat and old.resolved_media == resolve:
+            return old
+
+        digest = file_digest(path)
+        if old is not None and old.digest == digest and old.resolved_media == resolve:
+            old.stat = stat
+            return old
+
+        cached = read_cache(path, digest) if s.cache else None
+        if cached is not None:
+            categories, includes = cached
+        else:
+            with open_quiz_file(path) as f:
+                p = parse_lines(f)
+            categories, includes = p.categories, p.includes
+            # Unless the file was changed while it was being parsed
+            if s.cache and file_stat(path) == stat:
+                write_cache(path, digest, categories, includes)
+        includes = [(position, normpath(join(dirname(path), include)), line_number)
+                    for position, include, line_number in includes]
+        if resolve:
+            s.resolve_media(path, categories)
+        new = FileEntry(path, stat, digest, categories, includes, resolve)
+        s.entries[path] = new
+        return new
+
+    def resolve_media(s, path, categories):
+        """Makes media paths of an included file absolute, relative to that file.
+        """
+        folder = normpath(join(dirname(path), s.media_path_rel))
+        for category in categories:
+            for qa in category:
+                qa.question_media = [join(folder, m) for m in qa.question_media or []]
+                qa.answer_media = [join(folder, m) for m in qa.answer_media or []]
+
+    def refresh(s, root):
+        """Brings the entries of every file reachable from root up to date,
+        updates the dependency graph, forgets linked categories that are
+        out of date, and returns the set of changed files.
+        """
+        changed = set()
+        visited = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if path in visited:
+                continue
+            visited.add(path)
+            old = s.entries.get(path)
+            entry = s.entry(path)
+            if entry is not old or path not in s.linked:
+                changed.add(path)
+            for position, include, line_number in entry.includes:
+                s.dependents.setdefault(include, set()).add(path)
+                if not os.path.isfile(include):
+                    raise IncludeError("{}, line {}: included file {} does not exist.".format(
+                                       path, line_number, include))
+                stack.append(include)
+        s.invalidate(changed)
+        return changed
+
+    def invalidate(s, changed):
+        """Forgets the linked categories of changed files,
+        and of every file including them.
+        """
+        stack = list(changed)
+        visited = set()
+        while stack:
+            path = stack.pop()
+            if path in visited:
+                continue
+            visited.add(path)
+            s.linked.pop(path, None)
+            stack.extend(s.dependents.get(path, ()))
+
+    def link(s, path, stack):
+        """Returns the categories of path, with included files spliced in.
+        stack holds the files including path, for cycle detection.
+        """
+        if path in stack:
+            cycle = ' -> '.join(stack[stack.index(path):] + (path,))
+            raise IncludeError("Include cycle: {}".format(cycle))
+        if path in s.linked:
+            return s.linked[path]
+        entry = s.entries[path]
+        categories = []
+        start = 0
+        for position, include, line_number in entry.includes:
+            categories.extend(entry.categories[start:position])
+            categories.extend(s.link(include, stack + (path,)))
+            start = position
+        categories.extend(entry.categories[start:])
+        s.linked[path] = categories
+        return categories
+
+    def remove_duplicates(s, categories):
+        seen = set()
+        out = []
+        for category in categories:
+            kept = []
+            for qa in category:
+                fingerprint = qa.fingerprint()
+                if fingerprint not in seen:
+                    seen.add(fingerprint)
+                    kept.append(qa)
+            if kept:
+                category[:] = kept
+                out.append(category)
+        return out
+
+    def subtree_digest(s, path):
+        """A hash over the contents of path and every file it includes.
+        """
+        s.refresh(path)
+        h = sha1()
+        visited = set()
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            entry = s.entries[current]
+            h.update(entry.digest.encode('ascii'))
+            stack.extend(include for position, include, line_number in reversed(entry.includes))
+        return h.hexdigest()
@@ -0,0 +1,248 @@
+# encoding: utf-8
+
+"""Finds duplicate and near-duplicate question-answers, e.g. in quiz
+banks merged from several authors.
+
+Exact duplicates are found by QuestionAnswer.fingerprint.
+Near-duplicates are found with MinHash signatures over word shingles,
+and locality sensitive hashing (LSH) over bands of the signatures.
+Only question-answers sharing a band are compared, so finding
+candidate pairs takes roughly linear time in the number of questions.
+
+For a report on a quiz file, run
+    python dedup.py path/to/quiz.ep
+"""
+
+from __future__ import print_function
+
+import re
+import zlib
+import numpy as np
+
+from quiz_handler import Category
+
+RE_NON_WORD = re.compile(r'\W+', re.UNICODE)
+
+# A prime larger than any crc32 value. Coefficients are kept below 2**31,
+# so that a*x + b never overflows uint64.
+MINHASH_PRIME = np.uint64(4294967311)
+
+
+def normalise(text):
+    """Returns a list of lowercase word tokens in text,
+    ignoring punctuation and whitespace.
+    """
+    return RE_NON_WORD.sub(' ', text.lower()).split()
+
+def shingle_hashes(tokens, shingle_size=3):
+    """Returns a uint64 array of crc32 hashes of all runs
+    of shingle_size consecutive tokens.
+    Texts shorter than shingle_size become a single shingle.
+    """
+    n = max(1, len(tokens) - shingle_size + 1)
+    shingles = set(' '.join(tokens[i:i+shingle_size]) for i in range(n))
+    return np.array([zlib.crc32(sh.encode('utf-8')) & 0xffffffff for sh in shingles],
+                    dtype=np.uint64)
+
+def qa_text(qa):
+    """The text that near-duplicate detection compares.
+    """
+    return ' '.join([qa.question, qa.answer]
+                    + (qa.question_media or [])
+                    + (qa.answer_media or []))
+
+
+class NearDuplicateIndex(object):
+    """MinHash/LSH index of question-answers.
+    Add question-answers with add(), then ask for candidate_pairs()
+    or clusters().
+    """
+
+    def __init__(s, num_perm=64, bands=16, shingle_size=3, seed=1):
+        assert num_perm % bands == 0, "num_perm must be divisible by bands."
+        s.num_perm = num_perm
+        s.bands = bands
+        s.rows = num_perm // bands
+        s.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        s.a = rng.randint(1, 2**31, size=num_perm).astype(np.uint64)
+        s.b = rng.randint(0, 2**31, size=num_perm).astype(np.uint64)
+        # Random odd multipliers for folding the rows of a band into one key
+        s.band_mix = (rng.randint(0, 2**31, size=s.rows).astype(np.uint64)
+                      * np.uint64(2) + np.uint64(1))
+        s.items = []
+        s._signatures = []
+        s._matrix = None
+
+    def __len__(s):
+        return len(s.items)
+
+    def signature(s, text):
+        """Returns the MinHash signature of text, as a uint64 array of length num_perm.
+        """
+        x = shingle_hashes(normalise(text), s.shingle_size)
+        return ((s.a[:, None] * x[None, :] + s.b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    def add(s, qa):
+        """Adds qa to the index, and returns its index.
+        """
+        s.items.append(qa)
+        s._signatures.append(s.signature(qa_text(qa)))
+        s._matrix = None
+        return len(s.items) - 1
+
+    def signatures(s):
+        """Returns all signatures as an array of shape (len(s), num_perm).
+        """
+        if s._matrix is None:
+            if s._signatures:
+                s._matrix = np.vstack(s._signatures)
+            else:
+                s._matrix = np.zeros((0, s.num_perm), dtype=np.uint64)
+            s._signatures = [s._matrix[i] for i in range(len(s._matrix))]
+        return s._matrix
+
+    def similarity(s, i, j):
+        """Estimated Jaccard similarity of items i and j.
+        """
+        sig = s.signatures()
+        return float(np.mean(sig[i] == sig[j]))
+
+    def candidate_pairs(s):
+        """Returns an array of shape (n, 2) with index pairs i < j
+        that share at least one band.
+        Within a bucket, every member is paired with the first member only,
+        which is enough for clustering and keeps the pair count linear.
+        """
+        sig = s.signatures()
+        n = len(sig)
+        pairs = []
+        for band in range(s.bands):
+            rows = sig[:, band*s.rows:(band+1)*s.rows]
+            keys = (rows * s.band_mix[None, :]).sum(axis=1)
+            order = np.argsort(keys, kind='mergesort')
+            sorted_keys = keys[order]
+            starts = np.ones(n, dtype=bool)
+            starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+            # Index in 'order' of the first member of each element's bucket
+            first = order[np.maximum.accumulate(np.where(starts, np.arange(n), 0))]
+            member = ~starts
+            pairs.append(np.column_stack([first[member], order[member]]))
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+        pairs = np.sort(np.vstack(pairs), axis=1)
+        if len(pairs) == 0:
+            return pairs
+        return np.unique(pairs, axis=0)
+
+    def clusters(s, threshold=0.8):
+        """Returns a list of lists of indices, each list holding items
+        whose estimated similarity to another member is at least threshold.
+        Only clusters with more than one member are returned.
+        Indices within a cluster, and clusters, are in insertion order.
+        """
+        sig = s.signatures()
+        pairs = s.candidate_pairs()
+        if len(pairs) > 0:
+            similar = (sig[pairs[:, 0]] == sig[pairs[:, 1]]).mean(axis=1) >= threshold
+            pairs = pairs[similar]
+
+        parent = list(range(len(sig)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for i, j in pairs:
+            ri, rj = find(int(i)), find(int(j))
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+        groups = dict()
+        for i in range(len(sig)):
+            groups.setdefault(find(i), []).append(i)
+        return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: g[0])
+
+
+def find_exact_duplicates(categories):
+    """Returns a list of lists of question-answers with identical fingerprints.
+    Only groups with more than one member are returned.
+    """
+    groups = dict()
+    order = []
+    for category in categories:
+        for qa in category:
+            fingerprint = qa.fingerprint()
+            if fingerprint not in groups:
+                groups[fingerprint] = []
+                order.append(fingerprint)
+            groups[fingerprint].append(qa)
+    return [groups[f] for f in order if len(groups[f]) > 1]
+
+def build_index(categories, **kwargs):
+    """Returns a NearDuplicateIndex of all question-answers in categories.
+    kwargs are passed on to NearDuplicateIndex.
+    """
+    index = NearDuplicateIndex(**kwargs)
+    for category in categories:
+        for qa in category:
+            index.add(qa)
+    return index
+
+def collapse_duplicates(categories, threshold=0.8):
+    """Returns a new list of categories where only the first member
+    of each cluster of (near-)duplicates is kept.
+    Categories left empty are dropped.
+    """
+    index = build_index(categories)
+    dropped = set()
+    for cluster in index.clusters(threshold):
+        dropped.update(id(index.items[i]) for i in cluster[1:])
+
+    collapsed = []
+    for category in categories:
+        kept = Category(category.name, [qa for qa in category if id(qa) not in dropped])
+        if len(kept) > 0:
+            collapsed.append(kept)
+    return collapsed
+
+def location(qa):
+    if qa.line_number is None:
+        return '?'
+    return str(qa.line_number)
+
+def report(categories, threshold=0.8, out=None):
+    """Prints exact and near-duplicate question-answers
+    in categories, with their line numbers.
+    """
+    import sys
+    out = out or sys.stdout
+    exact = find_exact_duplicates(categories)
+    print("Exact duplicates: {}".format(len(exact)), file=out)
+    for group in exact:
+        print("  lines {}: {}".format(', '.join(location(qa) for qa in group),
+                                      group[0].question), file=out)
+
+    index = build_index(categories)
+    exact_ids = set(id(qa) for group in exact for qa in group)
+    near = [c for c in index.clusters(threshold)
+            if not all(id(index.items[i]) in exact_ids for i in c)]
+    print("Near-duplicate clusters (similarity >= {}): {}".format(threshold, len(near)), file=out)
+    for cluster in near:
+        print("  lines {}".format(', '.join(location(index.items[i]) for i in cluster)), file=out)
+        for i in cluster:
+            print("    {}: {}".format(location(index.items[i]).rjust(5),
+                                      index.items[i].question), file=out)
+
+
+if __name__ == '__main__':
+    import argparse
+    from parser import parse
+
+    argparser = argparse.ArgumentParser(description="Report duplicate questions in a quiz file")
+    argparser.add_argument("file_path", help="Path to quiz file")
+    argparser.add_argument("-t", "--threshold", dest="threshold", type=float, default=0.8,
+                           help="Estimated Jaccard similarity above which questions are near-duplicates.")
+    args = argparser.parse_args()
+
+    report(parse(args.file_path), threshold=args.threshold)
@@ -0,0 +1,234 @@
+# encoding: utf-8
+
+"""Two-phase loading of quiz files, so that only the categories
+chosen for a quiz are parsed.
+
+The first phase runs every file through a LineParser that keeps
+nothing but the name, number of questions and byte range of every
+category, and the include directives, which is all that is needed
+to pick categories. Each category is a byte range of its file, from
+its name up to the next category.
+
+The second phase parses the byte range of a category once it is chosen.
+"""
+
+from os.path import abspath, dirname, isfile, join, normpath
+
+from parser import (LineParser, IncludeError, compressed_extension, decode_line,
+                    open_binary, split_lines)
+from quiz_handler import Category
+
+
+class CategoryRange(object):
+    """Where a category is in its file. first_line is the line number
+    of the first line of the range. If duplicates are left out,
+    fingerprints holds (line number, fingerprint) of its question-answers,
+    and duplicate_lines the line numbers of those that are duplicates.
+    """
+
+    def __init__(s, name, line_number, start, first_line):
+        s.name = name
+        s.line_number = line_number
+        s.start = start
+        s.end = start
+        s.first_line = first_line
+        s.count = 0
+        s.fingerprints = []
+        s.duplicate_lines = set()
+
+
+class CategoryScanner(LineParser):
+    """A LineParser that records where in the file every category is,
+    instead of keeping its question-answers. Lines are given as byte strings.
+    ranges gets a CategoryRange for every category with questions,
+    and includes gets (position in ranges, path, line number).
+    If unique is True, the fingerprints of the question-answers are kept,
+    with their media made relative to media_folder, as parse() does for
+    included files.
+    """
+
+    def __init__(s, unique=False, media_folder=None):
+        LineParser.__init__(s)
+        s.keep_fingerprints = unique
+        s.media_folder = media_folder
+        s.offset = 0
+        s.line_start = 0
+        s.ranges = []
+        s.current = CategoryRange('Default', None, 0, 1)
+
+    def parse_line(s, line):
+        s.line_start = s.offset
+        s.offset += len(line)
+        LineParser.parse_line(s, decode_line(line))
+
+    def flush_qa(s):
+        if s.keep_fingerprints:
+            LineParser.flush_qa(s)
+        elif s.qa_buffer:
+            # Only counted, so the question-answer is not built
+            s.current.count += 1
+            s.clear()
+
+    def add_qa(s, qa):
+        s.current.count += 1
+        if s.keep_fingerprints:
+            if s.media_folder is not None:
+                qa.question_media = [join(s.media_folder, m) for m in qa.question_media or []]
+                qa.answer_media = [join(s.media_folder, m) for m in qa.answer_media or []]
+            s.current.fingerprints.append((qa.line_number, qa.fingerprint()))
+
+    def flush_category(s, new_category_name=None):
+        s.current.end = s.line_start
+        if s.current.count > 0:
+            s.ranges.append(s.current)
+        if new_category_name:
+            s.current = CategoryRange(new_category_name.strip(), s.line_number, s.line_start, s.line_number)
+        else:
+            s.current = CategoryRange('Default', None, s.line_start, s.line_number)
+
+    def include(s, path):
+        # Questions after the include go in a new category, starting on the next line
+        s.flush_category()
+        s.current.start = s.offset
+        s.current.first_line += 1
+        s.includes.append((len(s.ranges), path, s.line_number))
+
+    def close(s):
+        s.line_start = s.offset
+        LineParser.close(s)
+
+
+class DeferredCategory(Category):
+    """A Category that only knows its name and number of questions
+    until load() is called. Until then, len() gives that number,
+    but the category holds no question-answers.
+    """
+
+    def __init__(s, source, path, category_range):
+        Category.__init__(s, category_range.name)
+        s.line_number = category_range.line_number
+        s.source = source
+        s.path = path
+        s.range = category_range
+        s.loaded = False
+
+    def __len__(s):
+        if s.loaded:
+            return list.__len__(s)
+        return s.range.count - len(s.range.duplicate_lines)
+
+    def load(s):
+        """Parses the question-answers of the category from its file,
+        leaving out those found to be duplicates when it was scanned.
+        """
+        if s.loaded:
+            return
+        r = s.range
+        data = s.source.read(s.path, r.start, r.end)
+        p = LineParser()
+        p.escapes = s.path in s.source.escaped_paths
+        p.line_number = r.first_line - 1
+        for line in split_lines(data):
+            p.parse_line(decode_line(line))
+        p.close()
+        qas = [qa for category in p.categories for qa in category
+               if qa.line_number not in r.duplicate_lines]
+        if s.path != s.source.root:
+            folder = normpath(join(dirname(s.path), s.source.media_path_rel))
+            for qa in qas:
+                qa.question_media = [join(folder, m) for m in qa.question_media or []]
+                qa.answer_media = [join(folder, m) for m in qa.answer_media or []]
+        s.loaded = True
+        s.extend(qas)
+
+
+class DeferredSource(object):
+    """Reads which categories a quiz file and the files it includes
+    have, without parsing their questions. s.categories is a list of
+    DeferredCategory, to be loaded once chosen.
+    Can be used as the source of a QuizConductor.
+    """
+
+    def __init__(s, file_path, unique=False, media_path_rel='./media'):
+        s.root = abspath(file_path)
+        s.unique = unique
+        s.media_path_rel = media_path_rel
+        s.compressed_files = {}
+        s.reload()
+
+    def reload(s):
+        s.close()
+        # Files starting with parser.ESCAPES_PRAGMA
+        s.escaped_paths = set()
+        s.categories = s.scan(s.root, ())
+        if s.unique:
+            s.categories = s.remove_duplicates(s.categories)
+
+    def read(s, path, start, end):
+        """Returns bytes start to end of the quiz file in path.
+        Compressed files can only be read from the start, so they are
+        kept open, and reading categories in file order reads them once.
+        """
+        if compressed_extension(path) is None:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                return f.read(end - start)
+        f = s.compressed_files.get(path)
+        if f is None:
+            f = s.compressed_files[path] = open_binary(path)
+        # Seeking backwards starts decompressing over again
+        f.seek(start)
+        return f.read(end - start)
+
+    def close(s):
+        for f in s.compressed_files.values():
+            f.close()
+        s.compressed_files = {}
+
+    def scan(s, path, stack):
+        """Returns the categories of path, with included files spliced in.
+        stack holds the files including path.
+        """
+        media_folder = normpath(join(dirname(path), s.media_path_rel)) if stack else None
+        scanner = CategoryScanner(s.unique, media_folder)
+        with open_binary(path) as f:
+            for line in f:
+                scanner.parse_line(line)
+            scanner.close()
+        if scanner.escapes:
+            s.escaped_paths.add(path)
+
+        categories = []
+        start = 0
+        for position, include, line_number in scanner.includes:
+            include = normpath(join(dirname(path), include))
+            chain = stack + (path,)
+            if include in chain:
+                raise IncludeError("Include cycle: {}".format(' -> '.join(chain[chain.index(include):] + (include,))))
+            if not isfile(include):
+                raise IncludeError("{}, line {}: included file {} does not exist.".format(
+                                   path, line_number, include))
+            categories.extend(DeferredCategory(s, path, r) for r in scanner.ranges[start:position])
+            categories.extend(s.scan(include, chain))
+            start = position
+        categories.extend(DeferredCategory(s, path, r) for r in scanner.ranges[start:])
+        return categories
+
+    def remove_duplicates(s, categories):
+        """Marks the question-answers that are duplicates of earlier ones,
+        in the order of the linked course, like parse(unique=True) leaves
+        them out, and returns the categories that still have questions.
+        """
+        seen = set()
+        out = []
+        for category in categories:
+            r = category.range
+            for line_number, fingerprint in r.fingerprints:
+                if fingerprint in seen:
+                    r.duplicate_lines.add(line_number)
+                else:
+                    seen.add(fingerprint)
+            r.fingerprints = []
+            if len(category) > 0:
+                out.append(category)
+        return out
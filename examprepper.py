@@ -4,38 +4,108 @@
 with a given interface. Available arguments can be found using
     python examprepper --help
 In the command line, you may navigate to the folder containing a .ep file
-(or .ep.txt, or any file name containg '.ep.' or ending in '.ep')
+(or .ep.txt, or any file name containg '.ep.' or ending in '.ep',
+possibly compressed as .ep.gz, .ep.bz2 or .ep.xz,
+or a columnar .epc file made with convert.py)
 and just invoke this program directly - it will find the quiz file and open it.
 """
 
 import os
 
 
-def run(interface, file_path, media_path_rel='./media', presets=None):
+def run(interface, file_path, media_path_rel='./media', presets=None, unique=False, watch=False, lazy=False,
+        resume=False, grade=None, grade_later=False):
     """Runs a quiz using the supplied interface (instance of QuizInterfaceBase)
     and the quiz document in file_path. It looks for media (images, sound) in
     the media_path_rel, which is relative to the file_path.
+    If unique is True, exact duplicate questions are dropped while parsing.
+    If watch is True, changes to the quiz file are merged into the running quiz.
+    If lazy is True, question and answer texts are read from the quiz file
+    only when shown, instead of being kept in memory (see lazy.py).
+    Watching is not supported then.
+    When sampling questions, their scores are kept in file_path + '.weights'.
+    The session is always journaled in file_path + '.journal' while it runs,
+    if that can be written, which makes starting a round of many questions
+    a little slower (see journal.py). If resume is True, a session that was
+    cut short is continued where it stopped.
+    If grade is a number, typed responses are graded automatically, and count
+    as correct if their score (between 0 and 1) is at least grade.
+    If grade_later is True too, they are graded together at the end of every
+    round, and the questions answered wrong are then asked again.
+    Files ending in .epc are read as columnar quiz files (see convert.py),
+    and files ending in .csv or .tsv as a question-answer per row (see importer.py).
     """
-    from parser import parse
+    from incremental import IncrementalParser
     from quiz_handler import QuizConductor
     from os.path import normpath, join, dirname
     media_folder = normpath(join(dirname(file_path), media_path_rel))
     interface.set_media_folder(media_folder)
-    categories = parse(file_path)
-    qc = QuizConductor(categories, presets=presets)
-    qc.run(interface)
+    if file_path.endswith('.epc'):
+        from columnar import load
+        source = None
+        categories = load(file_path)
+    elif file_path.endswith(('.csv', '.tsv')):
+        from importer import load
+        source = None
+        categories = load(file_path)
+    elif lazy:
+        from lazy import load
+        source = None
+        categories = load(file_path, unique=unique, media_path_rel=media_path_rel)
+    elif watch:
+        source = IncrementalParser(file_path, unique=unique, media_path_rel=media_path_rel)
+        categories = source.categories
+    else:
+        # Only the categories chosen for the quiz are parsed
+        from deferred import DeferredSource
+        source = DeferredSource(file_path, unique=unique, media_path_rel=media_path_rel)
+        categories = source.categories
+    qc = QuizConductor(categories, presets=presets, source=source)
+    qc.watch = watch
+    qc.weights_path = file_path + '.weights'
+    qc.journal_path = file_path + '.journal'
+    if grade is not None:
+        from grading import Grader
+        qc.grader = Grader(grade)
+        qc.grade_later = grade_later
+    resumed = resume and qc.resume_session()
+    if resume and not resumed:
+        print("No interrupted session of {} to resume, or the file has changed since. "
+              "Starting a new session.".format(file_path))
+    qc.run(interface, resumed=resumed)
+
+# Files kept next to quiz files, which are not quiz files themselves
+SIDECAR_EXTENSIONS = ('.idx', '.weights', '.journal', '.parsed', '.tmp')
+
+def is_ep_file(file_name):
+    """Whether file_name looks like the name of a quiz file in the text format,
+    which may be compressed (.ep.gz, .ep.bz2 or .ep.xz).
+    """
+    from parser import compressed_extension
+    extension = compressed_extension(file_name)
+    if extension is not None:
+        file_name = file_name[:-len(extension)]
+    if file_name.endswith(SIDECAR_EXTENSIONS):
+        return False
+    # Columnar files, e.g. quiz.ep.epc converted from quiz.ep.txt, are binary
+    if file_name.endswith('.epc'):
+        return False
+    return '.ep.' in file_name or file_name.endswith('.ep')
 
 def find_ep_file(directory):
     files = os.listdir(directory)
 
     for f in files:
-        if '.ep.' in f or f.endswith('.ep'):
+        if is_ep_file(f) or f.endswith('.epc'):
             return os.path.join(directory, f)
 
 if __name__ == '__main__':
     import argparse
+    from grading import THRESHOLD
     
     parser = argparse.ArgumentParser(description="CLI for starting the examprepper")
+    parser.add_argument("--check", dest="check", nargs='?', const='.', default=None, metavar="PATH",
+                        help="Check the quiz file in PATH, or all quiz files under it (default: current directory), and exit.")
     parser.add_argument("-i", "--interface", dest="interface",default="terminal", 
                         help="Interface type. Currently only supporting 'terminal' for a terminal interface.")
     file_arg = parser.add_argument("-f", "--file", dest="file_path", default=None,
@@ -53,13 +123,51 @@ if __name__ == '__main__':
                       Choose among random, no_random, random_within_category, 
                       random_between_category, and
                       categories_random_and_random_within_category""")
+    parser.add_argument("-u", "--unique", dest="unique", action="store_true",
+                      help="Drop exact duplicate questions when reading the quiz file.")
+    parser.add_argument("--marathon", dest="marathon", action="store_true",
+                      help="For very long sessions. Each round starts without reinserted copies, and reinsertions are capped.")
+    parser.add_argument("--max-reinsertions", dest="max_reinsertions", type=int, default=None,
+                      help="How many times a failed question may be reinserted per round.")
+    parser.add_argument("-l", "--lazy", dest="lazy", action="store_true",
+                      help="For very large quiz files. Read questions and answers from the file only when they are shown.")
+    parser.add_argument("-w", "--watch", dest="watch", action="store_true",
+                      help="Merge changes to the quiz file into the running quiz.")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                      help="Continue the last session with this quiz file, if it was cut short.")
+    parser.add_argument("-g", "--grade", dest="grade", type=float, nargs='?', const=THRESHOLD, default=None,
+                      metavar="THRESHOLD",
+                      help="Grade typed answers automatically, instead of asking whether they were ok. "
+                           "An answer is correct if its similarity (0-1) to the true answer is at least THRESHOLD "
+                           "(default {}).".format(THRESHOLD))
+    parser.add_argument("--grade-later", dest="grade_later", action="store_true",
+                      help="With -g/--grade, grade the answers of a round together at its end, which is quicker "
+                           "for long rounds. The questions answered wrong are then asked again.")
+    parser.add_argument("-s", "--sample", dest="sample", type=int, default=None, metavar="N",
+                      help="Preset. Optional. Ask only N of the chosen questions, favouring those answered wrong or not recently.")
+    parser.add_argument("-d", "--collapse-duplicates", dest="collapse_duplicates", type=float,
+                      default=None, metavar="THRESHOLD",
+                      help="Preset. Optional. Collapse near-duplicate questions with a similarity (0-1) above THRESHOLD before ordering.")
 
     args = parser.parse_args()
+    if args.sample is not None and args.sample < 1:
+        parser.error("argument -s/--sample: N must be at least 1, not {}".format(args.sample))
+    if args.grade_later and args.grade is None:
+        parser.error("argument --grade-later: only with -g/--grade")
+
+    if args.check is not None:
+        import sys
+        from check import check
+        sys.exit(1 if check(args.check, media_path_rel=args.media_path) else 0)
     
     presets = dict()
     if args.order: presets['order'] = args.order
     if args.category_indices: presets['category_indices'] = [int(x) for x in args.category_indices.split(',')]
     if args.repetition_lag != None: presets['repetition_lag'] = args.repetition_lag
+    if args.collapse_duplicates != None: presets['collapse_duplicates'] = args.collapse_duplicates
+    if args.sample != None: presets['sample'] = args.sample
+    if args.marathon: presets['marathon'] = True
+    if args.max_reinsertions != None: presets['max_reinsertions'] = args.max_reinsertions
 
     interface = None
     if args.interface == 'terminal':
@@ -82,7 +190,8 @@ if __name__ == '__main__':
         if file_path == None:
             raise argparse.ArgumentError(file_arg, "No quiz file (.ep) found in given directory {}".format(directory))
 
-    run(interface, file_path, args.media_path, presets=presets)
+    run(interface, file_path, args.media_path, presets=presets, unique=args.unique, watch=args.watch, lazy=args.lazy,
+        resume=args.resume, grade=args.grade, grade_later=args.grade_later)
 
 
 
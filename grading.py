@@ -0,0 +1,152 @@
+# encoding: utf-8
+
+"""Automatic grading of typed responses, for when nobody is there to say
+whether their answer was ok.
+
+A response and the answer of its question-answer are both normalised to
+lowercase word tokens, ignoring punctuation (see dedup.normalise),
+and compared in two ways:
+
+    token overlap   F1 of the sets of tokens, 2 * common / (answer + response),
+                    which forgives words in another order
+    edit distance   1 - Levenshtein distance / length of the longer text,
+                    over the normalised texts, which forgives typos
+
+The score of a response is the higher of the two, and it is graded correct
+if the score is at least the threshold. Only the first MAX_EDIT_LENGTH
+characters are compared by edit distance, as its cost grows with the
+product of the lengths; longer answers are graded by token overlap.
+Answers without any words, e.g. just a picture, cannot be graded; the
+user is asked instead (see Grader.gradable).
+
+Edit distances of a whole batch of responses are computed together with
+numpy, one row of the distance matrices at a time, so grading many pending
+responses takes about as many numpy operations as grading the longest one.
+The normalised answers are cached per question-answer.
+"""
+
+import numpy as np
+
+from dedup import normalise
+
+THRESHOLD = 0.8
+MAX_EDIT_LENGTH = 256
+# Responses are graded in chunks of similar length, so little time goes to padding
+CHUNK_SIZE = 512
+
+
+def to_tokens(text):
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    return normalise(text)
+
+def response_text(response):
+    """Returns the text of a response, given as a string or a list of lines.
+    """
+    if isinstance(response, (list, tuple)):
+        return '\n'.join(response)
+    return response
+
+def code_points(texts, fill):
+    """Returns an int32 array with a row of code points for every text,
+    padded with fill, and an array of the lengths of the texts.
+    """
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    codes = np.full((len(texts), lengths.max() if len(texts) else 0), fill, dtype=np.int32)
+    for k, text in enumerate(texts):
+        if text:
+            codes[k, :len(text)] = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    return codes, lengths
+
+def _edit_distances(a, b):
+    # Row i of the distance matrix of every pair is computed at once, from row i-1.
+    # Insertions within a row are a running minimum: with tmp[j] the best cost
+    # without one, row[j] = min over k <= j of tmp[k] + j - k.
+    ca, la = code_points(a, -1)
+    cb, lb = code_points(b, -2)
+    cols = np.arange(cb.shape[1] + 1)
+    row = np.tile(cols, (len(b), 1))
+    tmp = np.empty_like(row)
+    distances = lb.copy()
+    for i in range(1, ca.shape[1] + 1):
+        cost = cb != ca[:, i-1:i]
+        tmp[:, 0] = i
+        np.minimum(row[:, 1:] + 1, row[:, :-1] + cost, out=tmp[:, 1:])
+        row = np.minimum.accumulate(tmp - cols, axis=1) + cols
+        done = np.flatnonzero(la == i)
+        distances[done] = row[done, lb[done]]
+    return distances
+
+def edit_distances(a, b):
+    """Returns an array of the Levenshtein distances between a[k] and b[k],
+    for lists of unicode strings a and b of the same length.
+    """
+    distances = np.zeros(len(a), dtype=np.int64)
+    order = np.argsort([max(len(x), len(y)) for x, y in zip(a, b)], kind='mergesort')
+    for start in range(0, len(a), CHUNK_SIZE):
+        chunk = order[start:start + CHUNK_SIZE]
+        distances[chunk] = _edit_distances([a[k] for k in chunk], [b[k] for k in chunk])
+    return distances
+
+def token_overlap(answer_tokens, response_tokens):
+    """F1 of two sets of tokens.
+    """
+    if not answer_tokens and not response_tokens:
+        return 1.0
+    common = len(answer_tokens & response_tokens)
+    return 2.0 * common / (len(answer_tokens) + len(response_tokens))
+
+
+class Grader(object):
+    """Grades responses against the answers of question-answers.
+    A response is correct if its score is at least threshold.
+    Can be set as s.grader of a QuizConductor, to grade instead of the user.
+    """
+
+    def __init__(s, threshold=THRESHOLD):
+        s.threshold = threshold
+        s.references = dict()
+
+    def reference(s, qa):
+        """Returns the normalised answer of qa, as (set of tokens, text).
+        Cached, and computed again if the answer was edited.
+        """
+        cached = s.references.get(id(qa))
+        answer = qa.answer
+        if cached is None or cached[0] != answer:
+            tokens = to_tokens(answer)
+            cached = (answer, set(tokens), ' '.join(tokens)[:MAX_EDIT_LENGTH])
+            s.references[id(qa)] = cached
+        return cached[1:]
+
+    def gradable(s, qa):
+        """Whether the answer of qa has any words to compare responses with.
+        """
+        return len(s.reference(qa)[0]) > 0
+
+    def scores(s, qas, responses):
+        """Returns an array with the score (between 0 and 1) of every response
+        to the question-answer at the same place in qas, or nan if the
+        question-answer cannot be graded.
+        """
+        references = [s.reference(qa) for qa in qas]
+        tokens = [to_tokens(response_text(response)) for response in responses]
+        overlap = np.array([token_overlap(answer_tokens, set(response_tokens))
+                            for (answer_tokens, answer), response_tokens in zip(references, tokens)])
+        a = [' '.join(response_tokens)[:MAX_EDIT_LENGTH] for response_tokens in tokens]
+        b = [answer for answer_tokens, answer in references]
+        longest = np.array([max(len(x), len(y)) for x, y in zip(a, b)], dtype=np.float64)
+        distances = edit_distances(a, b)
+        similarity = 1 - distances / np.maximum(longest, 1)
+        scores = np.maximum(overlap, similarity)
+        scores[[not answer_tokens for answer_tokens, answer in references]] = np.nan
+        return scores
+
+    def grade(s, qas, responses):
+        """Returns a boolean array, True for every correct response.
+        Responses that cannot be graded are False.
+        """
+        return s.scores(qas, responses) >= s.threshold
+
+    def score(s, qa, response):
+        return float(s.scores([qa], [response])[0])
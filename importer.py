@@ -0,0 +1,213 @@
+# encoding: utf-8
+
+"""Imports question-answers from CSV or TSV files, e.g. spreadsheets or
+flashcard decks exported as text.
+
+Every row is a question-answer. Which column holds what is given by the
+names in the header row, or by the columns argument:
+
+    question        the question
+    answer          the answer
+    category        the category; rows without one go in 'Default'
+    question_media  media names for the question, separated by ;
+    answer_media    media names for the answer, separated by ;
+
+Columns with other names are ignored. 'front' and 'back', as flashcards
+have them, are taken as question and answer, and 'deck' as category.
+Fields may span several lines. Leading lines starting with #, which is how
+Anki starts its text exports, are skipped. With html=True, <br> tags become
+new lines, other tags are removed, and the media of <img src="..."> and
+[sound:...] are moved to the media of the field.
+
+Rows are read one at a time, and can be turned into Categories, or written
+to a quiz file in constant memory. The quiz file starts with
+parser.ESCAPES_PRAGMA, and questions and answers are escaped as needed,
+so that it reads back the same (see parser.escape).
+Rows of a category should come together, as the quiz file gets a new
+category every time the category changes.
+
+    python importer.py deck.csv quiz.ep
+"""
+
+from __future__ import print_function
+
+import codecs
+import csv
+import io
+import itertools
+import re
+
+from parser import ESCAPES_PRAGMA, escape, native
+from quiz_handler import Category, QuestionAnswer
+
+COLUMN_NAMES = {'question': 'question', 'front': 'question',
+                'answer': 'answer', 'back': 'answer',
+                'category': 'category', 'deck': 'category',
+                'question_media': 'question_media', 'answer_media': 'answer_media'}
+MEDIA_SEPARATOR = ';'
+
+RE_BR = re.compile(r'<br\s*/?>', re.IGNORECASE)
+RE_IMG = re.compile(r'<img[^>]*?src=["\']?([^"\'>\s]+)["\']?[^>]*>', re.IGNORECASE)
+RE_SOUND = re.compile(r'\[sound:([^\]]+)\]')
+RE_TAG = re.compile(r'<[^>]+>')
+HTML_ENTITIES = [('&nbsp;', ' '), ('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&amp;', '&')]
+
+
+def open_rows(path, delimiter=None):
+    """Returns an iterator over the rows of the file in path, as lists of
+    unicode strings, the csv reader behind it, and the number of lines
+    skipped before the rows. The delimiter is a tab for .tsv and .txt files,
+    and a comma otherwise, unless given.
+    """
+    if delimiter is None:
+        delimiter = '\t' if path.endswith(('.tsv', '.txt')) else ','
+    if str is bytes:
+        lines, skipped = skip_comments(open(path, 'rb'))
+        reader = csv.reader(lines, delimiter=delimiter)
+        return ([field.decode('utf-8') for field in row] for row in reader), reader, skipped
+    lines, skipped = skip_comments(io.open(path, 'r', encoding='utf-8', newline=''))
+    reader = csv.reader(lines, delimiter=delimiter)
+    return reader, reader, skipped
+
+def skip_comments(f):
+    """Returns an iterator over the lines of the file f, without a byte order
+    mark and the lines starting with # at its start, and the number of those.
+    """
+    skipped = 0
+    for line in f:
+        bom = codecs.BOM_UTF8 if isinstance(line, bytes) else u'\ufeff'
+        if skipped == 0 and line.startswith(bom):
+            line = line[len(bom):]
+        if not line.startswith('#'):
+            return itertools.chain([line], f), skipped
+        skipped += 1
+    return iter([]), skipped
+
+def column_indices(header, columns=None):
+    """Returns a dict from field (e.g. 'question') to column index.
+    columns is a list of column names, or None to use the header row.
+    """
+    names = columns if columns is not None else header
+    indices = dict()
+    for i, name in enumerate(names):
+        field = COLUMN_NAMES.get(name.strip().lower())
+        if field is not None and field not in indices:
+            indices[field] = i
+    if 'question' not in indices or 'answer' not in indices:
+        raise ValueError("No question and answer columns among {}.".format(', '.join(names)))
+    return indices
+
+def clean_html(text):
+    """Returns the text of an html flashcard field, and the media in it.
+    """
+    media = RE_IMG.findall(text) + RE_SOUND.findall(text)
+    text = RE_SOUND.sub('', RE_IMG.sub('', RE_BR.sub('\n', text)))
+    text = RE_TAG.sub('', text)
+    for entity, char in HTML_ENTITIES:
+        text = text.replace(entity, char)
+    return text, media
+
+def split_media(field):
+    return [name.strip() for name in field.split(MEDIA_SEPARATOR) if name.strip()]
+
+def read_rows(path, columns=None, delimiter=None, html=False):
+    """Yields (category name, question, answer, question media, answer media,
+    line number) for every row of the file in path, as unicode strings.
+    """
+    rows, reader, skipped = open_rows(path, delimiter)
+    if columns is None:
+        indices = column_indices(next(rows))
+    else:
+        indices = column_indices(None, columns)
+    line_number = skipped + reader.line_num + 1
+    get = lambda row, field: row[indices[field]] if field in indices and indices[field] < len(row) else u''
+    for row in rows:
+        start, line_number = line_number, skipped + reader.line_num + 1
+        if not any(field.strip() for field in row):
+            continue
+        question, answer = get(row, 'question'), get(row, 'answer')
+        question_media = split_media(get(row, 'question_media'))
+        answer_media = split_media(get(row, 'answer_media'))
+        if html:
+            question, media = clean_html(question)
+            question_media.extend(media)
+            answer, media = clean_html(answer)
+            answer_media.extend(media)
+        category = u' '.join(get(row, 'category').split()) or u'Default'
+        yield category, question, answer, question_media, answer_media, start
+
+
+def load(path, columns=None, delimiter=None, html=False):
+    """Returns the rows of the file in path as a list of Category,
+    like parser.parse. Categories of the same name are merged.
+    """
+    categories = []
+    by_name = dict()
+    for category, question, answer, question_media, answer_media, line_number in read_rows(
+            path, columns, delimiter, html):
+        category = native(category)
+        if category not in by_name:
+            by_name[category] = Category(category)
+            categories.append(by_name[category])
+        qa = QuestionAnswer(native(normalise_newlines(question)), native(normalise_newlines(answer)),
+                            [native(m) for m in question_media], [native(m) for m in answer_media])
+        qa.line_number = line_number
+        by_name[category].append(qa)
+    return categories
+
+def normalise_newlines(text):
+    return text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+
+def ep_lines(question, answer, question_media, answer_media):
+    """Returns the lines of a question-answer in the quiz file format,
+    without line endings.
+    """
+    for name in question_media + answer_media:
+        if u']' in name or u'\n' in name:
+            raise ValueError("Media names cannot hold ] or line breaks: {}".format(name))
+    lines = []
+    if question_media:
+        lines.append(u'?' + u''.join(u'[{}]'.format(name) for name in question_media))
+    lines.extend(u'?' + escape(line) for line in normalise_newlines(question).split(u'\n'))
+    if answer_media:
+        lines.append(u''.join(u'[{}]'.format(name) for name in answer_media))
+    lines.extend(escape(line) for line in normalise_newlines(answer).split(u'\n'))
+    return lines
+
+def write_ep(rows, out):
+    """Writes rows from read_rows to the file object out, which takes
+    unicode strings, in the quiz file format. Returns the number of rows.
+    """
+    out.write(ESCAPES_PRAGMA + u'\n')
+    current = u'Default'
+    n = 0
+    for category, question, answer, question_media, answer_media, line_number in rows:
+        if category != current:
+            out.write(escape(category) + u'\n')
+            current = category
+        out.write(u'\n'.join(ep_lines(question, answer, question_media, answer_media)) + u'\n\n')
+        n += 1
+    return n
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    argparser = argparse.ArgumentParser(description="Import question-answers from a CSV or TSV file into a quiz file")
+    argparser.add_argument("source", help="CSV or TSV file. Files ending in .tsv or .txt are read as TSV.")
+    argparser.add_argument("target", help="Quiz file (.ep) to write.")
+    argparser.add_argument("--columns", default=None,
+                           help="Comma separated column names, e.g. question,answer,category, "
+                                "for files without a header row.")
+    argparser.add_argument("--delimiter", default=None, help="Field delimiter, if not comma or tab.")
+    argparser.add_argument("--html", action="store_true",
+                           help="Fields are html, as in flashcard exports. Tags are removed and media kept.")
+    args = argparser.parse_args()
+
+    t = time.time()
+    columns = args.columns.split(',') if args.columns else None
+    with io.open(args.target, 'w', encoding='utf-8') as out:
+        n = write_ep(read_rows(args.source, columns, args.delimiter, args.html), out)
+    t = time.time() - t
+    print("Wrote {} question-answers to {} in {:.1f}s ({:.0f} rows/s).".format(n, args.target, t, n / max(t, 1e-9)))
@@ -0,0 +1,368 @@
+# encoding: utf-8
+
+"""Incremental reparsing of a quiz file that is edited while
+a quiz is running.
+
+The file is split into blocks delimited by empty lines. Each block is
+parsed on its own and cached by the hash of its text, so on reload
+only blocks that changed are parsed again. Blocks are then linked
+into categories, the same way parser.parse would have done it.
+
+Changed blocks are compared with the blocks they replace, and their
+question-answers are matched up by position: an edited question-answer
+is updated in place, so every reference to it (including copies
+reinserted in a running QuizConductor) sees the new text.
+"""
+
+import os
+from difflib import SequenceMatcher
+from hashlib import sha1
+from os.path import abspath, dirname, join, normpath
+
+from course import CourseLoader, copy_categories, file_stat
+from parser import (LineParser, IncludeError, INCLUDE_LINE_RE, QUESTION_LINE_RE, is_escapes_pragma,
+                    open_quiz_file)
+from quiz_handler import Category
+
+# Errors from reading a quiz file that is being saved, or that
+# includes a file that is missing or misspelt
+READ_ERRORS = (IOError, OSError, EOFError, UnicodeDecodeError, IncludeError)
+
+
+class FileWatcher(object):
+    """Polls a file for changes by comparing os.stat results.
+    The terminal interface blocks on input, so the quiz can only react
+    to changes between questions anyway; polling there costs one stat call,
+    and an event based watcher (e.g. inotify) would not show changes any sooner.
+    """
+
+    def __init__(s, path):
+        s.path = path
+        s.last_stat = s.stat()
+
+    def stat(s):
+        try:
+            st = os.stat(s.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def changed(s):
+        """Returns True if the file changed since the last call.
+        """
+        current = s.stat()
+        if current == s.last_stat:
+            return False
+        s.last_stat = current
+        return True
+
+
+class BlockResult(object):
+    """The parsed contents of one block.
+    segments is a list of Category. The first one is a continuation
+    of whichever category was current before the block iff its
+    'continuation' attribute is True. The last one is the category
+    that is current after the block, even if it is empty.
+    """
+
+    def __init__(s, segments, first_line_number):
+        s.segments = segments
+        s.first_line_number = first_line_number
+
+    def qas(s):
+        return [qa for segment in s.segments for qa in segment]
+
+    def fingerprints(s):
+        """Fingerprints of s.qas(), computed once.
+        """
+        if getattr(s, '_fingerprints', None) is None:
+            s._fingerprints = [qa.fingerprint() for qa in s.qas()]
+        return s._fingerprints
+
+    def shift_line_numbers(s, first_line_number):
+        delta = first_line_number - s.first_line_number
+        if delta == 0:
+            return
+        for qa in s.qas():
+            if qa.line_number is not None:
+                qa.line_number += delta
+        s.first_line_number = first_line_number
+
+
+def split_blocks(lines):
+    """Splits lines into blocks of consecutive non-empty lines.
+    Returns a list of (first_line_number, lines) with 1-based line numbers.
+    Empty lines separate blocks, and belong to none of them.
+    """
+    blocks = []
+    current = []
+    start = 1
+    for i, line in enumerate(lines):
+        if line == '\n':
+            if current:
+                blocks.append((start, current))
+            current = []
+            start = i + 2
+        else:
+            current.append(line)
+    if current:
+        blocks.append((start, current))
+    return blocks
+
+def split_includes(blocks):
+    """Puts every include directive in a block of its own, so that a change
+    to one included file does not invalidate the other directives near it.
+    Directives can only occur before the first question of a block, since
+    the rest of the block is questions and answers.
+    """
+    out = []
+    for start, lines in blocks:
+        current = []
+        current_start = start
+        for i, line in enumerate(lines):
+            if QUESTION_LINE_RE.match(line):
+                current.extend(lines[i:])
+                break
+            if INCLUDE_LINE_RE.match(line):
+                if current:
+                    out.append((current_start, current))
+                out.append((start + i, [line]))
+                current = []
+                current_start = start + i + 1
+            else:
+                current.append(line)
+        if current:
+            out.append((current_start, current))
+    return out
+
+def block_hash(lines):
+    h = sha1()
+    for line in lines:
+        h.update(line if isinstance(line, bytes) else line.encode('utf-8'))
+    return h.hexdigest()
+
+def parse_block(lines, first_line_number, include=None, escapes=False):
+    """Parses a single block, and returns a BlockResult.
+    include is called with the path of every include directive
+    in the block, and returns the categories to put in its place.
+    escapes is whether the file starts with parser.ESCAPES_PRAGMA.
+    """
+    p = LineParser()
+    p.escapes = escapes
+    p.current_category = Category('')
+    p.current_category.continuation = True
+    p.line_number = first_line_number - 1
+    for line in lines:
+        p.parse_line(line)
+    # The empty line ending the block flushes the last answer,
+    # or abandons a question without an answer.
+    p.parse_line('\n')
+
+    segments = []
+    start = 0
+    for position, path, line_number in p.includes:
+        segments.extend(p.categories[start:position])
+        segments.extend(include(path))
+        start = position
+    segments.extend(p.categories[start:])
+    return BlockResult(segments + [p.current_category], first_line_number)
+
+
+class QuizChanges(object):
+    """The difference between two parses of the same file.
+    edited: question-answers that were updated in place.
+    removed: question-answers that no longer exist.
+    added: list of (qa, category name) for new question-answers.
+    """
+
+    def __init__(s):
+        s.edited = []
+        s.removed = []
+        s.added = []
+
+    def __len__(s):
+        return len(s.edited) + len(s.removed) + len(s.added)
+
+
+class IncrementalParser(object):
+    """Parses a quiz file, and on reload() reparses only
+    the blocks that changed since the last parse.
+    """
+
+    def __init__(s, file_path, unique=False, media_path_rel='./media'):
+        s.file_path = file_path
+        s.unique = unique
+        s.watcher = FileWatcher(file_path)
+        # For files included by file_path, which are parsed as a whole
+        s.loader = CourseLoader(media_path_rel=media_path_rel)
+        s.hashes = []
+        s.blocks = []
+        s.categories = []
+        s.error = None
+        s.escapes = False
+        s.reload()
+
+    def read_blocks(s):
+        with open_quiz_file(s.file_path) as f:
+            return split_includes(split_blocks(f))
+
+    def reload(s):
+        """Rereads the file, and returns a QuizChanges relative to
+        the previous parse. s.categories holds the new list of categories.
+        """
+        changes = QuizChanges()
+        old_hashes, old_blocks = s.hashes, s.blocks
+        blocks = s.read_blocks()
+        escapes = bool(blocks) and blocks[0][0] == 1 and is_escapes_pragma(blocks[0][1][0])
+        # Every block reads differently if the pragma is added or removed
+        hashes = [s.block_key(lines) + ('escapes' if escapes else '') for start, lines in blocks]
+        new_blocks = [None] * len(blocks)
+
+        # Changed blocks are all parsed before anything is updated,
+        # so the previous parse is kept whole if one of them fails
+        opcodes = SequenceMatcher(None, old_hashes, hashes, autojunk=False).get_opcodes()
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != 'equal':
+                for j in range(j1, j2):
+                    new_blocks[j] = parse_block(blocks[j][1], blocks[j][0], s.include, escapes)
+
+        s.hashes, s.blocks, s.escapes = hashes, new_blocks, escapes
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    result = old_blocks[i]
+                    result.shift_line_numbers(blocks[j][0])
+                    s.blocks[j] = result
+                continue
+            old_qas = [qa for result in old_blocks[i1:i2] for qa in result.qas()]
+            new_qas = [qa for result in s.blocks[j1:j2] for qa in result.qas()]
+            s.match(old_qas, new_qas, s.blocks[j1:j2], changes)
+
+        s.link(changes)
+        return changes
+
+    def include_path(s, path):
+        return normpath(join(dirname(abspath(s.file_path)), path))
+
+    def include(s, path):
+        """Returns copies of the categories of an included file.
+        """
+        path = s.include_path(path)
+        s.loader.refresh(path)
+        return copy_categories(s.loader.link(path, (abspath(s.file_path),)))
+
+    def block_key(s, lines):
+        """The hash of a block, which for blocks with include directives
+        also covers the contents of the included files.
+        """
+        key = block_hash(lines)
+        for line in lines:
+            match = INCLUDE_LINE_RE.match(line)
+            if match:
+                try:
+                    key += s.loader.subtree_digest(s.include_path(match.group(1).strip()))
+                except IncludeError:
+                    # Raised again by parse_block if the line is a directive,
+                    # and reload() then keeps the previous parse
+                    key += 'missing'
+        return key
+
+    def match(s, old_qas, new_qas, new_blocks, changes):
+        """Matches up the question-answers of replaced blocks with those
+        of the blocks replacing them. Unchanged ones are matched by contents,
+        the rest by position. Matched old objects take the new contents,
+        and replace the new objects in new_blocks.
+        """
+        if not old_qas:
+            changes.added.extend((qa, None) for qa in new_qas)
+            return
+        replacement = dict()
+        matcher = SequenceMatcher(None, [qa.fingerprint() for qa in old_qas],
+                                  [qa.fingerprint() for qa in new_qas], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            for old, new in zip(old_qas[i1:i2], new_qas[j1:j2]):
+                if tag != 'equal':
+                    changes.edited.append(old)
+                old.question = new.question
+                old.answer = new.answer
+                old.question_media = new.question_media
+                old.answer_media = new.answer_media
+                old.line_number = new.line_number
+                replacement[id(new)] = old
+            n = min(i2 - i1, j2 - j1)
+            changes.removed.extend(old_qas[i1+n:i2])
+            changes.added.extend((qa, None) for qa in new_qas[j1+n:j2])
+        for result in new_blocks:
+            for segment in result.segments:
+                segment[:] = [replacement.get(id(qa), qa) for qa in segment]
+
+    def link(s, changes):
+        """Joins the parsed blocks into a list of categories,
+        and fills in category names for added question-answers.
+        """
+        added = set(id(qa) for qa, name in changes.added)
+        category_of = dict()
+        categories = []
+        current = None
+        seen = set()
+        for result in s.blocks:
+            fingerprints = result.fingerprints() if s.unique else None
+            k = 0
+            for segment in result.segments:
+                if getattr(segment, 'continuation', False):
+                    if current is None:
+                        current = Category('Default')
+                        categories.append(current)
+                else:
+                    current = Category(segment.name)
+                    current.line_number = getattr(segment, 'line_number', None)
+                    categories.append(current)
+                if s.unique:
+                    qas = []
+                    for qa in segment:
+                        if fingerprints[k] not in seen:
+                            seen.add(fingerprints[k])
+                            qas.append(qa)
+                        k += 1
+                else:
+                    qas = segment
+                current.extend(qas)
+                if added:
+                    for qa in qas:
+                        if id(qa) in added:
+                            category_of[id(qa)] = current.name
+        # Added duplicates were left out above, so they are not added at all
+        changes.added = [(qa, category_of[id(qa)]) for qa, name in changes.added
+                         if id(qa) in category_of]
+        s.categories = [category for category in categories if len(category) > 0]
+
+    def poll(s):
+        """Returns a QuizChanges if the file changed since the last
+        call, or None otherwise.
+        The file may be missing or half written while an editor saves it,
+        or include a file that does not exist. If it cannot be read then,
+        the previous parse is kept, the error is kept in s.error, and the
+        file is read again on the next poll.
+        """
+        if s.error is not None:
+            s.watcher.changed()
+            return s.try_reload()
+        changed = s.watcher.changed()
+        for path, entry in list(s.loader.entries.items()):
+            try:
+                if file_stat(path) != entry.stat:
+                    changed = True
+            except OSError:
+                changed = True
+        if not changed:
+            return None
+        return s.try_reload()
+
+    def try_reload(s):
+        try:
+            changes = s.reload()
+        except READ_ERRORS as e:
+            s.error = e
+            return None
+        s.error = None
+        return changes
@@ -53,8 +53,16 @@ class QuizInterfaceBase(object):
         """
         raise NotImplementedError('show_answer is an abstract method - implement it yourself!')
     
+    def prefetch(s, qas):
+        """Optional. qas is a list of question-answers that may be shown next.
+        Called while the user answers the current question, so that they can
+        be prepared in the meantime.
+        """
+        pass
+
     def get_response(s):
-        """Returns the user's response to the current question
+        """Returns the user's response to the current question,
+        as a string or a list of lines, as typed.
         """
         raise NotImplementedError('get_response is an abstract method - implement it yourself!')
 
@@ -64,6 +72,27 @@ class QuizInterfaceBase(object):
         """
         raise NotImplementedError('get_evaluation is an abstract method - implement it yourself!')
 
+    def show_grade(s, correct, score):
+        """Optional. Called instead of get_evaluation when responses are
+        graded automatically (see grading.py), with the result and its
+        score between 0 and 1.
+        """
+        pass
+
+    def show_ungraded(s):
+        """Optional. Called instead of show_grade when responses are graded
+        together at the end of the round.
+        """
+        pass
+
+    def show_grades(s, qas, correct, scores):
+        """Optional. Called at the end of a round whose responses were graded
+        together, with lists of the question-answers, whether each response
+        was correct, and its score between 0 and 1. Questions answered wrong
+        are asked again after this.
+        """
+        pass
+
     def end_of_quiz(s, end_options):
         """Tell the user that the quiz is over
         end_options is a list of strings describing what options 
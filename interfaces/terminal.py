@@ -5,9 +5,58 @@ from base_interface import QuizInterfaceBase
 import re
 import platform
 import readline
+import threading
+import time
+from collections import OrderedDict
 from textwrap import TextWrapper
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 RE_WHITESPACE = re.compile("^\s*$")
+RE_UINT_LIST = re.compile("^[\d\s:]+$")
+
+# Word wrapped texts, by (width, text), oldest first. Shared with the
+# prefetching thread, so only touched while holding WRAPPED_LOCK.
+WRAPPED = OrderedDict()
+WRAPPED_LOCK = threading.Lock()
+WRAP_CACHE_SIZE = 1024
+MEDIA_READ_SIZE = 1 << 16
+
+def wrap(textwrapper, text):
+    """Returns textwrapper.fill(text), remembering the result, so that
+    text rendered over and over, or prefetched, is only wrapped once.
+    When the cache is full, the oldest text is forgotten.
+    """
+    key = (textwrapper.width, text)
+    with WRAPPED_LOCK:
+        wrapped = WRAPPED.get(key)
+    if wrapped is None:
+        # Wrapped outside the lock, so the main thread never waits for
+        # the prefetcher to finish wrapping a long text
+        wrapped = textwrapper.fill(text)
+        with WRAPPED_LOCK:
+            if key not in WRAPPED:
+                while len(WRAPPED) >= WRAP_CACHE_SIZE:
+                    WRAPPED.popitem(last=False)
+                WRAPPED[key] = wrapped
+    return wrapped
+
+def shows_media():
+    return platform.system() == 'Darwin' # OSX
+
+def remove_repetitions(values):
+    """Returns values without repetitions, keeping the first
+    occurrence of each, in linear time.
+    """
+    seen = set()
+    out = []
+    for v in values:
+        if v not in seen:
+            seen.add(v)
+            out.append(v)
+    return out
 
 class View(object):
     def __init__(self, terminal=None, input_gt=False, view=None):
@@ -71,7 +120,7 @@ class View(object):
         with self.t.fullscreen():
             for v in self.contents:
                 if word_wrap:
-                    print(self.textwrapper.fill(v))
+                    print(wrap(self.textwrapper, v))
                 else:
                     print(v)
             if self.input_gt:
@@ -82,6 +131,32 @@ def raw_input_prompt():
     return raw_input('> ')
 
 
+class Prefetcher(object):
+    """Runs prepare on question-answers in a daemon thread,
+    so that it happens while the main thread waits for input.
+    """
+
+    def __init__(s, prepare):
+        s.prepare = prepare
+        s.queue = Queue()
+        thread = threading.Thread(target=s.work)
+        thread.daemon = True
+        thread.start()
+
+    def put(s, qas):
+        s.queue.put(qas)
+
+    def work(s):
+        while True:
+            for qa in s.queue.get():
+                try:
+                    s.prepare(qa)
+                except Exception:
+                    # Prefetching only saves time; the main thread will
+                    # run into the same problem and report it
+                    pass
+
+
 class Terminal(QuizInterfaceBase):
     """This is the base user interface for an ExamPrepper quiz.
     Extend and implement it in subclasses, catering to different views.
@@ -95,6 +170,11 @@ class Terminal(QuizInterfaceBase):
 
         s.t = BlessedTerminal()
         s.view = View(s.t)
+        s.prefetcher = None
+        s.prefetch_pending = None
+        # Seconds from each evaluation until the next question was on screen
+        s.latencies = []
+        s.evaluated_at = None
         
     def set_media_folder(s, path):
         s.media_folder = path
@@ -126,10 +206,7 @@ class Terminal(QuizInterfaceBase):
             op.append(v0)
 
         if unique:
-            for i in range(len(op)):
-                for k in range(len(op)-1,i, -1):
-                    if op[i] == op[k]:
-                        op.pop(k)
+            op = remove_repetitions(op)
         return op
 
     def select_index_from_list(self, length, view, shift=0, select_multiple=False, accept_empty=False):
@@ -159,30 +236,80 @@ class Terminal(QuizInterfaceBase):
             view.push_if_new(error_message)
 
 
+    def parse_selection(s, line, index):
+        """Takes a string comprising one line, and a CategoryIndex,
+        and returns a list of unique indices into the indexed list.
+        Parts separated by commas or semicolons are either numbers and
+        ranges as understood by parse_uint_list (counting from 1),
+        or name patterns, e.g. 'chem*', or just part of a name.
+        """
+        selected = []
+        for part in re.split('[,;]', line):
+            part = part.strip()
+            if part == '':
+                continue
+            if RE_UINT_LIST.match(part):
+                selected.extend(i-1 for i in s.parse_uint_list(part) if 1 <= i <= len(index))
+            else:
+                selected.extend(index.search(part))
+        return remove_repetitions(selected)
+
     def select_categories(self, categories):
         """Allow the user to pick categories.
         Returns a list of selected categories.
+        Categories are listed a page at a time, and the list can be
+        filtered by name, so that thousands of categories stay manageable.
         """
-        view = View(self.t)
-        view.extend(["Please select the categories you want to be quizzed in by entering their numbers.", 
-                     "You can quickly select a range by using e.g. 3:7, instead of saying 3,4,5,6,7.",
-                     "You may select all categories by just pressing Enter." + view.vpad()],
-                     section_name='instructions')
-        
-        cats = []
-        for i,cat in enumerate(categories):
-            cats.append('{index}: ({length}) {name}'.format(index=str(i+1).rjust(3), 
-                                                            length=str(len(cat)), 
-                                                            name=cat.name))
-        view.extend(cats, section_name='categories')
-        view.push('')
+        from category_index import CategoryIndex
+        index = CategoryIndex([cat.name for cat in categories])
+        page_size = max(5, getattr(self.t, 'height', 24) - 12)
+        width = len(str(len(categories)))
+        shown = index.all()
+        query = ''
+        page = 0
+        error_message = None
 
-        idx = self.select_index_from_list(len(categories), view, shift=1, 
-                                    select_multiple=True, accept_empty=True)
-        if len(idx) == 0:
-            idx = range(len(categories))
-
-        return [categories[i] for i in idx]
+        while True:
+            n_pages = max(1, (len(shown) + page_size - 1) // page_size)
+            page = max(0, min(page, n_pages - 1))
+
+            view = View(self.t)
+            view.extend(["Please select the categories you want to be quizzed in by entering their numbers or names.", 
+                         "You can quickly select a range by using e.g. 3:7, instead of saying 3,4,5,6,7.",
+                         "Names may contain wildcards, as in chem*, and several selections are separated by commas.",
+                         "Enter n or p for the next or previous page, and /text to only list categories matching text.",
+                         "You may select all listed categories by just pressing Enter." + view.vpad()],
+                         section_name='instructions')
+
+            cats = []
+            for i in shown[page*page_size:(page+1)*page_size]:
+                cats.append('{index}: ({length}) {name}'.format(index=str(i+1).rjust(width), 
+                                                                length=str(len(categories[i])), 
+                                                                name=categories[i].name))
+            view.extend(cats, section_name='categories')
+            view.push(view.vpad() + 'Page {} of {}, listing {} of {} categories{}.'.format(
+                          page+1, n_pages, len(shown), len(categories),
+                          " matching '{}'".format(query) if query else ''))
+            if error_message:
+                view.push(error_message)
+            error_message = None
+
+            inp = view.render_execute(raw_input_prompt).strip()
+            if inp == '':
+                return [categories[i] for i in shown]
+            elif inp.lower() == 'n':
+                page += 1
+            elif inp.lower() == 'p':
+                page -= 1
+            elif inp.startswith('/'):
+                query = inp[1:].strip()
+                shown = index.search(query) if query else index.all()
+                page = 0
+            else:
+                idx = self.parse_selection(inp, index)
+                if len(idx) > 0:
+                    return [categories[i] for i in idx]
+                error_message = "Sorry, nothing matched '{}'.".format(inp)
 
     def select_ordering(self, order_options):
         """order_options is a list of methods, each defining a type of ordering.
@@ -272,11 +399,43 @@ class Terminal(QuizInterfaceBase):
         self.show_media(qa.answer_media)
         self.view.extend(a, section_name='answer')
     
+    def prefetch(self, qas):
+        """Prepares the given question-answers in a worker thread,
+        while the user answers the current question. The work starts
+        once the question is on screen, so it does not slow that down.
+        """
+        self.prefetch_pending = qas
+
+    def prepare(self, qa):
+        """Word wraps the text of qa, and reads its media files,
+        so that they are in the disk cache when shown.
+        """
+        textwrapper = TextWrapper(width=self.t.width, replace_whitespace=False)
+        wrap(textwrapper, qa.question)
+        wrap(textwrapper, qa.answer)
+        if not shows_media():
+            return
+        from os.path import join, isfile
+        for f in (qa.question_media or []) + (qa.answer_media or []):
+            path = join(self.media_folder, f)
+            if isfile(path):
+                with open(path, 'rb') as media:
+                    while media.read(MEDIA_READ_SIZE):
+                        pass
+
     def get_response(self):
         """Returns the user's response to the current question
         """
         self.view.push('Your answer (end with an empty line):', section_name='response_prompt')
         def handler():
+            if self.evaluated_at is not None:
+                self.latencies.append(time.time() - self.evaluated_at)
+                self.evaluated_at = None
+            if self.prefetch_pending:
+                if self.prefetcher is None:
+                    self.prefetcher = Prefetcher(self.prepare)
+                self.prefetcher.put(self.prefetch_pending)
+                self.prefetch_pending = None
             out = []
             while True:
                 inp = raw_input_prompt()
@@ -284,8 +443,7 @@ class Terminal(QuizInterfaceBase):
                 if inp == '':
                     return out
         response = self.view.render_execute(handler)
-        response = ['> ' + r for r in response]
-        self.view.extend(response + ['-'*(self.t.width/2)], section_name='response')
+        self.view.extend(['> ' + r for r in response] + ['-'*(self.t.width/2)], section_name='response')
         return response
 
     def get_evaluation(self):
@@ -296,13 +454,49 @@ class Terminal(QuizInterfaceBase):
         while True:
             inp = self.view.render_execute(raw_input_prompt)
             self.view.push('> ' + inp)
-            if inp.lower() == 'y':
-                return True
-            elif inp.lower() == 'n':
-                return False
+            if inp.lower() in ('y', 'n'):
+                self.evaluated_at = time.time()
+                return inp.lower() == 'y'
             else:
                 self.view.push("Sorry, not understood. y or n, please", section_name='error_msg')
 
+    def show_grade(self, correct, score):
+        """Tells the user how their response was graded, instead of asking them,
+        and waits for Enter, so the true answer can be read.
+        """
+        self.view.push("Graded {} (score {:.2f}). Press Enter to continue".format(
+                       'correct' if correct else 'wrong', score), section_name='eval_prompt')
+        self.view.render_execute(raw_input_prompt)
+        self.evaluated_at = time.time()
+
+    def show_ungraded(self):
+        """Tells the user their response is graded at the end of the round,
+        and waits for Enter, so the true answer can be read.
+        """
+        self.view.push("Your answer is graded at the end of the round. Press Enter to continue",
+                       section_name='eval_prompt')
+        self.view.render_execute(raw_input_prompt)
+        self.evaluated_at = time.time()
+
+    def show_grades(self, qas, correct, scores):
+        """Lists how the responses of the round were graded,
+        and waits for Enter.
+        """
+        view = View(self.t)
+        view.push("Your answers of this round were graded:" + view.vpad())
+        width = self.t.width - 20
+        for qa, ok, score in zip(qas, correct, scores):
+            question = qa.question.split('\n')[0]
+            if len(question) > width:
+                question = question[:width-3] + '...'
+            view.push('{} {:.2f}  {}'.format('correct' if ok else 'wrong  ', score, question))
+        n_wrong = correct.count(False)
+        view.push(view.vpad() + '{} of {} correct.{} Press Enter to continue'.format(
+                  len(correct) - n_wrong, len(correct),
+                  ' The questions answered wrong are asked again.' if n_wrong else ''))
+        view.render_execute(raw_input_prompt, word_wrap=False)
+        self.evaluated_at = time.time()
+
 
     def end_of_quiz(self, quiz_conductor, end_options):
         """Tell the user that the quiz is over
@@ -315,6 +509,13 @@ class Terminal(QuizInterfaceBase):
         view.push(view.vpad())
         view.push(view.hcenter('This is the end of the quiz! Good job!'))
         view.push(view.vpad())
+        if self.latencies:
+            latencies = self.latencies
+            view.push('The next question was shown {:.0f} ms after your evaluation on average, {:.0f} ms at most.'.format(
+                      1000 * sum(latencies) / len(latencies), 1000 * max(latencies)))
+            view.push(view.vpad())
+            self.latencies = []
+            self.evaluated_at = None
         view.push('Now, select one of the following options:')
 
         opt = []
@@ -364,7 +565,7 @@ class Terminal(QuizInterfaceBase):
     def show_media(self, media_list):
         if media_list == None or len(media_list) == 0:
             return
-        if platform.system() == 'Darwin': # OSX
+        if shows_media():
             from subprocess import call
             from os.path import join, isfile
             from tempfile import TemporaryFile
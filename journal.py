@@ -0,0 +1,290 @@
+# encoding: utf-8
+
+"""A journal of a quiz session, so it can be resumed if the program dies.
+
+The journal is a file of JSON lines, kept next to the quiz file in
+<quiz file>.journal, and only ever appended to during a round.
+Every line is a list, starting with the kind of record:
+
+    snapshot    the whole state of the QuizConductor: the queue of
+                questions, where in it the quiz is, reinsertion counts,
+                the number of questions seen and the time spent.
+    evaluation  whether a question was answered right, and where it
+                was reinserted in its category, if it was. Responses
+                graded at the end of the round are recorded as neither,
+                and a resumed session does not grade them.
+
+A snapshot is written when a round starts, after changes to the quiz file
+are merged in, and after every SNAPSHOT_EVERY evaluations. The queue in it
+is kept as an array of indices into the questions of the base categories,
+so a snapshot of a long queue is small and quick to read. Once the journal
+is COMPACT_FACTOR times as long as a snapshot, it is replaced by a journal
+holding just the latest snapshot, so it does not grow without bounds.
+To resume, the latest snapshot is restored, and only the evaluations after
+it are replayed. Reinsertions are replayed from their recorded positions,
+so no random choices are made again.
+
+Every line is flushed to the operating system when written, which is enough
+if only the program dies. fsync, which also survives a crash of the whole
+machine, is slow, so it is done for snapshots, and otherwise for every
+FSYNC_EVERY lines or FSYNC_SECONDS seconds.
+
+Every session is journaled, since one that was not cannot be resumed.
+The cost is mostly in starting a round, where the digest fingerprints every
+queued question: about half a second for 100,000 questions, whose snapshot
+is about 0.5 MB. Each evaluation takes some tens of microseconds.
+"""
+
+import base64
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from hashlib import sha1
+
+import numpy as np
+
+from parser import native
+
+JOURNAL_VERSION = 2
+SNAPSHOT_EVERY = 100
+FSYNC_EVERY = 16
+FSYNC_SECONDS = 2.0
+COMPACT_FACTOR = 8
+SNAPSHOT_MARK = b'["snapshot"'
+
+
+def encode_array(values):
+    """Returns the integers in values as an ascii string for JSON.
+    """
+    data = np.asarray(values, dtype='<i4').tobytes()
+    return base64.b64encode(data).decode('ascii')
+
+def decode_array(text):
+    return np.frombuffer(base64.b64decode(text.encode('ascii')), dtype='<i4')
+
+
+def base_keys(categories):
+    """Returns a dict from id() of every question-answer in categories to
+    its key, its index among all the question-answers of categories.
+    """
+    keys = dict()
+    offset = 0
+    for category in categories:
+        for p, qa in enumerate(category):
+            keys[id(qa)] = offset + p
+        offset += len(category)
+    return keys
+
+def queue_digest(qas_by_key):
+    """A digest of the question-answers in a dict from key to question-answer,
+    which tells whether they are still the same when the quiz file is reread.
+    """
+    h = sha1()
+    for key in sorted(qas_by_key):
+        fingerprint = qas_by_key[key].fingerprint()
+        if not isinstance(fingerprint, bytes):
+            fingerprint = fingerprint.encode('ascii')
+        h.update(fingerprint)
+    return h.hexdigest()
+
+
+def capture(qc, keys, digest):
+    """Returns a snapshot record of the state of the QuizConductor qc.
+    keys is from base_keys(qc.base_categories), and digest from queue_digest.
+    """
+    queue = [keys[id(qa)] for category in qc.categories for qa in category]
+    positions = dict((id(cat), c) for c, cat in enumerate(qc.base_categories))
+    selected = [positions[id(cat)] for cat in qc.selected_categories if id(cat) in positions]
+    reinserted = [(keys[i], count) for i, count in qc.reinsertion_counts.items() if i in keys]
+    return ['snapshot', {'version': JOURNAL_VERSION, 'time': time.time(),
+            'presets': qc.chosen_presets,
+            'marathon': qc.marathon,
+            'max_reinsertions': qc.max_reinsertions,
+            'selected_category_names': sorted(qc.selected_category_names),
+            'selected_indices': selected,
+            'base_names': [cat.name for cat in qc.base_categories],
+            'base_sizes': [len(cat) for cat in qc.base_categories],
+            'digest': digest,
+            'names': [cat.name for cat in qc.categories],
+            'lengths': encode_array([len(cat) for cat in qc.categories]),
+            'queue': encode_array(queue),
+            'reinserted': encode_array(reinserted),
+            'category_index': qc._current_category_index,
+            'question_index': qc._current_question_index,
+            'n_questions_seen': qc.n_questions_seen,
+            'elapsed': qc.elapsed_time().total_seconds()}]
+
+def restore(qc, snapshot):
+    """Puts the QuizConductor qc in the state of a snapshot record.
+    qc.base_categories must be the freshly read categories of the quiz file.
+    Returns whether it could, i.e. whether the quiz file is still the same.
+    """
+    from quiz_handler import Category
+    presets = dict((native(key), value) for key, value in snapshot['presets'].items())
+    presets['category_names'] = [native(name) for name in presets['category_names']]
+    queue = decode_array(snapshot['queue'])
+    base = qc.base_categories
+    if [cat.name for cat in base] != [native(name) for name in snapshot['base_names']]:
+        return False
+    chosen = snapshot['selected_indices']
+    offsets = np.cumsum([0] + snapshot['base_sizes'])
+    # Load the categories in the order setup did, then any others
+    # the queue holds questions of
+    used = np.unique(np.searchsorted(offsets, queue, 'right') - 1).tolist()
+    for c in list(chosen) + sorted(set(used) - set(chosen)):
+        if c >= len(base):
+            return False
+        if hasattr(base[c], 'load'):
+            base[c].load()
+    if [len(cat) for cat in base] != snapshot['base_sizes']:
+        return False
+    qas_by_key = dict()
+    for c in used:
+        for p, qa in enumerate(base[c]):
+            qas_by_key[int(offsets[c]) + p] = qa
+    qas = [qas_by_key[key] for key in queue.tolist()]
+    if queue_digest(dict((key, qas_by_key[key]) for key in set(queue.tolist()))) != snapshot['digest']:
+        return False
+
+    categories = []
+    start = 0
+    for name, length in zip(map(native, snapshot['names']), decode_array(snapshot['lengths']).tolist()):
+        category = Category(name)
+        category.extend(qas[start:start + length])
+        if name == 'random':
+            # Like ORDER_RANDOM, which gives its questions a category
+            for qa in category:
+                if not hasattr(qa, 'category'):
+                    qa.category = category
+        categories.append(category)
+        start += length
+
+    qc.categories = categories
+    qc.chosen_presets = presets
+    qc.presets = presets
+    qc.repetition_lag = presets['repetition_lag']
+    qc.marathon = snapshot['marathon']
+    qc.max_reinsertions = snapshot['max_reinsertions']
+    qc.selected_category_names = set(map(native, snapshot['selected_category_names']))
+    qc.selected_categories = [base[c] for c in chosen]
+    qc.known_category_names = set(cat.name for cat in base)
+    qc.reinsertion_counts = dict((id(qas_by_key[key]), count) for key, count in
+                                 decode_array(snapshot['reinserted']).reshape(-1, 2).tolist())
+    qc._current_category_index = snapshot['category_index']
+    qc._current_question_index = snapshot['question_index']
+    qc.n_questions_seen = snapshot['n_questions_seen']
+    qc.start_time = datetime.now() - timedelta(seconds=snapshot['elapsed'])
+    return True
+
+
+def encode_record(record):
+    return json.dumps(record).encode('utf-8') + b'\n'
+
+def read_journal(path):
+    """Returns the latest snapshot record in the journal in path, and the
+    evaluation records after it, or None if there is no usable journal.
+    Only the lines from the latest snapshot on are parsed.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    end = len(data)
+    while True:
+        start = data.rfind(b'\n' + SNAPSHOT_MARK, 0, end) + 1
+        if start == 0 and not data.startswith(SNAPSHOT_MARK):
+            return None
+        lines = data[start:].split(b'\n')
+        try:
+            kind, snapshot = json.loads(lines[0].decode('utf-8'))
+            break
+        except ValueError:
+            # A snapshot cut short by a crash; the one before still holds
+            if start == 0:
+                return None
+            end = start - 1
+    if snapshot.get('version') != JOURNAL_VERSION:
+        return None
+    evaluations = []
+    for line in lines[1:]:
+        try:
+            kind, correct, position = json.loads(line.decode('utf-8'))
+        except ValueError:
+            # The last line is cut short if the program died while writing it
+            break
+        evaluations.append((correct, position))
+    return snapshot, evaluations
+
+
+class Journal(object):
+    """Appends snapshot and evaluation records to the journal in path.
+    """
+
+    def __init__(s, path):
+        s.path = path
+        s.f = None
+        s.unsynced = 0
+        s.synced_at = time.time()
+        s.since_snapshot = 0
+
+    def open(s, new=False):
+        """Opens the journal for appending, emptying it first if new is True.
+        """
+        s.close()
+        s.f = open(s.path, 'wb' if new else 'ab')
+
+    def write(s, record):
+        s.f.write(encode_record(record))
+        s.f.flush()
+        s.unsynced += 1
+        if s.unsynced >= FSYNC_EVERY or time.time() - s.synced_at >= FSYNC_SECONDS:
+            s.sync()
+
+    def sync(s):
+        s.f.flush()
+        os.fsync(s.f.fileno())
+        s.unsynced = 0
+        s.synced_at = time.time()
+
+    def snapshot(s, record):
+        line = encode_record(record)
+        if s.f.tell() > COMPACT_FACTOR * len(line):
+            # The snapshot holds all that is needed to resume, so the journal
+            # can start over from it. The old one is kept until it is replaced.
+            temp_path = s.path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            s.f.close()
+            os.rename(temp_path, s.path)
+            s.f = open(s.path, 'ab')
+        else:
+            s.f.write(line)
+        s.sync()
+        s.since_snapshot = 0
+
+    def evaluation(s, correct, position):
+        """Records an answer, and where the question was reinserted (or None).
+        correct is None for a response not graded yet.
+        """
+        s.write(['evaluation', None if correct is None else bool(correct), position])
+        s.since_snapshot += 1
+
+    def snapshot_due(s):
+        return s.since_snapshot >= SNAPSHOT_EVERY
+
+    def close(s):
+        if s.f is not None:
+            s.sync()
+            s.f.close()
+            s.f = None
+
+    def remove(s):
+        """Closes and deletes the journal, once the session is over.
+        """
+        s.close()
+        if os.path.isfile(s.path):
+            os.remove(s.path)
@@ -0,0 +1,297 @@
+# encoding: utf-8
+
+"""Lazy loading of large quiz files.
+
+Instead of keeping the text of every question and answer in memory,
+the file is scanned once for where each question-answer is, and only
+these byte offsets are kept:
+
+    starts          where its question lines begin
+    answer_starts   where its answer lines begin
+    ends            where its answer lines end
+    line_numbers    the line its question starts on
+
+Its text and media names are read from a memory map of the file when
+they are used, and the most recently used ones are kept in a small cache.
+Memory use is then a fixed amount per question-answer, no matter how long
+the texts are.
+
+The offsets and categories of every file are saved next to it, in
+<quiz file>.idx, so the file is not scanned again until it changes.
+"""
+
+import json
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from os.path import abspath, dirname, isfile, join, normpath
+import numpy as np
+
+from course import file_stat
+from parser import (LineParser, IncludeError, extract_QuestionAnswer, COMMENT_LINE_RE,
+                    compressed_extension, decode_line, native, split_lines, to_unicode)
+from quiz_handler import Category, QuestionAnswer
+
+INDEX_VERSION = 2
+INDEX_COLUMNS = [('starts', '<u8'), ('answer_starts', '<u8'), ('ends', '<u8'), ('line_numbers', '<u4')]
+INDEX_ROW_SIZE = sum(np.dtype(dtype).itemsize for name, dtype in INDEX_COLUMNS)
+CACHE_SIZE = 64
+
+try:
+    array('Q')
+    OFFSET_TYPECODE = 'Q'
+except ValueError:
+    # Python 2 has no 'Q', but 'L' is 64 bits on 64 bit unix
+    OFFSET_TYPECODE = 'L'
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class IndexingLineParser(LineParser):
+    """A LineParser that records where in the file every question-answer
+    is, instead of keeping it. Lines are given as byte strings.
+    """
+
+    def __init__(s):
+        LineParser.__init__(s)
+        s.offset = 0
+        s.qa_start = s.answer_start = s.qa_end = None
+        s.starts = array(OFFSET_TYPECODE)
+        s.answer_starts = array(OFFSET_TYPECODE)
+        s.ends = array(OFFSET_TYPECODE)
+        s.line_numbers = array('I')
+        s.current_count = 0
+        s.category_names = []
+        s.category_line_numbers = []
+        s.category_qa_offsets = [0]
+
+    def parse_line(s, line):
+        start = s.offset
+        s.offset += len(line)
+        line = decode_line(line)
+        LineParser.parse_line(s, line)
+        if s.qa_buffer and s.qa_buffer[-1] is line:
+            if len(s.qa_buffer) == 1:
+                s.qa_start = start
+                s.answer_start = None
+            if s.building_answer and s.answer_start is None:
+                s.answer_start = start
+            s.qa_end = s.offset
+
+    def add_qa(s, qa):
+        s.starts.append(s.qa_start)
+        s.answer_starts.append(s.answer_start)
+        s.ends.append(s.qa_end)
+        s.line_numbers.append(qa.line_number)
+        s.current_count += 1
+
+    def flush_category(s, new_category_name=None):
+        if s.current_count > 0:
+            s.category_names.append(s.current_category.name)
+            s.category_line_numbers.append(getattr(s.current_category, 'line_number', None) or 0)
+            s.category_qa_offsets.append(len(s.starts))
+        else:
+            s.store_discarded_category(s.current_category)
+        s.current_count = 0
+
+        if new_category_name:
+            s.current_category = Category(new_category_name)
+            s.current_category.line_number = s.line_number
+        else:
+            s.current_category = Category('Default')
+
+    def include(s, path):
+        s.flush_category()
+        s.includes.append((len(s.category_names), path, s.line_number))
+
+
+class LazySource(object):
+    """The index of a single quiz file, and a cache of the
+    question-answers most recently read from it.
+    Media of included files are made relative to media_folder.
+    """
+
+    def __init__(s, path, media_folder=None):
+        s.path = path
+        s.media_folder = media_folder
+        s.data = None
+        s.cache = OrderedDict()
+        # The terminal interface reads questions from a prefetching thread too
+        s.lock = threading.Lock()
+
+    def scan(s):
+        s.stat = file_stat(s.path)
+        p = IndexingLineParser()
+        with open(s.path, 'rb') as f:
+            for line in f:
+                p.parse_line(line)
+            p.close()
+        for name, dtype in INDEX_COLUMNS:
+            setattr(s, name, np.array(getattr(p, name), dtype=dtype))
+        s.category_names = p.category_names
+        s.category_line_numbers = p.category_line_numbers
+        s.category_qa_offsets = p.category_qa_offsets
+        s.includes = p.includes
+        s.escapes = p.escapes
+
+    def read_index(s):
+        """Reads the saved index of the file, if it is up to date.
+        Returns whether it was.
+        """
+        try:
+            with open(index_path(s.path), 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if header['version'] != INDEX_VERSION or header['stat'] != list(file_stat(s.path)):
+                    return False
+                data = f.read()
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+        n = header['count']
+        if len(data) != n * INDEX_ROW_SIZE:
+            return False
+        s.stat = file_stat(s.path)
+        offset = 0
+        for name, dtype in INDEX_COLUMNS:
+            setattr(s, name, np.frombuffer(data, dtype=dtype, count=n, offset=offset))
+            offset += n * np.dtype(dtype).itemsize
+        s.category_names = [native(name) for name in header['category_names']]
+        s.category_line_numbers = header['category_line_numbers']
+        s.category_qa_offsets = header['category_qa_offsets']
+        s.includes = [(position, native(path), line_number)
+                      for position, path, line_number in header['includes']]
+        s.escapes = header['escapes']
+        return True
+
+    def write_index(s):
+        """Saves the index next to the file: a line of JSON with the
+        categories and includes, followed by the offset columns.
+        Nothing happens if it cannot be written.
+        """
+        path = index_path(s.path)
+        header = dict(version=INDEX_VERSION, stat=list(s.stat), count=len(s.starts),
+                      category_names=[to_unicode(name) for name in s.category_names],
+                      category_line_numbers=list(s.category_line_numbers),
+                      category_qa_offsets=list(s.category_qa_offsets),
+                      includes=[(position, to_unicode(include), line_number)
+                                for position, include, line_number in s.includes],
+                      escapes=s.escapes)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                for name, dtype in INDEX_COLUMNS:
+                    f.write(np.asarray(getattr(s, name), dtype=dtype).tobytes())
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError):
+            pass
+
+    def categories(s):
+        """Returns a list of Category of LazyQuestionAnswer, one for each
+        category in the file, without those of included files.
+        """
+        categories = []
+        offsets = s.category_qa_offsets
+        for j, name in enumerate(s.category_names):
+            category = Category(name)
+            category.line_number = s.category_line_numbers[j] or None
+            category.extend(LazyQuestionAnswer(s, i) for i in range(offsets[j], offsets[j+1]))
+            categories.append(category)
+        return categories
+
+    def entry(s, i):
+        """Returns (question, answer, question media, answer media)
+        of question-answer number i.
+        """
+        with s.lock:
+            entry = s.cache.pop(i, None)
+            if entry is None:
+                entry = s.read(i)
+                if len(s.cache) >= CACHE_SIZE:
+                    s.cache.popitem(last=False)
+            s.cache[i] = entry
+            return entry
+
+    def read(s, i):
+        if s.data is None:
+            with open(s.path, 'rb') as f:
+                s.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        lines = [decode_line(line) for line in split_lines(s.data[int(s.starts[i]):int(s.ends[i])])]
+        qa = extract_QuestionAnswer([line for line in lines if not COMMENT_LINE_RE.match(line)], s.escapes)
+        question_media, answer_media = qa.question_media, qa.answer_media
+        if s.media_folder is not None:
+            question_media = [join(s.media_folder, m) for m in question_media]
+            answer_media = [join(s.media_folder, m) for m in answer_media]
+        return qa.question, qa.answer, question_media, answer_media
+
+
+class LazyQuestionAnswer(QuestionAnswer):
+    """A QuestionAnswer that only knows where it is in its LazySource,
+    and reads its texts and media from there when they are used.
+    """
+    __slots__ = ('source', 'index')
+
+    def __init__(s, source, index):
+        s.source = source
+        s.index = index
+
+    question = property(lambda s: s.source.entry(s.index)[0])
+    answer = property(lambda s: s.source.entry(s.index)[1])
+    question_media = property(lambda s: s.source.entry(s.index)[2])
+    answer_media = property(lambda s: s.source.entry(s.index)[3])
+    line_number = property(lambda s: int(s.source.line_numbers[s.index]) or None)
+
+
+def load_file(path, media_path_rel, stack):
+    """Returns the categories of the quiz file in path, with included
+    files spliced in. stack holds the files including path.
+    """
+    if compressed_extension(path) is not None:
+        raise ValueError("{} is compressed, but lazy loading reads from "
+                         "an uncompressed quiz file.".format(path))
+    media_folder = normpath(join(dirname(path), media_path_rel)) if stack else None
+    source = LazySource(path, media_folder)
+    if not source.read_index():
+        source.scan()
+        source.write_index()
+
+    own = source.categories()
+    categories = []
+    start = 0
+    for position, include, line_number in source.includes:
+        include = normpath(join(dirname(path), include))
+        chain = stack + (path,)
+        if include in chain:
+            raise IncludeError("Include cycle: {}".format(' -> '.join(chain[chain.index(include):] + (include,))))
+        if not isfile(include):
+            raise IncludeError("{}, line {}: included file {} does not exist.".format(
+                               path, line_number, include))
+        categories.extend(own[start:position])
+        categories.extend(load_file(include, media_path_rel, chain))
+        start = position
+    categories.extend(own[start:])
+    return categories
+
+def load(file_path, unique=False, media_path_rel='./media'):
+    """Like parser.parse, but returns categories of LazyQuestionAnswer.
+    If unique is True, exact duplicates of earlier question-answers
+    are left out, which means reading all of them once.
+    """
+    categories = load_file(abspath(file_path), media_path_rel, ())
+    if not unique:
+        return categories
+    seen = set()
+    out = []
+    for category in categories:
+        kept = []
+        for qa in category:
+            fingerprint = qa.fingerprint()
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                kept.append(qa)
+        if kept:
+            category[:] = kept
+            out.append(category)
+    return out
@@ -1,12 +1,129 @@
 from quiz_handler import Category, QuestionAnswer
 from itertools import groupby
+import bz2
+import gzip
+import io
 import re
+try:
+    import lzma
+except ImportError:
+    # Python 2 has no lzma, so .xz quiz files need python 3
+    lzma = None
 
 QUESTION_LINE_RE = re.compile('^\?.*')
 MEDIA_CONTENT_RE = re.compile('^\??(?:\[([^\]]+)\])+')
 COMMENT_LINE_RE = re.compile('^\s*%.*')
+INCLUDE_LINE_RE = re.compile('^INCLUDE:(.+)$')
+# In files whose first line is ESCAPES_PRAGMA, a backslash before what would
+# otherwise be read as syntax makes it plain text, and a line of just a backslash
+# is an empty line in a question-answer. The pragma is a comment to older versions.
+# In other files, lines starting with a backslash are plain text, backslash and all,
+# so existing text such as LaTeX (\[ x \], \\, \%) keeps its meaning.
+ESCAPES_PRAGMA = '%!escapes'
+ESCAPED_LINE_RE = re.compile(r'^\\(?=[?%\[\\]|\s|INCLUDE:|$)')
 
 
+COMPRESSED_EXTENSIONS = ['.gz', '.bz2', '.xz']
+
+
+class IncludeError(Exception):
+    """Raised for include directives that cannot be followed,
+    because the file is missing, or because it includes itself.
+    """
+    pass
+
+
+def compressed_extension(path):
+    """Returns the compression extension of path (e.g. '.gz'), or None.
+    """
+    for extension in COMPRESSED_EXTENSIONS:
+        if path.endswith(extension):
+            return extension
+    return None
+
+def open_binary(path):
+    """Opens the quiz file in path for reading bytes. Files ending in
+    .gz, .bz2 or .xz are decompressed as they are read, a buffer at a time.
+    """
+    extension = compressed_extension(path)
+    if extension == '.gz':
+        # Python 2's GzipFile reads lines in pure python; the buffer does it in C
+        return io.BufferedReader(gzip.GzipFile(path, 'rb'))
+    if extension == '.bz2':
+        return bz2.BZ2File(path, 'rb')
+    if extension == '.xz':
+        if lzma is None:
+            raise IOError("Reading {} needs the lzma module of python 3.".format(path))
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+def open_quiz_file(path):
+    """Opens the quiz file in path for reading lines, the way LineParser
+    takes them, decompressing it as it is read if need be.
+    """
+    if compressed_extension(path) is None:
+        return open(path)
+    if str is bytes:
+        return open_binary(path)
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8')
+
+def decode_line(line):
+    """Turns a line read from open_binary into a line like open_quiz_file gives.
+    Under python 2, lines are kept as byte strings. Under python 3 they are
+    decoded, and line endings normalised like a file opened in text mode would.
+    """
+    if str is bytes:
+        return line
+    line = line.decode('utf-8')
+    if line.endswith('\r\n'):
+        line = line[:-2] + '\n'
+    return line
+
+def split_lines(data):
+    """Splits data into lines ending in a newline, like iterating over a file.
+    """
+    lines = [line + b'\n' for line in data.split(b'\n')]
+    if data.endswith(b'\n'):
+        lines.pop()
+    else:
+        lines[-1] = lines[-1][:-1]
+    return lines
+
+def to_unicode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8')
+    return text
+
+def native(text):
+    """Inverse of to_unicode: under python 2, parser.parse returns byte strings.
+    """
+    if str is bytes:
+        return text.encode('utf-8')
+    return text
+
+def is_escapes_pragma(line):
+    return line.strip() == ESCAPES_PRAGMA
+
+def unescape(line, escapes):
+    """Returns line without its escaping backslash, and whether it had one.
+    Lines are left as they are unless escapes is True, i.e. unless
+    the file starts with ESCAPES_PRAGMA.
+    """
+    if escapes and ESCAPED_LINE_RE.match(line):
+        return line[1:], True
+    return line, False
+
+def escape(line):
+    """Returns line with a backslash in front if it would otherwise be read
+    as anything but plain text, at the start of a question or answer line,
+    or as a category name. The inverse of unescape, for files starting
+    with ESCAPES_PRAGMA.
+    """
+    if (line.strip() == '' or line[0] in '?[\\' or line.lstrip().startswith('%')
+            or line.startswith('INCLUDE:')):
+        return '\\' + line
+    return line
+
 def extract_media(line):
     """Extracts text written in square brackets
     at the beginning of the line. More than one 
@@ -16,14 +133,18 @@ def extract_media(line):
     media = []
     while line.startswith('['):
         n = line.find(']')
+        if n == -1:
+            # Unmatched bracket; keep it as text
+            break
         media.append(line[1:n])
         line = line[n+1:]
     return line, media
 
-def extract_QuestionAnswer(lines):
+def extract_QuestionAnswer(lines, escapes=False):
     """Returns a QuestionAnswer.
     lines is a list of strings, and must be guaranteed to
     contain only a full, proper question and answer.
+    escapes is whether the file starts with ESCAPES_PRAGMA.
     """
     assert not any([COMMENT_LINE_RE.match(L) for L in lines]), "lines must not contain comments."
     assert not any([L == '' for L in lines]), "no empty lines are allowed in a question-answer."
@@ -41,13 +162,17 @@ def extract_QuestionAnswer(lines):
     for i,line in enumerate(lines):
         if not QUESTION_LINE_RE.match(line):
             break
-        line, media = extract_media(line[1:])
-        question_media.extend(media)
+        line, escaped = unescape(line[1:], escapes)
+        if not escaped:
+            line, media = extract_media(line)
+            question_media.extend(media)
         question_text.append(line)
 
     for line in lines[i:]:
-        line, media = extract_media(line)
-        answer_media.extend(media)
+        line, escaped = unescape(line, escapes)
+        if not escaped:
+            line, media = extract_media(line)
+            answer_media.extend(media)
         answer_text.append(line)
     
     qa = QuestionAnswer(''.join(question_text), 
@@ -59,15 +184,30 @@ def extract_QuestionAnswer(lines):
 
 
 class LineParser(object):
-    def __init__(s):
+    def __init__(s, unique=False, collect_diagnostics=False):
+        """If unique is True, a question-answer whose fingerprint
+        has already been seen is left out of the parsed categories,
+        and put in s.duplicates instead.
+        If collect_diagnostics is True, comments and discarded text are
+        kept in s.comments and s.discarded_text. Otherwise they are dropped,
+        so that they don't take up memory.
+        """
         s.current_category = Category('Default')
         s.categories = []
         s.qa_buffer = []
+        s.qa_line_number = None
         s.building_question = False
         s.building_answer = False
+        s.collect_diagnostics = collect_diagnostics
         s.discarded_text = []
         s.comments = []
-        s.line_number = -1
+        s.line_number = 0
+        s.unique = unique
+        s.seen_fingerprints = set()
+        s.duplicates = []
+        s.includes = []
+        # Set by ESCAPES_PRAGMA on the first line
+        s.escapes = False
 
     def clear(s):
         s.qa_buffer = []
@@ -75,7 +215,7 @@ class LineParser(object):
         s.building_question = False
 
     def store_discarded_qa(s):
-        if len(s.qa_buffer) > 0:
+        if len(s.qa_buffer) > 0 and s.collect_diagnostics:
             i = s.line_number - len(s.qa_buffer)
             for L in s.qa_buffer:
                 i += 1
@@ -83,7 +223,9 @@ class LineParser(object):
         s.qa_buffer = []
 
     def store_discarded_category(s, category):
-        if 'line_number' in category:
+        if not s.collect_diagnostics:
+            return
+        if getattr(category, 'line_number', None) is not None:
             i = category.line_number
         else:
             i = '<' + str(s.line_number)
@@ -95,9 +237,22 @@ class LineParser(object):
         """
         if len(s.qa_buffer) == 0:
             return
-        qa = extract_QuestionAnswer(s.qa_buffer)
-        s.current_category.append(qa)
+        qa = extract_QuestionAnswer(s.qa_buffer, s.escapes)
+        qa.line_number = s.qa_line_number
         s.clear()
+        if s.unique:
+            fingerprint = qa.fingerprint()
+            if fingerprint in s.seen_fingerprints:
+                s.duplicates.append(qa)
+                return
+            s.seen_fingerprints.add(fingerprint)
+        s.add_qa(qa)
+
+    def add_qa(s, qa):
+        """Puts a finished QuestionAnswer in the current category.
+        Override to do something else with it, e.g. stream it to a file.
+        """
+        s.current_category.append(qa)
 
     def flush_category(s, new_category_name=None):
         """flush the buffer for the current category
@@ -111,13 +266,17 @@ class LineParser(object):
 
         if new_category_name:
             s.current_category = Category(new_category_name)
+            s.current_category.line_number = s.line_number
         else:
             s.current_category = Category('Default')
 
     def parse_line(s, line):
         s.line_number += 1
         if COMMENT_LINE_RE.match(line):
-            s.comments.append(line)
+            if s.line_number == 1 and is_escapes_pragma(line):
+                s.escapes = True
+            if s.collect_diagnostics:
+                s.comments.append(line)
             return
         if line == '\n':
             if s.building_question:
@@ -133,6 +292,7 @@ class LineParser(object):
                 # flush_qa qa, begin
                 s.flush_qa()
                 s.building_question = True
+                s.qa_line_number = s.line_number
             s.qa_buffer.append(line)
             return
             # else
@@ -142,7 +302,19 @@ class LineParser(object):
         if s.building_answer:
             s.qa_buffer.append(line)
             return
-        s.flush_category(line)
+        match = INCLUDE_LINE_RE.match(line)
+        if match:
+            s.include(match.group(1).strip())
+            return
+        s.flush_category(unescape(line, s.escapes)[0])
+
+    def include(s, path):
+        """Marks that the categories of the quiz file in path go here.
+        s.includes gets (position in s.categories, path, line number).
+        Question-answers after the include go in a new category.
+        """
+        s.flush_category()
+        s.includes.append((len(s.categories), path, s.line_number))
 
     def close(s):
         s.flush_qa()
@@ -154,21 +326,30 @@ class LineParser(object):
     def get_discarded(s):
         return s.discarded_text
 
+    def get_duplicates(s):
+        return s.duplicates
 
-def parse(file_path):
-    """Interprets a quiz file in the given path, and returns
-    the parsed list of categories
-    """
-
-    p = LineParser()
-
-    with open(file_path) as f:
-        for i, line in enumerate(f):
-            p.parse_line(line)
-        p.close()
 
-    # print "Discarded text from quiz file:"
-    # for L,val in p.get_discarded():
-        # print str(L).rjust(5), val
+def parse_lines(lines, unique=False, collect_diagnostics=False):
+    """Runs the lines of a single quiz file through a LineParser,
+    and returns the parser. Include directives are not followed.
+    """
+    p = LineParser(unique=unique, collect_diagnostics=collect_diagnostics)
+    for line in lines:
+        p.parse_line(line)
+    p.close()
+    return p
 
-    return p.get_parsed()
+def parse(file_path, unique=False, lazy=False):
+    """Interprets a quiz file in the given path, and returns
+    the parsed list of categories, following include directives.
+    If unique is True, exact duplicates of earlier question-answers
+    are left out.
+    If lazy is True, question and answer texts are only read from
+    the file when they are used (see lazy.py).
+    """
+    if lazy:
+        from lazy import load
+        return load(file_path, unique=unique)
+    from course import CourseLoader
+    return CourseLoader(unique=unique).load(file_path)
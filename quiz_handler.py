@@ -5,9 +5,12 @@ This module handles parsing of quiz files (.ep format), quiz ordering,
 question issuance and question reinsertion.
 """
 
+import os
+import warnings
 import numpy as np
 from datetime import datetime
 from itertools import compress
+from hashlib import sha1
 
 def ORDER_RANDOM(categories):
     """Jumble all questions, regardless of categories.
@@ -57,6 +60,9 @@ ORDER_DICT = {'random': ORDER_RANDOM,
     'categories_random_and_random_within_category': ORDER_CATEGORIES_RANDOM_AND_RANDOM_WITHIN_CATEGORY
 }
 
+# Default cap on reinsertions of a single question per round, in marathon mode
+MARATHON_MAX_REINSERTIONS = 3
+
 
 
 class Category(list):
@@ -67,7 +73,7 @@ class Category(list):
 
         if qas:
             for qa in qas:
-                if not 'category' in dir(qa):
+                if not hasattr(qa, 'category'):
                     qa.category = s # Hack to circumvent ORDER_RANDOM where everything is put in a Category('random')
             s.extend(qas)
 
@@ -80,51 +86,117 @@ class Category(list):
 class QuestionAnswer(object):
     """Class holding the strings and relevant image paths for
     a quiz question-and-answer pair.
+    Large quizzes hold a great many of these, so they have no __dict__.
     """
+    __slots__ = ('question', 'answer', 'question_media', 'answer_media', 'line_number', 'category')
 
-    def __init__(s, question_str, answer_str, question_media=None, answer_media=None):
+    def __init__(s, question_str, answer_str, question_media=None, answer_media=None, line_number=None):
         s.answer = answer_str.strip()
         s.answer_media = answer_media
         s.question = question_str.strip()
         s.question_media = question_media
+        s.line_number = line_number
 
     def __repr__(s):
         return ''.join([QUESTION_START_SYMBOL, s.question, '\n', 
                         ANSWER_START_SYMBOL, s.answer])
 
+    def fingerprint(s):
+        """Returns a hex digest of the question, answer and media.
+        Unlike hash(), it is stable across runs and interpreters,
+        so it can be stored on disk and compared later.
+        """
+        h = sha1()
+        for part in (s.question, s.answer, 
+                     '\x1f'.join(s.question_media or []), 
+                     '\x1f'.join(s.answer_media or [])):
+            if not isinstance(part, bytes):
+                part = part.encode('utf-8')
+            h.update(part)
+            h.update(b'\x1e')
+        return h.hexdigest()
+
     def __hash__(s):
-        return hash(hash(s.question) + 
-                    hash(s.answer) +
-                    (hash(s.image_path) if s.image_path else 0))
+        return hash(s.fingerprint())
 
 class QuizConductor(object):
     """Responsible for ordering questions, handling 
     question repetitions, and delivering progress feedback.
     """
 
-    def __init__(s, categories, presets=None):
+    def __init__(s, categories, presets=None, source=None):
         """categories is a list of Category
         order is a function for ordering
         presets is a dict with optional key-value pairs for predefining settings:
             order: random, no_random, random_within_category, random_between_category, and
                    categories_random_and_random_within_category
             category_indices: a list of indices of chosen categories. Empty list for all categories.
+            category_names: a list of names of chosen categories, which is how the choice
+                   is remembered for a rerun, as indices change when the quiz file is edited.
             repetition_lag: an integer or a two-tuple of integers.
+            collapse_duplicates: a similarity threshold between 0 and 1. Near-duplicate
+                   questions above it are collapsed into one before ordering.
+            marathon: True for long running sessions. Each round starts from a compacted
+                   queue without reinserted copies, and reinsertions are capped.
+            max_reinsertions: how many times a question may be reinserted per round.
+                   Defaults to unlimited, or MARATHON_MAX_REINSERTIONS in marathon mode.
+            sample: an integer. Only this many of the chosen questions are asked,
+                   drawn by weight, favouring questions answered wrong or not recently.
+        source is an optional incremental.IncrementalParser for the quiz file.
+        With a source, the quiz file is actually reread when reloading, and
+        if s.watch is True, changes to it are merged in between questions.
+        s.weights_path is where the scores for sampling are kept, if anywhere.
+        s.journal_path is where the session is journaled, so it can be resumed
+        with resume_session() if the program dies (see journal.py).
+        If s.grader is set, e.g. to a grading.Grader, it grades the responses
+        instead of asking the user to evaluate them, unless the answer has
+        no words to grade by. If s.grade_later is True too, the responses are
+        graded together at the end of the round, which is quicker for many
+        of them, and the questions answered wrong are then asked again.
         """
         s.base_categories = categories
         s.reset_indices()
         s.repetition_lag = None
         s.presets = presets or dict()
+        s.chosen_presets = dict()
+        s.source = source
+        s.watch = False
+        # Marathon settings last for the whole session, unlike the other presets
+        s.marathon = s.presets.get('marathon', False)
+        s.max_reinsertions = s.presets.get('max_reinsertions',
+                                           MARATHON_MAX_REINSERTIONS if s.marathon else None)
+        s.reinsertion_counts = dict()
+        s.weights_path = None
+        s.weights = None
+        s.journal_path = None
+        s.journal = None
+        s.grader = None
+        s.grade_later = False
+        # (question-answer, response) to be graded at the end of the round
+        s.ungraded = []
 
     def reinsert(s, qa):
+        """Puts qa back in the current category, according to the repetition lag.
+        Returns where it was put, or None if it was reinserted too often already.
+        """
+        if s.max_reinsertions is not None:
+            if s.reinsertion_counts.get(id(qa), 0) >= s.max_reinsertions:
+                return None
+
         if s.repetition_lag == 'random':
             pos = np.random.random() * s.get_unseen_questions_in_category_count() + s._current_question_index
             pos = int(pos)
-            s.current_category.insert(pos, qa)
         elif s.repetition_lag >= 0:
-            s.current_category.insert(s._current_question_index + s.repetition_lag + 1, qa)
+            pos = s._current_question_index + s.repetition_lag + 1
         else:
-            s.current_category.append(qa)
+            pos = len(s.current_category)
+        s.reinsert_at(qa, pos)
+        return pos
+
+    def reinsert_at(s, qa, pos):
+        if s.max_reinsertions is not None:
+            s.reinsertion_counts[id(qa)] = s.reinsertion_counts.get(id(qa), 0) + 1
+        s.current_category.insert(pos, qa)
 
     def update(s):
         """Updates the pointers to current category and question
@@ -140,19 +212,42 @@ class QuizConductor(object):
         s._current_category_index = 0
         s._current_question_index = -1
 
+    def compact(s):
+        """Removes copies of questions inserted due to repetition,
+        keeping the first occurrence of each. The categories are replaced
+        by new Category objects, so reinsertions never grow the
+        categories they were selected from.
+        """
+        compacted = []
+        for category in s.categories:
+            seen = set()
+            kept = Category(category.name)
+            for qa in category:
+                if id(qa) not in seen:
+                    seen.add(id(qa))
+                    kept.append(qa)
+            compacted.append(kept)
+        s.categories = compacted
+        s.reinsertion_counts = dict()
+
     def __iter__(s):
         return s
 
     def next(s):
         s._current_question_index += 1
-        if s._current_question_index >= len(s.current_category):
+        # A loop, since reloading may leave the current category empty
+        while s._current_question_index >= len(s.current_category):
             s._current_category_index += 1
             s._current_question_index = 0
             if s._current_category_index >= len(s.categories):
                 raise StopIteration
+            s.current_category = s.categories[s._current_category_index]
         s.update()
         return s.current_question
 
+    # For python 3, where the tests run
+    __next__ = next
+
     def get_total_progress(s):
         return float(s.get_total_questions_done_count())/s.get_total_question_count()
         
@@ -210,7 +305,11 @@ class QuizConductor(object):
         else:
             order = ui.select_ordering(ORDER_OPTIONS)
 
-        if 'category_indices' in presets:
+        if 'category_names' in presets:
+            # Every category of a chosen name, wherever it is in the reread file
+            names = set(presets['category_names'])
+            s.categories = [cat for cat in s.base_categories if cat.name in names]
+        elif 'category_indices' in presets:
             category_indices = presets['category_indices']
             s.categories = list(compress(s.base_categories, 
                                         map(lambda x: x in category_indices, 
@@ -220,50 +319,331 @@ class QuizConductor(object):
                                 )
         else:
             s.categories = ui.select_categories(s.base_categories)
+        # In the order they were chosen in, which is the order they are loaded in
+        s.selected_categories = list(s.categories)
+
+        # Categories read by deferred.DeferredSource are only parsed once chosen
+        for category in s.categories:
+            if hasattr(category, 'load'):
+                category.load()
+        # Ordering and reinsertions change the categories of the quiz in place,
+        # but the base categories must keep the order of the quiz file
+        from course import copy_categories
+        s.categories = [cat for cat in s.categories if len(cat) > 0]
+        s.categories = copy_categories(s.categories)
 
         if 'repetition_lag' in presets:
             s.repetition_lag = presets['repetition_lag']
         else:
             s.repetition_lag = ui.select_repetition_lag()
 
+        # Remember the choices, so the quiz can be rerun with the same options
+        s.selected_category_names = set(cat.name for cat in s.categories)
+        s.chosen_presets = dict(presets)
+        s.chosen_presets['order'] = [k for k, v in ORDER_DICT.items() if v is order][0]
+        s.chosen_presets.pop('category_indices', None)
+        s.chosen_presets['category_names'] = sorted(s.selected_category_names)
+        s.chosen_presets['repetition_lag'] = s.repetition_lag
+
+        if 'collapse_duplicates' in presets:
+            from dedup import collapse_duplicates
+            s.categories = collapse_duplicates(s.categories, presets['collapse_duplicates'])
+
+        if 'sample' in presets:
+            s.categories = s.sample(s.categories, presets['sample'])
+
         s.categories = order(s.categories)
 
+    def sample(s, categories, k):
+        """Returns categories holding k of the question-answers in categories,
+        drawn by weight, in their original order, or all of them if there
+        are no more than k.
+        s.weights keeps the weights up to date as questions are answered.
+        """
+        from sampling import QuestionWeights
+        s.weights = QuestionWeights([qa for cat in categories for qa in cat], s.weights_path)
+        k = min(k, len(s.weights.qas))
+        chosen = set(id(qa) for qa in s.weights.sample(k))
+        sampled = []
+        for category in categories:
+            kept = Category(category.name)
+            kept.extend(qa for qa in category if id(qa) in chosen)
+            if kept:
+                sampled.append(kept)
+        return sampled
+
+    def reload(s):
+        """Rereads the quiz file into s.base_categories, if there is a source.
+        """
+        if s.source is not None:
+            s.source.reload()
+            s.base_categories = s.source.categories
+
+    def poll_source(s):
+        """Merges changes to the quiz file into the running quiz.
+        """
+        if s.source is None or not s.watch:
+            return
+        changes = s.source.poll()
+        if changes is None:
+            return
+        s.base_categories = s.source.categories
+        s.apply_changes(changes)
+        if s.journal is not None:
+            s.start_journal(new=False)
+
+    def apply_changes(s, changes):
+        """Merges an incremental.QuizChanges into the running quiz.
+        Edited questions were already updated in place. Removed questions are
+        taken out of the queue, including reinserted copies, and added
+        questions are put at the end of a category of the same name.
+        Progress is kept, as the current position is adjusted for removals.
+        """
+        if changes.removed:
+            removed = set(id(qa) for qa in changes.removed)
+            for category in s.categories:
+                if category is s.current_category:
+                    gone = sum(1 for qa in category[:s._current_question_index + 1] if id(qa) in removed)
+                    s._current_question_index -= gone
+                category[:] = [qa for qa in category if id(qa) not in removed]
+            s.categories = [cat for cat in s.categories
+                            if len(cat) > 0 or cat is s.current_category]
+            s._current_category_index = [id(cat) for cat in s.categories].index(id(s.current_category))
+
+        base_names = set(cat.name for cat in s.base_categories)
+        for qa, name in changes.added:
+            same_name = [cat for cat in s.categories if cat.name == name]
+            if s.current_category in same_name:
+                s.current_category.append(qa)
+            elif same_name:
+                same_name[-1].append(qa)
+            elif name in s.selected_category_names:
+                # The categories were reordered, e.g. all put into one
+                s.current_category.append(qa)
+            elif name in base_names and name not in s.known_category_names:
+                # A category that did not exist when the quiz was set up
+                s.categories.append(Category(name, [qa]))
+                s.selected_category_names.add(name)
+                s.chosen_presets['category_names'] = sorted(s.selected_category_names)
+        s.known_category_names = base_names
+
+    def peek_next(s):
+        """Returns the question-answers that may be asked next: the next one
+        in the queue, and the current one, if a wrong answer could put it
+        right after itself.
+        """
+        qas = []
+        category_index = s._current_category_index
+        question_index = s._current_question_index + 1
+        while category_index < len(s.categories):
+            category = s.categories[category_index]
+            if question_index < len(category):
+                qas.append(category[question_index])
+                break
+            category_index += 1
+            question_index = 0
+        if (s.repetition_lag == 'random' or s.repetition_lag == 0
+                or s.get_unseen_questions_in_category_count() == 0):
+            qas.append(s.current_question)
+        return qas
+
     def handle_question(s, ui, qa):
         ui.show_question(qa)
+        ui.prefetch(s.peek_next())
         response = ui.get_response()
         ui.show_answer(qa)
-        answer_ok = ui.get_evaluation()
-        if not answer_ok:
-            s.reinsert(s.current_question)
+        if s.grader is not None and s.grader.gradable(qa) and s.grade_later:
+            s.ungraded.append((qa, response))
+            ui.show_ungraded()
+            answer_ok = None
+        elif s.grader is not None and s.grader.gradable(qa):
+            score = s.grader.score(qa, response)
+            answer_ok = score >= s.grader.threshold
+            ui.show_grade(answer_ok, score)
+        else:
+            answer_ok = ui.get_evaluation()
+        if s.weights is not None and answer_ok is not None:
+            s.weights.record(qa, answer_ok)
+        position = None
+        if answer_ok is False:
+            position = s.reinsert(s.current_question)
+        if s.journal is not None:
+            try:
+                s.journal.evaluation(answer_ok, position)
+                if s.journal.snapshot_due():
+                    s.save_snapshot()
+            except (IOError, OSError) as e:
+                s.stop_journal(e)
+
+    def grade_ungraded(s, ui):
+        """Grades the responses kept by handle_question all at once, once the
+        round is through its queue, and puts the questions answered wrong at
+        the end of the queue. Returns whether it did, so the round goes on.
+        """
+        if not s.ungraded:
+            return False
+        qas = [qa for qa, response in s.ungraded]
+        scores = s.grader.scores(qas, [response for qa, response in s.ungraded])
+        correct = [bool(score >= s.grader.threshold) for score in scores]
+        s.ungraded = []
+        ui.show_grades(qas, correct, scores.tolist())
+
+        # Back to the last question of the round, as if it was just answered
+        s._current_category_index = len(s.categories) - 1
+        s._current_question_index = len(s.categories[-1]) - 1
+        s.update()
+        reinserted = False
+        for qa, answer_ok in zip(qas, correct):
+            if s.weights is not None:
+                s.weights.record(qa, answer_ok)
+            if answer_ok:
+                continue
+            if s.max_reinsertions is None or s.reinsertion_counts.get(id(qa), 0) < s.max_reinsertions:
+                s.reinsert_at(qa, len(s.current_category))
+                reinserted = True
+        if s.journal is not None:
+            s.start_journal(new=False)
+        return reinserted
+
+    def start_journal(s, new=True):
+        """Starts journaling the session in s.journal_path, if set, with a
+        snapshot of the current state. Unless new is False, the journal
+        of the previous round is emptied first.
+        """
+        if s.journal_path is None:
+            return
+        from journal import Journal, base_keys, queue_digest
+        try:
+            if s.journal is None:
+                s.journal = Journal(s.journal_path)
+            if new or s.journal.f is None:
+                s.journal.open(new=new)
+            # The base categories and the queued questions only change with the
+            # quiz file, so their keys and digest are kept for later snapshots
+            s.journal_keys = base_keys(s.base_categories)
+            queued = dict((s.journal_keys[id(qa)], qa) for category in s.categories for qa in category)
+            s.journal_digest = queue_digest(queued)
+            s.save_snapshot()
+        except (IOError, OSError) as e:
+            s.stop_journal(e)
+
+    def stop_journal(s, error):
+        """Goes on without a journal, e.g. when the quiz file is on
+        read-only storage, after warning once that the session cannot be resumed.
+        What was journaled so far is out of date, so it is removed if possible.
+        """
+        warnings.warn("Cannot write the journal {} ({}). The session goes on, "
+                      "but cannot be resumed if cut short.".format(s.journal_path, error))
+        journal, s.journal = s.journal, None
+        s.journal_path = None
+        if journal is not None:
+            try:
+                if journal.f is not None:
+                    journal.f.close()
+                os.remove(journal.path)
+            except (IOError, OSError):
+                pass
+
+    def save_snapshot(s):
+        from journal import capture
+        s.journal.snapshot(capture(s, s.journal_keys, s.journal_digest))
+        # Scores are otherwise only saved at the end of a round
+        if s.weights is not None:
+            s.weights.save()
+
+    def resume_session(s):
+        """Restores the session journaled in s.journal_path, from its latest
+        snapshot and the answers given after it. Returns whether it could;
+        if not, e.g. because the quiz file changed, the session starts over.
+        run(ui, resumed=True) then continues it.
+        """
+        from journal import read_journal, restore
+        if s.journal_path is None:
+            return False
+        journaled = read_journal(s.journal_path)
+        if journaled is None:
+            return False
+        snapshot, evaluations = journaled
+        if not restore(s, snapshot):
+            return False
+        if 'sample' in s.chosen_presets:
+            from sampling import QuestionWeights
+            seen = set()
+            qas = [qa for cat in s.categories for qa in cat
+                   if id(qa) not in seen and not seen.add(id(qa))]
+            s.weights = QuestionWeights(qas, s.weights_path)
+        s.update()
+        for answer_ok, position in evaluations:
+            qa = s.next()
+            s.n_questions_seen += 1
+            # Responses to be graded at the end of the round are not journaled
+            if s.weights is not None and answer_ok is not None:
+                s.weights.record(qa, answer_ok)
+            if position is not None:
+                s.reinsert_at(qa, position)
+        s.start_journal(new=False)
+        return True
 
     def handle_end(self, ui):
+        """Asks the user what to do now that the quiz is over.
+        Returns None to exit, or whether the next round needs setup.
+        """
         options = ['Exit program',
                    'Reload quiz file and set options again',
                    'Reload quiz file and rerun with same options']
+        if self.weights is not None:
+            self.weights.save()
         res = ui.end_of_quiz(self, options)
+        if res not in (1, 2) and self.journal is not None:
+            # The session is over, and there is nothing left to resume
+            try:
+                self.journal.remove()
+            except (IOError, OSError) as e:
+                self.stop_journal(e)
         
         self.reset_indices()
         if res == 1:
+            self.reload()
             self.presets = dict()
-            self.run(ui, with_setup=True)
+            return True
         elif res == 2:
-            self.run(ui, with_setup=False)
+            if self.source is None:
+                return False
+            self.reload()
+            self.presets = self.chosen_presets
+            return True
         # else just exit
-
-
-
-    def run(self, ui, with_setup=True):
-        if with_setup: self.setup(ui, self.presets)
-        self.update()
-        self.n_questions_seen = 0
-        self.start_time = datetime.now()
-
-        for qa in self:
-            self.n_questions_seen += 1
-            ui.show_current_info(self)
-            self.handle_question(ui,qa)
-
-        self.handle_end(ui)
+        return None
+
+    def run(self, ui, with_setup=True, resumed=False):
+        # Rounds are run in a loop rather than by recursion from handle_end,
+        # so the state of finished rounds can be released.
+        # If resumed is True, the first round continues a resumed session.
+        while with_setup is not None:
+            if resumed:
+                resumed = False
+            else:
+                if with_setup: self.setup(ui, self.presets)
+                if self.marathon:
+                    self.compact()
+                self.reinsertion_counts = dict()
+                self.known_category_names = set(cat.name for cat in self.base_categories)
+                self.update()
+                self.n_questions_seen = 0
+                self.start_time = datetime.now()
+                self.start_journal()
+
+            while True:
+                for qa in self:
+                    self.n_questions_seen += 1
+                    ui.show_current_info(self)
+                    self.handle_question(ui,qa)
+                    self.poll_source()
+                # Questions answered wrong, once graded, are asked again
+                if not self.grade_ungraded(ui):
+                    break
+
+            with_setup = self.handle_end(ui)
 
 
 # End of class QuizConductor
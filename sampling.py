@@ -0,0 +1,196 @@
+# encoding: utf-8
+
+"""Weighted sampling of a few questions out of a large quiz.
+
+Every question-answer has a score, which is multiplied by
+WRONG_FACTOR when it is answered wrong and by RIGHT_FACTOR when it is
+answered right, and the time it was last answered. Its sampling weight
+is its score, raised for questions not answered for a while (or never):
+
+    weight = score * (1 + min(days since last answered, MAX_AGE_DAYS) / AGE_DAYS)
+
+The weights are kept in a numpy array and a Fenwick tree over it, so
+drawing k questions without replacement takes O(k log n), and the weight
+of a question is updated in O(log n) as soon as it is answered.
+Scores are stored next to the quiz file, keyed by question fingerprint,
+so they survive edits to the file.
+"""
+
+import os
+import time
+import numpy as np
+
+WRONG_FACTOR = 2.0
+RIGHT_FACTOR = 0.5
+MIN_SCORE = 1.0 / 16
+MAX_SCORE = 16.0
+AGE_DAYS = 7.0
+MAX_AGE_DAYS = 28.0
+SECONDS_PER_DAY = 24 * 60 * 60.0
+
+
+def compute_weights(scores, last_seen, now):
+    """Sampling weights for arrays of scores and last answer times
+    (seconds since the epoch, 0 for never).
+    """
+    age = np.where(last_seen > 0, (now - last_seen) / SECONDS_PER_DAY, MAX_AGE_DAYS)
+    return scores * (1 + np.clip(age, 0, MAX_AGE_DAYS) / AGE_DAYS)
+
+def to_fingerprint(qa):
+    fingerprint = qa.fingerprint()
+    if not isinstance(fingerprint, bytes):
+        fingerprint = fingerprint.encode('ascii')
+    return fingerprint
+
+
+class FenwickTree(object):
+    """Prefix sums over an array of non-negative weights, with
+    O(log n) updates and O(log n) search for a prefix sum.
+    """
+
+    def __init__(s, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        s.n = len(weights)
+        s.weights = weights.copy()
+        # Node i (1-based) holds the sum of the lowbit(i) weights ending at i
+        i = np.arange(1, s.n + 1)
+        cumsum = np.concatenate([[0.0], np.cumsum(weights)])
+        s.tree = np.zeros(s.n + 1)
+        s.tree[1:] = cumsum[i] - cumsum[i - (i & -i)]
+        s.top = 1 << s.n.bit_length() if s.n else 0
+
+    def prefix_sum(s, count):
+        """The sum of the first count weights.
+        """
+        total = 0.0
+        i = count
+        while i > 0:
+            total += s.tree[i]
+            i -= i & -i
+        return total
+
+    def total(s):
+        return s.prefix_sum(s.n)
+
+    def set(s, index, weight):
+        delta = weight - s.weights[index]
+        s.weights[index] = weight
+        i = index + 1
+        while i <= s.n:
+            s.tree[i] += delta
+            i += i & -i
+
+    def find(s, value):
+        """Returns the index whose weight spans value, in the
+        prefix sums of the weights.
+        """
+        pos = 0
+        step = s.top
+        while step:
+            nxt = pos + step
+            if nxt <= s.n and s.tree[nxt] <= value:
+                pos = nxt
+                value -= s.tree[nxt]
+            step >>= 1
+        # Guard against rounding errors pointing past the end or at a zero weight
+        while pos < s.n and s.weights[pos] == 0:
+            pos += 1
+        if pos == s.n:
+            pos = np.flatnonzero(s.weights)[-1]
+        return pos
+
+    def sample(s, k):
+        """Draws k distinct indices, each with probability proportional
+        to its weight among those not drawn yet.
+        """
+        drawn = []
+        removed = []
+        for _ in range(min(k, int(np.count_nonzero(s.weights)))):
+            i = s.find(np.random.random() * s.total())
+            drawn.append(i)
+            removed.append(s.weights[i])
+            s.set(i, 0.0)
+        for i, weight in zip(drawn, removed):
+            s.set(i, weight)
+        return drawn
+
+
+class QuestionWeights(object):
+    """Scores of a list of question-answers, for sampling among them.
+    If file_path is given, scores are read from and saved to it.
+    """
+
+    def __init__(s, qas, file_path=None):
+        s.qas = qas
+        s.file_path = file_path
+        s.index = dict((id(qa), i) for i, qa in enumerate(qas))
+        s.scores = np.ones(len(qas))
+        s.last_seen = np.zeros(len(qas))
+        s.stored = None
+        s._fingerprints = None
+        if file_path is not None and os.path.isfile(file_path):
+            s.load()
+        s.tree = FenwickTree(compute_weights(s.scores, s.last_seen, time.time()))
+
+    def fingerprints(s):
+        """Fingerprints of s.qas, as a list of byte strings.
+        """
+        if s._fingerprints is None:
+            s._fingerprints = [to_fingerprint(qa) for qa in s.qas]
+        return s._fingerprints
+
+    def load(s):
+        """Reads stored scores, and matches them to s.qas by fingerprint.
+        """
+        with np.load(s.file_path) as data:
+            stored = dict((name, data[name]) for name in ['fingerprints', 'scores', 'last_seen'])
+        position = dict((fingerprint, i) for i, fingerprint in enumerate(stored['fingerprints'].tolist()))
+        s.stored_pos = np.array([position.get(fingerprint, -1) for fingerprint in s.fingerprints()],
+                                dtype=np.int64)
+        found = s.stored_pos >= 0
+        s.scores[found] = stored['scores'][s.stored_pos[found]]
+        s.last_seen[found] = stored['last_seen'][s.stored_pos[found]]
+        s.stored = stored
+
+    def save(s):
+        """Writes the scores to s.file_path, keeping stored scores
+        of questions that are not in s.qas.
+        Nothing happens if it cannot be written, e.g. next to a read-only quiz file.
+        """
+        if s.file_path is None:
+            return
+        fingerprints = np.array(s.fingerprints(), dtype='S40')
+        if s.stored is None:
+            scores, last_seen = s.scores, s.last_seen
+        else:
+            new = s.stored_pos < 0
+            fingerprints = np.concatenate([s.stored['fingerprints'], fingerprints[new]])
+            scores = np.concatenate([s.stored['scores'], s.scores[new]])
+            last_seen = np.concatenate([s.stored['last_seen'], s.last_seen[new]])
+            old = ~new
+            scores[s.stored_pos[old]] = s.scores[old]
+            last_seen[s.stored_pos[old]] = s.last_seen[old]
+        temp_path = s.file_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez(f, fingerprints=fingerprints, scores=scores, last_seen=last_seen)
+            os.rename(temp_path, s.file_path)
+        except (IOError, OSError):
+            pass
+
+    def record(s, qa, correct):
+        """Updates the score of qa after it was answered.
+        Question-answers that are not sampled among are ignored.
+        """
+        i = s.index.get(id(qa))
+        if i is None:
+            return
+        factor = RIGHT_FACTOR if correct else WRONG_FACTOR
+        s.scores[i] = min(max(s.scores[i] * factor, MIN_SCORE), MAX_SCORE)
+        s.last_seen[i] = time.time()
+        s.tree.set(i, float(compute_weights(s.scores[i], s.last_seen[i], s.last_seen[i])))
+
+    def sample(s, k):
+        """Returns k question-answers drawn without replacement, by weight.
+        """
+        return [s.qas[i] for i in s.tree.sample(k)]
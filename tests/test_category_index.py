@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+"""Lookups in a category_index.CategoryIndex must give the same
+categories as checking every name with fnmatch, or with 'in'.
+"""
+
+import random
+import unittest
+from fnmatch import fnmatchcase
+
+from category_index import CategoryIndex, RE_GLOB_SPECIAL
+
+WORDS = ['chemistry', 'physics', 'biology', 'history', 'algebra', 'geometry', 'art', 'Chem']
+QUERIES = ['chem', 'CHEM', 'chemistry bio', 'y 1', 'art', 'a', 'zzz', '',
+           'chem*', 'Chem*', '*bio* 1?', '*y', '?rt*', '[ab]*', '[!ab]*', '*[0-9][0-9]', 'bio*y*',
+           'history 1', 'history 1*']
+
+
+def make_names(n=500):
+    random.seed(1)
+    return ['{} {} {}'.format(random.choice(WORDS), random.choice(WORDS), i) for i in range(n)]
+
+def brute_force(names, query):
+    names = [name.lower() for name in names]
+    query = query.lower()
+    if RE_GLOB_SPECIAL.search(query):
+        return [i for i, name in enumerate(names) if fnmatchcase(name, query)]
+    return [i for i, name in enumerate(names) if query in name]
+
+
+class CategoryIndexTest(unittest.TestCase):
+
+    def setUp(s):
+        s.names = make_names()
+        s.index = CategoryIndex(s.names)
+
+    def test_search(s):
+        for query in QUERIES:
+            s.index.last_query = None
+            s.assertEqual(s.index.search(query), brute_force(s.names, query), query)
+
+    def test_search_after_other_queries(s):
+        # Results of earlier queries are reused only for queries extending them
+        for query in QUERIES + list(reversed(QUERIES)):
+            s.assertEqual(s.index.search(query), brute_force(s.names, query), query)
+
+    def test_typing(s):
+        query = ''
+        for c in 'chemistry bio':
+            query += c
+            s.assertEqual(s.index.substring(query), brute_force(s.names, query), query)
+
+    def test_prefix(s):
+        for text in ['chem', 'CHEMISTRY ', 'art art', 'b', 'zzz', '']:
+            s.assertEqual(s.index.prefix(text),
+                          [i for i, name in enumerate(s.names) if name.lower().startswith(text.lower())])
+
+    def test_glob(s):
+        for pattern in ['*', 'chem*', '*istry*', 'a?t*', '*[13]']:
+            s.assertEqual(s.index.glob(pattern), brute_force(s.names, pattern), pattern)
+
+    def test_newline(s):
+        s.assertEqual(s.index.substring('chem\nphys'), [])
+
+    def test_empty_index(s):
+        index = CategoryIndex([])
+        s.assertEqual(len(index), 0)
+        s.assertEqual(index.search('chem'), [])
+        s.assertEqual(index.search('chem*'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# encoding: utf-8
+
+"""Round trips through the columnar format (columnar.py) must give the
+same categories as parser.parse.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import columnar
+from check import find_quiz_files
+from examprepper import find_ep_file, is_ep_file
+from parser import open_quiz_file, parse
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+MAIN = u"""Basics
+?First question
+First answer
+?[flag.png]
+?Which flag?
+[answer.png][second.png]
+South Korea
+% a comment
+?Multi
+?line
+Answer with ünïcödé
+
+INCLUDE:chapters/chapter.ep
+
+After the include
+?Last
+Last answer
+"""
+
+CHAPTER = u"""Chapter
+?[sound.wav]
+?What bird?
+Mockingbird
+?Plain
+Plain answer
+"""
+
+NO_MEDIA = u"""Only text
+?One
+1
+?Two
+2
+"""
+
+NO_QUESTIONS = u"""Just a category
+
+% and a comment
+"""
+
+
+def summary(categories):
+    return [(cat.name, [(qa.question, qa.answer, list(qa.question_media or []),
+                         list(qa.answer_media or []), qa.line_number) for qa in cat])
+            for cat in categories]
+
+
+class ColumnarRoundTripTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def write(s, name, text):
+        path = os.path.join(s.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def round_trip(s, path):
+        target = os.path.join(s.directory, 'out.epc')
+        with open_quiz_file(path) as f:
+            columnar.export(f, target, source_path=path)
+        return target, columnar.load(target)
+
+    def assertRoundTrip(s, path):
+        target, loaded = s.round_trip(path)
+        s.assertEqual(summary(loaded), summary(parse(path)))
+        return target, loaded
+
+    def test_media_and_includes(s):
+        s.write('chapters/chapter.ep', CHAPTER)
+        target, loaded = s.assertRoundTrip(s.write('main.ep', MAIN))
+        names = [cat.name for cat in loaded]
+        s.assertEqual(names, ['Basics', 'Chapter', 'After the include'])
+        # Media of the included file are relative to its own folder
+        s.assertEqual(loaded[1][0].question_media,
+                      [os.path.join(s.directory, 'chapters', 'media', 'sound.wav')])
+        s.assertEqual(loaded[0][1].answer_media, ['answer.png', 'second.png'])
+
+    def test_examples(s):
+        for name in ['syntax_demo.ep', 'debug_quiz.ep']:
+            s.assertRoundTrip(os.path.join(EXAMPLES, name))
+
+    def test_empty_media_columns(s):
+        target, loaded = s.assertRoundTrip(s.write('text.ep', NO_MEDIA))
+        arrays = columnar.load_arrays(target)
+        s.assertEqual(len(arrays['media_text']), 0)
+        s.assertEqual(arrays['question_media_offsets'].tolist(), [0, 0, 0])
+
+    def test_no_questions(s):
+        target, loaded = s.assertRoundTrip(s.write('empty.ep', NO_QUESTIONS))
+        s.assertEqual(loaded, [])
+        arrays = columnar.load_arrays(target)
+        s.assertEqual(len(arrays['question_text']), 0)
+        s.assertEqual(len(arrays['line_numbers']), 0)
+
+    def test_export_categories(s):
+        categories = parse(os.path.join(EXAMPLES, 'syntax_demo.ep'))
+        target = os.path.join(s.directory, 'parsed.epc')
+        columnar.export_categories(categories, target)
+        s.assertEqual(summary(columnar.load(target)), summary(categories))
+
+    def test_not_a_text_quiz(s):
+        # convert.py turns quiz.ep.txt into quiz.ep.epc by default
+        source = s.write('quiz.ep.txt', NO_MEDIA)
+        target = os.path.join(s.directory, 'quiz.ep.epc')
+        with open_quiz_file(source) as f:
+            columnar.export(f, target, source_path=source)
+        s.assertFalse(is_ep_file('quiz.ep.epc'))
+        s.assertFalse(is_ep_file('quiz.epc'))
+        s.assertEqual(find_quiz_files(s.directory), [source])
+        # It is still found as a quiz to run, when it is the only one
+        os.remove(source)
+        s.assertEqual(find_ep_file(s.directory), target)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# encoding: utf-8
+
+"""Parses of quiz files are cached on disk by course.CourseLoader, so that
+a new process only parses the files that changed since the last run.
+"""
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha1
+
+import course
+from course import CourseLoader, cache_path, file_digest
+
+MAIN = u"""Introduction
+?[intro.png]
+?What is this course about?
+Quizzes
+
+INCLUDE:chapters/one.ep
+
+INCLUDE:chapters/two.ep.gz
+
+Summary
+?Last question
+Last ånswer
+"""
+
+ONE = u"""One
+?First
+1
+"""
+
+TWO = u"""Two
+?[two.png]
+?Second
+2
+"""
+
+
+def summary(categories):
+    return [(cat.name, cat.line_number, [(qa.question, qa.answer, list(qa.question_media or []),
+                                          list(qa.answer_media or []), qa.line_number) for qa in cat])
+            for cat in categories]
+
+
+class CourseCacheTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+        s.main = s.write('main.ep', MAIN)
+        s.one = s.write('chapters/one.ep', ONE)
+        s.two = os.path.join(s.directory, 'chapters', 'two.ep.gz')
+        with gzip.open(s.two, 'wb') as f:
+            f.write(TWO.encode('utf-8'))
+        # Counts the files parsed
+        s.parsed = []
+        s.parse_lines = course.parse_lines
+        def parse_lines(lines, *args, **kwargs):
+            s.parsed.append(os.path.basename(lines.name))
+            return s.parse_lines(lines, *args, **kwargs)
+        course.parse_lines = parse_lines
+
+    def tearDown(s):
+        course.parse_lines = s.parse_lines
+        shutil.rmtree(s.directory)
+
+    def write(s, name, text):
+        path = os.path.join(s.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def load(s, **kwargs):
+        """Loads the course like a new process would.
+        """
+        del s.parsed[:]
+        return summary(CourseLoader(**kwargs).load(s.main))
+
+    def test_new_process_reads_cache(s):
+        uncached = s.load(cache=False)
+        s.assertEqual(sorted(s.parsed), ['main.ep', 'one.ep', 'two.ep.gz'])
+        s.assertFalse(os.path.exists(cache_path(s.main)))
+
+        s.assertEqual(s.load(), uncached)
+        s.assertEqual(sorted(s.parsed), ['main.ep', 'one.ep', 'two.ep.gz'])
+        for path in [s.main, s.one, s.two]:
+            s.assertTrue(os.path.isfile(cache_path(path)))
+
+        s.assertEqual(s.load(), uncached)
+        s.assertEqual(s.parsed, [])
+        # Media of included files are resolved after reading them from the cache
+        s.assertEqual(uncached[2][2][0][2], [os.path.join(s.directory, 'chapters', 'media', 'two.png')])
+
+    def test_only_edited_file_is_parsed(s):
+        s.load()
+        s.write('chapters/one.ep', ONE + u"?Added\nanswer\n")
+        loaded = s.load()
+        s.assertEqual(s.parsed, ['one.ep'])
+        s.assertEqual([qa[0] for qa in loaded[1][2]], ['First', 'Added'])
+        s.assertEqual(s.load(), loaded)
+        s.assertEqual(s.parsed, [])
+
+    def test_cache_of_other_contents(s):
+        s.load()
+        # An edit that keeps size and time is still seen, by the digest
+        stat = os.stat(s.one)
+        s.write('chapters/one.ep', ONE.replace('1', '9'))
+        os.utime(s.one, (stat.st_atime, stat.st_mtime))
+        loaded = s.load()
+        s.assertEqual(s.parsed, ['one.ep'])
+        s.assertEqual(loaded[1][2][0][1], '9')
+
+    def test_broken_cache(s):
+        expected = s.load()
+        with open(cache_path(s.one), 'wb') as f:
+            f.write(b'not a cache')
+        s.assertEqual(s.load(), expected)
+        s.assertEqual(s.parsed, ['one.ep'])
+        s.assertEqual(s.load(), expected)
+        s.assertEqual(s.parsed, [])
+
+    def test_unique(s):
+        s.write('chapters/one.ep', ONE + u"\nOne again\n?First\n1\n")
+        uncached = s.load(unique=True, cache=False)
+        s.assertEqual([cat[0] for cat in uncached], ['Introduction', 'One', 'Two', 'Summary'])
+        s.load(unique=True)
+        s.assertEqual(s.load(unique=True), uncached)
+        s.assertEqual(s.parsed, [])
+
+    def test_file_digest(s):
+        with open(s.main, 'rb') as f:
+            expected = sha1(f.read()).hexdigest()
+        chunk_size = course.HASH_CHUNK_SIZE
+        course.HASH_CHUNK_SIZE = 7
+        try:
+            s.assertEqual(file_digest(s.main), expected)
+        finally:
+            course.HASH_CHUNK_SIZE = chunk_size
+
+
+if __name__ == '__main__':
+    unittest.main()
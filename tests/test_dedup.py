@@ -0,0 +1,114 @@
+# encoding: utf-8
+
+"""Duplicate detection (dedup.py) must find exact and near-duplicate
+question-answers, and keep the first of each in file order.
+"""
+
+import io
+import unittest
+
+import dedup
+from quiz_handler import Category, QuestionAnswer
+
+PARIS = 'What is the capital city of France and which river runs through the middle of it'
+PARIS_ANSWER = 'Paris is the capital and the Seine runs through it'
+MITOCHONDRIA = 'Which organelle of the eukaryotic cell is known for producing most of its chemical energy'
+MITOCHONDRIA_ANSWER = 'The mitochondria produce most of the energy as ATP'
+
+
+def qa(question, answer, line_number):
+    return QuestionAnswer(question, answer, line_number=line_number)
+
+def make_categories():
+    """Two categories with:
+    lines 1 and 30: exact duplicates
+    lines 2, 10 and 31: near-duplicates, differing in their last word
+    lines 3 and 11: unrelated to anything
+    """
+    geography = Category('Geography', [
+        qa(PARIS, PARIS_ANSWER, 1),
+        qa(MITOCHONDRIA, MITOCHONDRIA_ANSWER, 2),
+        qa('Name the longest river in Africa', 'The Nile', 3),
+    ])
+    biology = Category('Biology', [
+        qa(MITOCHONDRIA.replace('energy', 'power'), MITOCHONDRIA_ANSWER, 10),
+        qa('How many legs does a spider have', 'Eight', 11),
+    ])
+    repeated = Category('Repeated', [
+        qa(PARIS, PARIS_ANSWER, 30),
+        qa(MITOCHONDRIA, MITOCHONDRIA_ANSWER.replace('ATP', 'adenosine triphosphate'), 31),
+    ])
+    return [geography, biology, repeated]
+
+def lines(qas):
+    return [qa.line_number for qa in qas]
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+
+    def test_signature_is_stable(s):
+        a = dedup.NearDuplicateIndex()
+        b = dedup.NearDuplicateIndex()
+        s.assertEqual(a.signature(PARIS).tolist(), b.signature(PARIS).tolist())
+        # Case, punctuation and spacing are ignored
+        s.assertEqual(a.signature(PARIS).tolist(), a.signature(PARIS.upper() + ' ?!').tolist())
+
+    def test_similarity(s):
+        index = dedup.NearDuplicateIndex()
+        for text in [PARIS, PARIS, MITOCHONDRIA]:
+            index.add(qa(text, 'answer', None))
+        s.assertEqual(index.similarity(0, 1), 1.0)
+        s.assertLess(index.similarity(0, 2), 0.2)
+
+    def test_clusters(s):
+        index = dedup.build_index(make_categories())
+        clusters = [lines(index.items[i] for i in cluster) for cluster in index.clusters(0.6)]
+        s.assertEqual(clusters, [[1, 30], [2, 10, 31]])
+
+    def test_threshold(s):
+        index = dedup.build_index(make_categories())
+        clusters = [lines(index.items[i] for i in cluster) for cluster in index.clusters(1.0)]
+        s.assertEqual(clusters, [[1, 30]])
+
+    def test_empty(s):
+        index = dedup.NearDuplicateIndex()
+        s.assertEqual(len(index.candidate_pairs()), 0)
+        s.assertEqual(index.clusters(), [])
+
+
+class DuplicatesTest(unittest.TestCase):
+
+    def test_exact_duplicates(s):
+        groups = dedup.find_exact_duplicates(make_categories())
+        s.assertEqual([lines(group) for group in groups], [[1, 30]])
+
+    def test_collapse_keeps_first_in_file_order(s):
+        categories = make_categories()
+        collapsed = dedup.collapse_duplicates(categories, 0.6)
+        s.assertEqual([(cat.name, lines(cat)) for cat in collapsed],
+                      [('Geography', [1, 2, 3]), ('Biology', [11])])
+        # The categories given are left as they were
+        s.assertEqual([lines(cat) for cat in categories], [[1, 2, 3], [10, 11], [30, 31]])
+
+    def test_collapse_representative_from_later_category(s):
+        # The first of a cluster in file order is kept, whichever variant it is
+        categories = make_categories()[1:]
+        collapsed = dedup.collapse_duplicates(categories, 0.6)
+        s.assertEqual([(cat.name, lines(cat)) for cat in collapsed],
+                      [('Biology', [10, 11]), ('Repeated', [30])])
+        s.assertIs(collapsed[0][0], categories[0][0])
+
+    def test_report(s):
+        out = io.StringIO() if str is not bytes else io.BytesIO()
+        dedup.report(make_categories(), threshold=0.6, out=out)
+        text = out.getvalue()
+        s.assertIn('Exact duplicates: 1', text)
+        s.assertIn('lines 1, 30: ' + PARIS, text)
+        # The cluster of exact duplicates is not reported again as near-duplicates
+        s.assertIn('Near-duplicate clusters (similarity >= 0.6): 1', text)
+        s.assertIn('lines 2, 10, 31', text)
+        s.assertNotIn('lines 1, 30\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
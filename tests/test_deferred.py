@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+"""Categories read by deferred.DeferredSource must hold the same
+question-answers as those of parser.parse once loaded, and say how many
+they hold before that, also when duplicates are left out.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from deferred import DeferredSource
+from parser import parse
+
+MAIN = u"""First
+?q1
+a1
+
+?q2
+a2
+
+INCLUDE:sub/included.ep
+
+?q2
+a2
+
+Later
+?q3
+a3
+
+?q1
+a1
+
+All duplicates
+?q3
+a3
+"""
+
+INCLUDED = u"""%!escapes
+Included
+?q3
+a3
+
+?[x.png]
+?q4
+\\?a4
+
+?q2
+a2
+"""
+
+
+def summary(categories):
+    return [(cat.name, [(qa.question, qa.answer, list(qa.question_media or []),
+                         list(qa.answer_media or []), qa.line_number) for qa in cat])
+            for cat in categories]
+
+
+class DeferredSourceTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+        s.main = s.write('main.ep', MAIN)
+        s.write('sub/included.ep', INCLUDED)
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def write(s, name, text):
+        path = os.path.join(s.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def check(s, unique):
+        expected = parse(s.main, unique=unique)
+        source = DeferredSource(s.main, unique=unique)
+        s.assertEqual([cat.name for cat in source.categories], [cat.name for cat in expected])
+        s.assertEqual([len(cat) for cat in source.categories], [len(cat) for cat in expected])
+        # Loaded out of order, as chosen categories may be
+        for cat in reversed(source.categories):
+            cat.load()
+        s.assertEqual(summary(source.categories), summary(expected))
+        source.close()
+        return expected
+
+    def test_all(s):
+        categories = s.check(unique=False)
+        s.assertEqual([len(cat) for cat in categories], [2, 3, 1, 2, 1])
+
+    def test_unique(s):
+        categories = s.check(unique=True)
+        # Duplicates are those coming later in the course, whichever file they are in
+        s.assertEqual(summary(categories)[1][1][0][:2], ('q3', 'a3'))
+        s.assertEqual([cat.name for cat in categories], ['First', 'Included'])
+        s.assertEqual([len(cat) for cat in categories], [2, 2])
+
+    def test_escaped_answer(s):
+        categories = s.check(unique=False)
+        s.assertEqual(categories[1][1].answer, '?a4')
+        s.assertEqual(categories[1][1].question_media,
+                      [os.path.join(s.directory, 'sub', 'media', 'x.png')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# encoding: utf-8
+
+"""grading.edit_distances must give the Levenshtein distance of every
+pair, whatever their lengths and characters, and questions whose answers
+have no words must be left to the user to evaluate.
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+import grading
+from grading import Grader, edit_distances
+from interfaces.base_interface import QuizInterfaceBase
+from quiz_handler import Category, QuestionAnswer, QuizConductor
+
+
+def levenshtein(a, b):
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a):
+        previous, row = row, [i + 1]
+        for j, y in enumerate(b):
+            row.append(min(previous[j + 1] + 1, row[j] + 1, previous[j] + (x != y)))
+    return row[-1]
+
+
+class EditDistancesTest(unittest.TestCase):
+
+    def check(s, pairs):
+        a = [x for x, y in pairs]
+        b = [y for x, y in pairs]
+        s.assertEqual(edit_distances(a, b).tolist(), [levenshtein(x, y) for x, y in pairs])
+
+    def test_examples(s):
+        s.assertEqual(edit_distances([u'kitten', u'flaw'], [u'sitting', u'lawn']).tolist(), [3, 2])
+
+    def test_empty(s):
+        s.check([(u'', u''), (u'', u'abc'), (u'abc', u''), (u'a', u'a')])
+        s.assertEqual(edit_distances([], []).tolist(), [])
+
+    def test_non_ascii(s):
+        s.check([(u'naïve', u'naive'), (u'日本語', u'日本'), (u'ÅÄÖ', u'åäö'),
+                 (u'\U0001F600a', u'a'), (u'é', u'é')])
+
+    def test_unequal_lengths(s):
+        random.seed(2)
+        alphabet = u'abcé '
+        def text():
+            return u''.join(random.choice(alphabet) for _ in range(random.randint(0, 40)))
+        pairs = [(text(), text()) for _ in range(300)]
+        s.check(pairs)
+        # Also when batched in chunks of very different lengths
+        chunk_size = grading.CHUNK_SIZE
+        grading.CHUNK_SIZE = 7
+        try:
+            s.check(pairs)
+        finally:
+            grading.CHUNK_SIZE = chunk_size
+
+
+class ScriptedInterface(QuizInterfaceBase):
+    """Types the true answer for questions starting with 'right', and
+    something else for the rest. Records what was asked and graded.
+    """
+
+    def __init__(s):
+        s.shown = []
+        s.evaluated = []
+        s.graded = []
+
+    def show_current_info(s, qc):
+        pass
+
+    def show_question(s, qa):
+        s.shown.append(qa.question)
+        s.qa = qa
+
+    def prefetch(s, qas):
+        pass
+
+    def get_response(s):
+        if s.qa.question.startswith('right'):
+            return [s.qa.answer]
+        return ['something else entirely']
+
+    def show_answer(s, qa):
+        pass
+
+    def get_evaluation(s):
+        s.evaluated.append(s.qa.question)
+        return True
+
+    def show_grades(s, qas, correct, scores):
+        s.graded.append([(qa.question, ok) for qa, ok in zip(qas, correct)])
+
+    def end_of_quiz(s, qc, end_options):
+        return 0
+
+
+def make_categories():
+    return [Category('A', [QuestionAnswer('right 1', 'The mitochondria'),
+                           QuestionAnswer('wrong 1', 'Photosynthesis in plants'),
+                           QuestionAnswer('picture', '', answer_media=['rectifier.jpg'])]),
+            Category('B', [QuestionAnswer('right 2', 'Forty two'),
+                           QuestionAnswer('wrong 2', 'Seven')])]
+
+
+class GraderTest(unittest.TestCase):
+
+    def conductor(s, **presets):
+        qc = QuizConductor(make_categories(), presets=dict(order='no_random', category_indices=[0, 1], **presets))
+        qc.grader = Grader()
+        return qc
+
+    def test_no_words(s):
+        qas = make_categories()[0]
+        grader = Grader()
+        s.assertEqual([grader.gradable(qa) for qa in qas], [True, True, False])
+        scores = grader.scores(qas, ['The mitochondria', 'Photosynthesis', 'anything'])
+        s.assertEqual(scores[0], 1.0)
+        s.assertTrue(np.isnan(scores[2]))
+        s.assertEqual(grader.grade(qas, ['', '', '']).tolist(), [False, False, False])
+
+    def test_user_evaluates_without_words(s):
+        ui = ScriptedInterface()
+        s.conductor(repetition_lag=-1, max_reinsertions=1).run(ui)
+        # Wrong answers are asked again at the end of their category
+        s.assertEqual(ui.shown, ['right 1', 'wrong 1', 'picture', 'wrong 1', 'right 2', 'wrong 2', 'wrong 2'])
+        s.assertEqual(ui.evaluated, ['picture'])
+        s.assertEqual(ui.graded, [])
+
+    def test_grade_later(s):
+        ui = ScriptedInterface()
+        qc = s.conductor(repetition_lag=2, max_reinsertions=2)
+        qc.grade_later = True
+        qc.run(ui)
+        s.assertEqual(ui.evaluated, ['picture'])
+        # Graded together at the end of the round, and the wrong ones asked again,
+        # until they were reinserted too often
+        s.assertEqual(ui.graded, [[('right 1', True), ('wrong 1', False), ('right 2', True), ('wrong 2', False)],
+                                  [('wrong 1', False), ('wrong 2', False)],
+                                  [('wrong 1', False), ('wrong 2', False)]])
+        s.assertEqual(ui.shown, ['right 1', 'wrong 1', 'picture', 'right 2', 'wrong 2',
+                                 'wrong 1', 'wrong 2', 'wrong 1', 'wrong 2'])
+        s.assertEqual(qc.ungraded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+"""A CSV file turned into a quiz file by importer.write_ep must read back
+as the same question-answers as importer.load gives, whichever way the
+quiz file is read, also for fields that look like quiz file syntax.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import lazy
+from deferred import DeferredSource
+from importer import load, read_rows, write_ep
+from parser import parse
+
+HEADER = [u'category', u'question', u'answer', u'question_media', u'answer_media']
+
+ROWS = [
+    [u'Plain', u'What is this?', u'A test', u'', u''],
+    [u'Plain', u'?Starts with a question mark', u'?So does the answer', u'', u''],
+    [u'Plain', u'% Not a comment', u'%Neither is this', u'', u''],
+    [u'Plain', u'[not media]', u'[not media either] but text', u'', u''],
+    [u'Plain', u'INCLUDE:chapter.ep', u'INCLUDE:other.ep', u'', u''],
+    [u'Plain', u'\\frac{1}{2}', u'\\[ x \\]\n\\\\ two backslashes', u'', u''],
+    [u'Plain', u'Blank lines', u'First paragraph\n\nSecond paragraph\n\n\nThird', u'', u''],
+    [u'Plain', u'Windows\r\nline breaks', u'one\r\n\r\ntwo', u'', u''],
+    [u'Plain', u'  Indented', u'   \nOnly spaces above', u'', u''],
+    [u'Plain', u'With media', u'[x] after the media', u'q.png;r.png', u'a.wav'],
+    [u'Plain', u'Ünïcödé', u'日本語\n\nÅÄÖ', u'', u''],
+    [u'?Looks like a question', u'In a category starting with ?', u'a', u'', u''],
+    [u'%Looks like a comment', u'In a category starting with %', u'a', u'', u''],
+    [u'INCLUDE:looks.ep', u'In a category like an include', u'a', u'', u''],
+    [u'\\Backslash', u'In a category starting with a backslash', u'a', u'', u''],
+    [u'Plain', u'Back in a category seen before', u'a', u'', u''],
+]
+
+
+def csv_line(fields):
+    return u','.join(u'"' + field.replace(u'"', u'""') + u'"' for field in fields) + u'\r\n'
+
+def summary(categories):
+    return [(cat.name, [(qa.question, qa.answer, list(qa.question_media or []),
+                         list(qa.answer_media or [])) for qa in cat])
+            for cat in categories]
+
+def by_name(categories):
+    """Categories of the same name merged, as importer.load does.
+    """
+    merged = []
+    qas_of = dict()
+    for name, qas in summary(categories):
+        if name not in qas_of:
+            qas_of[name] = []
+            merged.append((name, qas_of[name]))
+        qas_of[name].extend(qas)
+    return merged
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+        s.csv = os.path.join(s.directory, 'deck.csv')
+        s.ep = os.path.join(s.directory, 'deck.ep')
+        with io.open(s.csv, 'w', encoding='utf-8', newline='') as f:
+            f.write(u''.join(csv_line(row) for row in [HEADER] + ROWS))
+        with io.open(s.ep, 'w', encoding='utf-8') as f:
+            s.assertEqual(write_ep(read_rows(s.csv), f), len(ROWS))
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def test_parse(s):
+        expected = summary(load(s.csv))
+        s.assertEqual(by_name(parse(s.ep)), expected)
+        s.assertEqual(expected[0][1][6][1], 'First paragraph\n\nSecond paragraph\n\n\nThird')
+        s.assertEqual(expected[0][1][9][2:], (['q.png', 'r.png'], ['a.wav']))
+
+    def test_lazy(s):
+        categories = parse(s.ep)
+        s.assertEqual(summary(lazy.load(s.ep)), summary(categories))
+        # Read from the saved index too
+        s.assertEqual(summary(lazy.load(s.ep)), summary(categories))
+
+    def test_deferred(s):
+        categories = parse(s.ep)
+        source = DeferredSource(s.ep)
+        s.assertEqual([len(cat) for cat in source.categories], [len(cat) for cat in categories])
+        for cat in source.categories:
+            cat.load()
+        s.assertEqual(summary(source.categories), summary(categories))
+        s.assertEqual([qa.line_number for cat in source.categories for qa in cat],
+                      [qa.line_number for cat in categories for qa in cat])
+
+
+if __name__ == '__main__':
+    unittest.main()
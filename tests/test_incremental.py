@@ -0,0 +1,170 @@
+# encoding: utf-8
+
+"""Changes to a watched quiz file (incremental.py) must be merged into
+a running quiz without losing its place, and a rerun with the same
+options must pick the same categories, wherever they moved to.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from incremental import IncrementalParser
+from quiz_handler import QuizConductor
+
+QUIZ = u"""A
+?q1
+a1
+
+?q2
+a2
+
+?q3
+a3
+
+B
+?q4
+a4
+
+?q5
+a5
+"""
+
+# q1 edited, q3 replaced by q2b after the current question,
+# and q6 added to the next category
+EDITED = u"""A
+?q1
+a1, edited
+
+?q2
+a2
+
+?q2b
+a2b
+
+B
+?q4
+a4
+
+?q5
+a5
+
+?q6
+a6
+"""
+
+# q1 removed, before the current question
+REMOVED = u"""A
+?q2
+a2
+
+?q3
+a3
+
+B
+?q4
+a4
+
+?q5
+a5
+"""
+
+PRESETS = dict(order='no_random', repetition_lag=-1)
+
+
+def names(qc):
+    return [cat.name for cat in qc.categories]
+
+
+class EndOfQuiz(object):
+    """Chooses 'rerun with same options' at the end of the quiz.
+    """
+
+    def end_of_quiz(s, qc, options):
+        return 2
+
+
+class IncrementalMergeTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+        s.path = os.path.join(s.directory, 'quiz.ep')
+        s.mtime = 1000000000
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def write(s, text):
+        with io.open(s.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # Every write is seen as a change, however quickly they follow
+        s.mtime += 10
+        os.utime(s.path, (s.mtime, s.mtime))
+
+    def start(s, text, presets):
+        s.write(text)
+        source = IncrementalParser(s.path)
+        qc = QuizConductor(source.categories, source=source)
+        qc.watch = True
+        qc.setup(None, dict(PRESETS, **presets))
+        qc.known_category_names = set(cat.name for cat in qc.base_categories)
+        qc.update()
+        return qc
+
+    def remaining(s, qc):
+        return [qa.question for qa in qc]
+
+    def test_edit_add_remove_around_current(s):
+        qc = s.start(QUIZ, dict(category_indices=[0, 1]))
+        first = next(qc)
+        current = next(qc)
+        s.assertEqual(current.question, 'q2')
+
+        s.write(EDITED)
+        qc.poll_source()
+        s.assertIs(qc.current_question, current)
+        s.assertEqual(qc.get_total_questions_done_count(), 1)
+        # The edit is made in place, so the question already asked sees it too
+        s.assertEqual(first.answer, 'a1, edited')
+        s.assertEqual(names(qc), ['A', 'B'])
+        s.assertEqual(s.remaining(qc), ['q2b', 'q4', 'q5', 'q6'])
+
+    def test_remove_before_current(s):
+        qc = s.start(QUIZ, dict(category_indices=[0, 1]))
+        next(qc)
+        current = next(qc)
+
+        s.write(REMOVED)
+        qc.poll_source()
+        s.assertIs(qc.get_current_question(), current)
+        s.assertEqual(qc.get_total_questions_done_count(), 0)
+        s.assertEqual(s.remaining(qc), ['q3', 'q4', 'q5'])
+
+    def test_unchanged_blocks_are_kept(s):
+        qc = s.start(QUIZ, dict(category_indices=[0, 1]))
+        before = dict((qa.question, qa) for cat in qc.base_categories for qa in cat)
+        s.write(EDITED)
+        changes = qc.source.reload()
+        after = dict((qa.question, qa) for cat in qc.source.categories for qa in cat)
+        # q2b took the place of q3, so it is matched up with it as an edit
+        s.assertEqual([qa.question for qa in changes.edited], ['q1', 'q2b'])
+        s.assertEqual(changes.removed, [])
+        s.assertEqual([(qa.question, name) for qa, name in changes.added], [('q6', 'B')])
+        s.assertIs(after['q2b'], before['q3'])
+        for question in ['q1', 'q2', 'q4', 'q5']:
+            s.assertIs(after[question], before[question])
+
+    def test_rerun_after_category_inserted(s):
+        qc = s.start(QUIZ, dict(category_indices=[1]))
+        s.assertEqual(names(qc), ['B'])
+        s.write(u"New\n?q0\na0\n\n" + QUIZ)
+        s.assertTrue(qc.handle_end(EndOfQuiz()))
+        qc.setup(None, qc.presets)
+        s.assertEqual(names(qc), ['B'])
+        s.assertEqual(s.remaining(qc), ['q4', 'q5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
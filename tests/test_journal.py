@@ -0,0 +1,135 @@
+# encoding: utf-8
+
+"""A session cut short must be resumed from its journal (journal.py)
+exactly where it stopped, with the categories chosen in any order,
+and with duplicates left out of the deferred categories.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from deferred import DeferredSource
+from interfaces.base_interface import QuizInterfaceBase
+from quiz_handler import QuizConductor
+
+QUIZ = u"""A
+?a1
+1
+
+?shared
+s
+
+?a2
+2
+
+B
+?b1
+1
+
+C
+?c1
+1
+
+?shared
+s
+
+?c2
+2
+
+?c3
+3
+"""
+
+PRESETS = dict(order='no_random', repetition_lag=2)
+
+
+class Crash(Exception):
+    pass
+
+
+class ScriptedInterface(QuizInterfaceBase):
+    """Chooses C, then A, answers every third question wrong, and
+    dies instead of evaluating the answer after crash_after answers.
+    """
+
+    def __init__(s, crash_after=None):
+        s.crash_after = crash_after
+        s.shown = []
+
+    def select_categories(s, categories):
+        return [categories[2], categories[0]]
+
+    def show_current_info(s, qc):
+        pass
+
+    def show_question(s, qa):
+        s.shown.append(qa.question)
+
+    def prefetch(s, qas):
+        pass
+
+    def get_response(s):
+        return ['response']
+
+    def show_answer(s, qa):
+        pass
+
+    def get_evaluation(s):
+        if len(s.shown) - 1 == s.crash_after:
+            raise Crash()
+        return len(s.shown) % 3 != 0
+
+    def end_of_quiz(s, qc, end_options):
+        return 0
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(s):
+        s.directory = tempfile.mkdtemp()
+        s.path = os.path.join(s.directory, 'quiz.ep')
+        with io.open(s.path, 'w', encoding='utf-8') as f:
+            f.write(QUIZ)
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def conductor(s):
+        source = DeferredSource(s.path, unique=True)
+        qc = QuizConductor(source.categories, presets=dict(PRESETS), source=source)
+        qc.journal_path = s.path + '.journal'
+        return qc
+
+    def test_resume(s):
+        ui = ScriptedInterface()
+        s.conductor().run(ui)
+        session = ui.shown
+        # C is asked first, and the shared question only in A, where it is first
+        s.assertEqual(session, ['c1', 'c2', 'c3', 'c3', 'a1', 'shared', 'a2', 'shared'])
+        s.assertFalse(os.path.exists(s.path + '.journal'))
+
+        for crash_after in [0, 3, len(session) - 1]:
+            ui = ScriptedInterface(crash_after)
+            s.assertRaises(Crash, s.conductor().run, ui)
+            s.assertTrue(os.path.exists(s.path + '.journal'))
+
+            qc = s.conductor()
+            s.assertTrue(qc.resume_session())
+            s.assertEqual([cat.name for cat in qc.selected_categories], ['C', 'A'])
+            ui = ScriptedInterface()
+            ui.shown = session[:crash_after]
+            qc.run(ui, resumed=True)
+            s.assertEqual(ui.shown, session, crash_after)
+
+    def test_changed_file(s):
+        s.assertRaises(Crash, s.conductor().run, ScriptedInterface(2))
+        with io.open(s.path, 'a', encoding='utf-8') as f:
+            f.write(u"\n?c4\n4\n")
+        s.assertFalse(s.conductor().resume_session())
+
+
+if __name__ == '__main__':
+    unittest.main()
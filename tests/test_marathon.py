@@ -0,0 +1,103 @@
+# encoding: utf-8
+
+"""Marathon mode must keep memory flat over thousands of rounds:
+reinserted copies are dropped between rounds, and rounds are run in
+a loop rather than by recursion.
+"""
+
+import random
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+
+from interfaces.base_interface import QuizInterfaceBase
+from quiz_handler import Category, QuestionAnswer, QuizConductor
+
+ROUNDS = 2000
+
+
+class ScriptedInterface(QuizInterfaceBase):
+    """Answers wrong at random, and reruns the quiz with the same
+    options until rounds is used up. Records the traced memory and
+    the length of the queue at the end of every round.
+    """
+
+    def __init__(s, rounds, wrong=0.3):
+        s.rounds = rounds
+        s.wrong = wrong
+        # Preallocated, so that recording does not show up as growth
+        s.memory = np.zeros(rounds, dtype=np.int64)
+        s.queue_lengths = np.zeros(rounds, dtype=np.int64)
+        s.round = 0
+
+    def show_current_info(s, qc):
+        pass
+
+    def show_question(s, qa):
+        pass
+
+    def get_response(s):
+        return ['response']
+
+    def show_answer(s, qa):
+        pass
+
+    def get_evaluation(s):
+        return random.random() >= s.wrong
+
+    def end_of_quiz(s, qc, end_options):
+        s.memory[s.round] = tracemalloc.get_traced_memory()[0]
+        s.queue_lengths[s.round] = qc.get_total_question_count()
+        s.round += 1
+        return 2 if s.round < s.rounds else 0
+
+
+def make_categories():
+    return [Category('c{}'.format(i), [QuestionAnswer('q{} {}'.format(i, j), 'a{}'.format(j))
+                                      for j in range(20)])
+            for i in range(5)]
+
+
+@unittest.skipIf(tracemalloc is None, "tracemalloc needs python 3")
+class MarathonMemoryTest(unittest.TestCase):
+
+    def setUp(s):
+        random.seed(0)
+        np.random.seed(0)
+        tracemalloc.start()
+
+    def tearDown(s):
+        tracemalloc.stop()
+
+    def run_quiz(s, rounds, marathon):
+        presets = dict(order='random_within_category', repetition_lag=3,
+                       category_indices=list(range(5)), marathon=marathon)
+        ui = ScriptedInterface(rounds)
+        QuizConductor(make_categories(), presets=presets).run(ui)
+        return ui
+
+    def test_memory_stays_flat(s):
+        ui = s.run_quiz(ROUNDS, marathon=True)
+        s.assertEqual(ui.round, ROUNDS)
+        # Every round starts from the same 100 questions, plus at most
+        # MARATHON_MAX_REINSERTIONS copies of each
+        s.assertLessEqual(max(ui.queue_lengths), 400)
+        # Allow for noise in the allocator, but not for growth with the rounds
+        early = max(ui.memory[100:200])
+        late = max(ui.memory[-100:])
+        s.assertLess(late - early, 16 * 1024)
+
+    def test_queue_grows_without_marathon(s):
+        # The measurement above would catch growth: without marathon mode,
+        # reinserted copies pile up from round to round
+        ui = s.run_quiz(4, marathon=False)
+        s.assertGreater(ui.queue_lengths[-1], 2 * ui.queue_lengths[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
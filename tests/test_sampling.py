@@ -0,0 +1,134 @@
+# encoding: utf-8
+
+"""The Fenwick tree of sampling.py must keep its prefix sums right as
+weights change, never draw questions of weight zero, and draw the rest
+in proportion to their weights.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from quiz_handler import Category, QuestionAnswer, QuizConductor
+from sampling import FenwickTree, QuestionWeights, WRONG_FACTOR
+
+
+def prefix_sums(weights):
+    return np.concatenate([[0.0], np.cumsum(weights)])
+
+
+class FenwickTreeTest(unittest.TestCase):
+
+    def setUp(s):
+        np.random.seed(0)
+
+    def assertPrefixSums(s, tree, weights):
+        expected = prefix_sums(weights)
+        for count in range(len(weights) + 1):
+            s.assertAlmostEqual(tree.prefix_sum(count), expected[count])
+        s.assertAlmostEqual(tree.total(), expected[-1])
+
+    def test_prefix_sums(s):
+        for n in [1, 2, 7, 8, 9, 100]:
+            weights = np.random.random(n)
+            s.assertPrefixSums(FenwickTree(weights), weights)
+
+    def test_prefix_sums_after_updates(s):
+        weights = np.random.random(37)
+        tree = FenwickTree(weights)
+        for _ in range(200):
+            i = np.random.randint(len(weights))
+            weights[i] = np.random.choice([0.0, np.random.random() * 10])
+            tree.set(i, weights[i])
+        s.assertPrefixSums(tree, weights)
+        s.assertEqual(tree.weights.tolist(), weights.tolist())
+
+    def test_find(s):
+        weights = np.array([1.0, 0.0, 2.0, 0.0, 0.0, 3.0, 0.5])
+        tree = FenwickTree(weights)
+        sums = prefix_sums(weights)
+        for value in np.linspace(0, sums[-1], 200, endpoint=False):
+            s.assertEqual(tree.find(value), np.searchsorted(sums, value, 'right') - 1)
+        # Rounding past the end lands on the last weight that is not zero
+        s.assertEqual(tree.find(sums[-1] + 1e-9), 6)
+
+    def test_zero_weights(s):
+        weights = np.array([0.0, 1.0, 0.0, 0.0, 2.0, 0.0])
+        tree = FenwickTree(weights)
+        for _ in range(100):
+            drawn = tree.sample(2)
+            s.assertEqual(sorted(drawn), [1, 4])
+        # No more are drawn than have a weight
+        s.assertEqual(sorted(tree.sample(5)), [1, 4])
+        s.assertEqual(FenwickTree(np.zeros(4)).sample(2), [])
+        s.assertEqual(FenwickTree([]).sample(2), [])
+        s.assertEqual(FenwickTree([]).total(), 0.0)
+
+    def test_sample_leaves_weights(s):
+        weights = np.random.random(20)
+        tree = FenwickTree(weights)
+        drawn = tree.sample(10)
+        s.assertEqual(len(set(drawn)), 10)
+        s.assertEqual(tree.weights.tolist(), weights.tolist())
+        s.assertPrefixSums(tree, weights)
+
+    def test_distribution(s):
+        weights = np.array([1.0, 2.0, 0.0, 3.0, 4.0])
+        tree = FenwickTree(weights)
+        n = 20000
+        counts = np.bincount([tree.sample(1)[0] for _ in range(n)], minlength=len(weights))
+        np.testing.assert_allclose(counts / float(n), weights / weights.sum(), atol=0.01)
+
+    def test_distribution_without_replacement(s):
+        # The second draw is among the rest, in proportion to their weights
+        weights = np.array([8.0, 1.0, 1.0])
+        tree = FenwickTree(weights)
+        n = 20000
+        second = np.bincount([tree.sample(2)[1] for _ in range(n)], minlength=len(weights))
+        # P(second = 0) = P(first is 1 or 2) * 8/9
+        # P(second = 1) = P(first = 0) * 1/2 + P(first = 2) * 1/9
+        expected = np.array([0.2 * 8 / 9.0, 0.8 / 2 + 0.1 / 9.0, 0.8 / 2 + 0.1 / 9.0])
+        np.testing.assert_allclose(second / float(n), expected, atol=0.01)
+
+
+class QuestionWeightsTest(unittest.TestCase):
+
+    def setUp(s):
+        np.random.seed(0)
+        s.directory = tempfile.mkdtemp()
+        s.qas = [QuestionAnswer('q{}'.format(i), 'a{}'.format(i)) for i in range(10)]
+
+    def tearDown(s):
+        shutil.rmtree(s.directory)
+
+    def test_record(s):
+        weights = QuestionWeights(s.qas)
+        weights.record(s.qas[3], False)
+        s.assertEqual(weights.scores[3], WRONG_FACTOR)
+        # Just answered, so the weight is not raised for its age
+        s.assertEqual(weights.tree.weights[3], WRONG_FACTOR)
+        s.assertAlmostEqual(weights.tree.total(), weights.tree.weights.sum())
+
+    def test_saved_scores(s):
+        path = os.path.join(s.directory, 'quiz.ep.weights')
+        weights = QuestionWeights(s.qas, path)
+        weights.record(s.qas[3], False)
+        weights.save()
+        # Matched up by fingerprint, in another order
+        reloaded = QuestionWeights(list(reversed(s.qas)), path)
+        s.assertEqual(reloaded.scores[6], WRONG_FACTOR)
+        s.assertEqual(reloaded.scores.sum(), 9 + WRONG_FACTOR)
+
+    def test_sample_more_than_there_are(s):
+        categories = [Category('c', s.qas[:4]), Category('d', s.qas[4:5])]
+        qc = QuizConductor(categories)
+        qc.setup(None, dict(order='no_random', repetition_lag=-1, category_indices=[0, 1], sample=50))
+        qc.update()
+        s.assertEqual([qa.question for qa in qc], ['q0', 'q1', 'q2', 'q3', 'q4'])
+
+
+if __name__ == '__main__':
+    unittest.main()